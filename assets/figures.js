@@ -0,0 +1,80 @@
+// Clientside callbacks loading pre-encoded figures from the /figures routes (serialization.py)
+(function () {
+    // The browser cache keeps the figure and revalidates it with its ETag, an unchanged figure costs a 304
+    function fetchFigure(url) {
+        return fetch(url, {credentials: "same-origin"}).then(function (response) {
+            if (!response.ok) {
+                return dash_clientside.no_update;
+            }
+            return response.json();
+        });
+    }
+
+    // The cross-filter selection as the last part of a figure URL, crossfilter.parse reads it back
+    function selectionPath(selection) {
+        return encodeURIComponent(JSON.stringify(selection));
+    }
+
+    // The All Sports figure skeleton, fetched again only when a sport update names another one
+    let skeleton = {etag: null, figure: null};
+
+    function sportSkeleton(etag) {
+        if (skeleton.etag !== etag) {
+            skeleton = {etag: etag, figure: fetchFigure("figures/sport-skeleton/" + encodeURIComponent(etag)).then(function (figure) {
+                // Asked for again with the next sport when it couldn't be fetched
+                if (figure === dash_clientside.no_update) {
+                    skeleton = {etag: null, figure: null};
+                }
+                return figure;
+            })};
+        }
+        return skeleton.figure;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        figures: {
+            // Graphs of the Start, Norway and Sport Selection tabs, called once when a graph is added to the page
+            static: function (id) {
+                return fetchFigure("figures/static/" + encodeURIComponent(id.name));
+            },
+
+            // Graphs of the Countries tab, their names are <noc>/<graph>
+            country: function (id) {
+                return fetchFigure("figures/country/" + id.name.split("/").map(encodeURIComponent).join("/"));
+            },
+
+            // Linked graphs of the Start tab, drawn from the rows of the cross-filter selection when there is one
+            linked: function (id, selection) {
+                if (!selection || Object.keys(selection).length === 0) {
+                    return fetchFigure("figures/static/" + encodeURIComponent(id.name));
+                }
+                return fetchFigure("figures/linked/" + encodeURIComponent(id.name) + "/" + selectionPath(selection));
+            },
+
+            // The All Sports figure of the selected sport, options are loaded when the tab is opened. Only the update of
+            // the sport is fetched, the skeleton it is drawn on once per skeleton ETag (sport_store.py)
+            sport: function (sport, options, selection) {
+                if (!sport || !options || options.length === 0) {
+                    return dash_clientside.no_update;
+                }
+
+                let url = "figures/sport/" + encodeURIComponent(sport);
+                if (selection && Object.keys(selection).length > 0) {
+                    url += "/" + selectionPath(selection);
+                }
+
+                return fetchFigure(url).then(function (update) {
+                    if (update === dash_clientside.no_update) {
+                        return update;
+                    }
+                    return sportSkeleton(update.skeleton).then(function (skeleton) {
+                        if (skeleton === dash_clientside.no_update) {
+                            return skeleton;
+                        }
+                        return dash_clientside.sports.apply(skeleton, update);
+                    });
+                });
+            },
+        },
+    });
+})();
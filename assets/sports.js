@@ -0,0 +1,46 @@
+// Clientside callbacks for the All Sports tab, Dash loads every file in assets/ automatically
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    sports: {
+        // Selects the previous or next sport in the dropdown without a round trip to the server
+        navigate: function (leftClicks, rightClicks, currentValue, options) {
+            const buttonId = dash_clientside.callback_context.triggered_id;
+            if (!buttonId || !options || options.length === 0) {
+                return currentValue;
+            }
+
+            const values = options.map(function (option) { return option.value; });
+            const currentIndex = values.indexOf(currentValue);
+            const step = buttonId === "dropdown-sports-left-btn" ? -1 : 1;
+
+            return values[(currentIndex + step + values.length) % values.length];
+        },
+
+        // The All Sports figure of a sport update (sport_store.sport_update) drawn on the figure skeleton, like
+        // sport_store.apply_update. Returns a new figure, the skeleton is left as it is for the next sport
+        apply: function (skeleton, update) {
+            function merge(target, values) {
+                const merged = Object.assign({}, target);
+                Object.keys(values).forEach(function (key) {
+                    const value = values[key];
+                    const isObject = value !== null && typeof value === "object" && !Array.isArray(value);
+                    merged[key] = isObject ? merge(target[key] || {}, value) : value;
+                });
+                return merged;
+            }
+
+            return {
+                data: skeleton.data.map(function (trace, i) { return merge(trace, update.traces[i] || {}); }),
+                layout: merge(skeleton.layout, {title: {text: update.title}}),
+            };
+        },
+
+        // Draws the "All Sports" figure from the skeleton and sport updates in the sport-data-store
+        render: function (sport, sportData) {
+            if (!sportData || !sportData.sports[sport]) {
+                return dash_clientside.no_update;
+            }
+
+            return dash_clientside.sports.apply(sportData.skeleton, sportData.sports[sport]);
+        },
+    },
+});
@@ -0,0 +1,160 @@
+import hashlib as hl
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+
+CACHE_FORMAT_VERSION = 2
+
+# Text columns stored as integer codes into a file of sorted labels, loaded as pandas categoricals.
+# Hash repeats for every entry of an athlete, so it is coded too
+CATEGORICAL_COLUMNS = ["Sex", "Team", "NOC", "Games", "Season", "City", "Sport", "Event", "Medal", "Hash"]
+
+
+def cache_dir_for(file_path):
+    '''
+    returns the cache directory used for the passed csv file
+    '''
+    directory, file_name = os.path.split(os.path.abspath(file_path))
+    return os.path.join(directory, ".athlete_cache", os.path.splitext(file_name)[0])
+
+
+def file_content_hash(file_path, chunk_size=1 << 20):
+    sha = hl.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def source_fingerprint(file_path):
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_manifest(file_path):
+    manifest_path = os.path.join(cache_dir_for(file_path), "manifest.json")
+    try:
+        with open(manifest_path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def is_cache_valid(file_path, manifest=None):
+    '''
+    checks the cache manifest against the csv file.
+    size and mtime are compared first, the content hash is only computed
+    when the file has been touched but kept its size
+    '''
+    manifest = manifest if manifest is not None else read_manifest(file_path)
+    if manifest is None or manifest.get("format_version") != CACHE_FORMAT_VERSION:
+        return False
+
+    source = manifest["source"]
+    fingerprint = source_fingerprint(file_path)
+    if fingerprint["size"] != source["size"]:
+        return False
+    if fingerprint["mtime_ns"] == source["mtime_ns"]:
+        return True
+
+    if file_content_hash(file_path) != source["sha256"]:
+        return False
+
+    # Same content with a new mtime (e.g. a fresh checkout), remember the new mtime so the hash isn't computed again
+    manifest["source"]["mtime_ns"] = fingerprint["mtime_ns"]
+    _write_json(os.path.join(cache_dir_for(file_path), "manifest.json"), manifest)
+    return True
+
+
+def write_cache(df: pd.DataFrame, file_path):
+    '''
+    writes one .npy file per column of df and a manifest describing them.
+    the cache is built in a temporary directory and swapped in when complete
+    '''
+    cache_dir = cache_dir_for(file_path)
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for position, column in enumerate(df.columns):
+        values = df[column]
+        entry = {"name": column, "file": f"{position:02d}.npy"}
+
+        if column in CATEGORICAL_COLUMNS:
+            categorical = values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype("category")
+            array = categorical.cat.codes.to_numpy().astype(np.int32)
+            entry.update(kind="categorical", categories_file=f"{position:02d}.categories.npy")
+            np.save(os.path.join(tmp_dir, entry["categories_file"]), _encode_strings(categorical.cat.categories))
+        elif values.dtype == object:
+            array = _encode_strings(values)
+            entry.update(kind="string")
+        else:
+            array = values.to_numpy()
+            entry.update(kind="numeric")
+
+        entry["dtype"] = str(array.dtype)
+        np.save(os.path.join(tmp_dir, entry["file"]), array)
+        columns.append(entry)
+
+    manifest = {
+        "format_version": CACHE_FORMAT_VERSION,
+        "source": {**source_fingerprint(file_path), "sha256": file_content_hash(file_path)},
+        "rows": len(df),
+        "columns": columns,
+    }
+    _write_json(os.path.join(tmp_dir, "manifest.json"), manifest)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+
+    return manifest
+
+
+def load_cache(file_path, validate=True):
+    '''
+    returns the cached frame for the csv file or None if there is no valid cache.
+    numeric columns are memory-mapped and used without copying, categorical columns are built from their codes
+    '''
+    manifest = read_manifest(file_path)
+    if manifest is None or (validate and not is_cache_valid(file_path, manifest)):
+        return None
+
+    cache_dir = cache_dir_for(file_path)
+    data = {}
+    for entry in manifest["columns"]:
+        # np.asarray keeps the mapping but hands pandas a plain ndarray instead of a np.memmap
+        array = np.asarray(np.load(os.path.join(cache_dir, entry["file"]), mmap_mode="r"))
+
+        if entry["kind"] == "categorical":
+            categories = np.char.decode(np.load(os.path.join(cache_dir, entry["categories_file"])), "utf-8").astype(object)
+            data[entry["name"]] = pd.Categorical.from_codes(array, pd.Index(categories, dtype=object))
+        elif entry["kind"] == "string":
+            data[entry["name"]] = np.char.decode(array, "utf-8").astype(object)
+        else:
+            data[entry["name"]] = array
+
+    return pd.DataFrame(data, copy=False)
+
+
+def _encode_strings(values):
+    encoded = [value.encode("utf-8") for value in values]
+    return np.array(encoded, dtype=f"S{max(map(len, encoded), default=1) or 1}")
+
+
+def _write_json(path, content):
+    with open(path, "w") as file:
+        json.dump(content, file)
+
+
+if __name__ == "__main__":
+    import sys
+    from data_utils import rebuild_athlete_cache
+
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else "athlete_events.csv"
+    manifest = rebuild_athlete_cache(csv_path)
+    print(f"Rebuilt cache for {csv_path} ({manifest['rows']} rows) in {cache_dir_for(csv_path)}")
@@ -0,0 +1,106 @@
+'''
+Normalized layout of the athlete frame, built next to it by the loader (dataset.model()).
+
+    athletes         one row per athlete ID: ID, Hash, Sex, Height, Weight
+    games            one row per Games: Games, Year, Season, City
+    events           one row per event: Sport, Event
+    participations   one row per row of the frame: athlete, games and event keys, NOC, Team, Age and Medal
+
+Keys are int32 positions into their table, tables are sorted by their natural key. The frame repeats the athlete
+columns on every row, the figures used to undo that with drop_duplicates. The first row of every athlete per view
+(VIEWS) is looked up once here instead and kept as an array of frame row positions.
+'''
+import numpy as np
+import pandas as pd
+
+ATHLETE_COLUMNS = ["ID", "Hash", "Sex", "Height", "Weight"]
+GAMES_COLUMNS = ["Games", "Year", "Season", "City"]
+EVENT_COLUMNS = ["Sport", "Event"]
+PARTICIPATION_COLUMNS = ["NOC", "Team", "Age", "Medal"]
+
+# Unique athlete views: the columns a view keeps one row of every athlete per, and the keys the athlete is told apart by
+VIEWS = {
+    # Every athlete once (medal_distribution_by_country)
+    "athlete": ([], "athlete"),
+    # Once per sport and Games (the distribution charts of the Sport Selection tab)
+    "sport_games": (["Sport", "games"], "athlete"),
+    # Once per country and Games (norwegian_participants_sex)
+    "noc_games": (["NOC", "games"], "athlete"),
+    # Once per country and Games by name, athletes sharing a name count once (norwegian_sex_age_distribution)
+    "noc_games_name": (["NOC", "games"], "name"),
+}
+
+
+def _codes(values: pd.Series) -> np.ndarray:
+    # Codes from 0, missing values are a group of their own like in drop_duplicates
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy().astype(np.int64) + 1
+    return pd.factorize(values, sort=True, use_na_sentinel=False)[0].astype(np.int64)
+
+
+def _first_positions(key_columns) -> np.ndarray:
+    # Positions of the first row of every key combination, in row order. The keys are folded into one integer per row
+    combined = np.zeros(len(key_columns[0]), dtype=np.int64)
+    for codes in key_columns:
+        combined = combined * (int(codes.max(initial=0)) + 1) + codes
+
+    _, first = np.unique(combined, return_index=True)
+    return np.sort(first)
+
+
+def _table(df: pd.DataFrame, columns, key_codes) -> pd.DataFrame:
+    # One row per key, with the column values of its first row in the frame
+    _, first = np.unique(key_codes, return_index=True)
+    return df[columns].take(first).reset_index(drop=True)
+
+
+class AthleteModel:
+    '''
+    the tables and unique athlete views of an athlete frame, see the module docstring.
+    Sex, Height and Weight are athlete columns, they are taken from the first row of every ID
+    '''
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.rows = len(df)
+
+        athlete_keys = pd.factorize(df["ID"], sort=True)[0].astype(np.int32)
+        games_keys = pd.factorize(df["Games"], sort=True)[0].astype(np.int32)
+        event_codes = _codes(df["Sport"]) * (int(_codes(df["Event"]).max(initial=0)) + 1) + _codes(df["Event"])
+        event_keys = pd.factorize(event_codes, sort=True)[0].astype(np.int32)
+
+        self.athletes = _table(df, ATHLETE_COLUMNS, athlete_keys)
+        self.games = _table(df, GAMES_COLUMNS, games_keys)
+        self.events = _table(df, EVENT_COLUMNS, event_keys)
+        self.participations = pd.DataFrame(
+            {"athlete": athlete_keys, "games": games_keys, "event": event_keys} | {column: df[column] for column in PARTICIPATION_COLUMNS},
+            copy=False,
+        )
+
+        keys = {
+            "athlete": athlete_keys.astype(np.int64),
+            "name": _codes(df["Hash"]),
+            "games": games_keys.astype(np.int64),
+            "Sport": _codes(df["Sport"]),
+            "NOC": _codes(df["NOC"]),
+        }
+        # Frame row positions of the first row of every athlete per view
+        self.views = {
+            view: _first_positions([keys[column] for column in columns] + [keys[athlete]])
+            for view, (columns, athlete) in VIEWS.items()
+        }
+
+
+    def unique_positions(self, view) -> np.ndarray:
+        '''
+        returns the ascending frame row positions of the first row of every athlete in view (VIEWS)
+        '''
+        if view not in self.views:
+            raise ValueError(f"unknown unique athlete view {view!r}, expected one of {list(VIEWS)}")
+        return self.views[view]
+
+
+    def memory_usage(self) -> int:
+        '''
+        returns the bytes held by the tables and views, the participation columns shared with the frame included
+        '''
+        tables = [self.athletes, self.games, self.events, self.participations]
+        return sum(int(table.memory_usage(deep=True).sum()) for table in tables) + sum(view.nbytes for view in self.views.values())
@@ -0,0 +1,187 @@
+'''
+Runs heavy figure callbacks as Dash background callbacks, outside of the web server's threads.
+
+Jobs wait in a queue in a diskcache directory shared by every gunicorn worker and are built by a fixed pool of
+config.BACKGROUND_WORKERS processes, forked from the server the first time a job is queued (so they share the loaded
+data set). A job asked for again while it waits or builds is shared instead of queued twice, and results are cached
+by the callback's arguments and the data set version.
+
+JobManager overrides methods of dash.DiskcacheManager that aren't public API, Dash is pinned to the minor version they
+were written for in requirements.txt and tests/test_background.py runs them through the installed Dash.
+'''
+import os
+import time
+import dash
+import dataset
+
+try:
+    # DiskcacheManager also needs psutil and multiprocess, installed with dash[diskcache]
+    import diskcache
+    from multiprocess import Process
+except ImportError:
+    diskcache = None
+
+# Seconds an idle pool worker sleeps between looking for a queued job
+QUEUE_POLL_INTERVAL = 0.1
+
+# Prefix of the queued jobs in the diskcache
+QUEUE = "queue"
+
+
+class JobManager(dash.DiskcacheManager):
+    '''
+    DiskcacheManager building the queued jobs in a pool of worker processes and sharing jobs between callers with the
+    same cache key. Job ids are numbers counted in the cache, not process ids
+    '''
+    def __init__(self, cache, workers, expire=None) -> None:
+        # Results of an older data set version are never looked up again and expire
+        super().__init__(cache, cache_by=[dataset.version], expire=expire)
+        self.workers = workers
+
+
+    def make_job_fn(self, fn, progress, key=None):
+        job_fn = super().make_job_fn(fn, progress, key)
+        # Queued jobs name their function by its registry key, the pool worker forked from the server has the same registry
+        job_fn.registry_key = key
+        return job_fn
+
+
+    def call_job_fn(self, key, job_fn, args, context):
+        with self.handle.transact():
+            job = self.handle.get(("job", key))
+            if job is not None and self.job_running(job):
+                self.handle.incr(("waiters", job))
+                return job
+
+            job = self.handle.incr("job_id")
+            # A result already cached is read by the first poll, the job never runs
+            if not self.result_ready(key):
+                self.handle.set(("job", key), job, expire=self.expire)
+                self.handle.set(("key", job), key, expire=self.expire)
+                self.handle.set(("waiters", job), 1, expire=self.expire)
+                # Progress of an earlier, cancelled job of the same key
+                self.handle.delete(self._make_progress_key(key))
+                self.handle.push((job, key, job_fn.registry_key, args, dict(context), dataset.version()), prefix=QUEUE, expire=self.expire)
+
+        self._start_workers()
+        return job
+
+
+    def job_running(self, job):
+        '''
+        True while job waits in the queue or a pool worker builds it, False once it finished, was dropped or its worker died
+        '''
+        if job is None:
+            return False
+
+        job = int(job)
+        key = self.handle.get(("key", job))
+        if key is None or self.handle.get(("job", key)) != job:
+            return False
+
+        worker = self.handle.get(("worker", job))
+        if worker is None:
+            # Still queued, a worker that died since it was queued is replaced so the job is built
+            self._start_workers()
+            return True
+
+        return super().job_running(worker)
+
+
+    def terminate_job(self, job):
+        '''
+        drops a caller of job (it was cancelled, replaced by a newer one or its result was read), the job is only
+        taken out of the queue or its worker killed when no one else waits for it
+        '''
+        if job is None:
+            return
+
+        job = int(job)
+        with self.handle.transact():
+            key = self.handle.get(("key", job))
+            # Finished jobs only have their bookkeeping left, that expires
+            if key is None or self.handle.get(("job", key)) != job or self.result_ready(key):
+                return
+            if self.handle.decr(("waiters", job), default=1) > 0:
+                return
+
+            # A queued job is skipped by the worker pulling it
+            self.handle.delete(("job", key))
+            worker = self.handle.get(("worker", job))
+
+        # The pool starts a new worker in place of the killed one with the next job
+        if worker is not None:
+            super().terminate_job(worker)
+
+
+    def get_progress(self, key):
+        # Every caller sharing the job polls its progress, it is kept until the result is read
+        return self.handle.get(self._make_progress_key(key))
+
+
+    def _start_workers(self):
+        # A slot holds the pid of its worker until that process has exited, so a killed or crashed worker is replaced
+        with self.handle.transact():
+            empty = []
+            for slot in range(self.workers):
+                holder = self.handle.get(("slot", slot))
+                if holder is None or not super().job_running(holder):
+                    # Taken by this process until the worker is started, outside the transaction the forked process would inherit
+                    self.handle.set(("slot", slot), os.getpid())
+                    self.handle.delete(("building", slot))
+                    empty.append(slot)
+
+        for slot in empty:
+            process = Process(target=self._work, args=(slot,), daemon=True)
+            process.start()
+            self.handle.set(("slot", slot), process.pid)
+
+
+    def _work(self, slot):
+        # The loop of a pool worker, builds the queued jobs one after another
+        while True:
+            with self.handle.transact():
+                _, item = self.handle.pull(prefix=QUEUE)
+                if item is None:
+                    job = None
+                else:
+                    job, key, registry_key, args, context, version = item
+                    if self.handle.get(("job", key)) != job:
+                        # Dropped by every caller while it waited
+                        continue
+                    if version > dataset.version():
+                        # Queued for data appended after this worker was forked, a new worker forked from the server builds it
+                        self.handle.push(item, prefix=QUEUE, side="front", expire=self.expire)
+                        return
+                    self.handle.set(("worker", job), os.getpid(), expire=self.expire)
+                    self.handle.set(("building", slot), job)
+
+            if job is None:
+                time.sleep(QUEUE_POLL_INTERVAL)
+                continue
+
+            self.func_registry[registry_key](key, self._make_progress_key(key), args, context)
+
+            with self.handle.transact():
+                self.handle.delete(("building", slot))
+                if self.handle.get(("job", key)) == job:
+                    self.handle.delete(("job", key))
+
+
+    def stats(self):
+        running = 0
+        for slot in range(self.workers):
+            holder = self.handle.get(("slot", slot))
+            if holder is not None and self.handle.get(("building", slot)) is not None and super().job_running(holder):
+                running += 1
+        return {"running": running, "workers": self.workers}
+
+
+def make_manager(directory, workers, expire=None):
+    '''
+    returns a JobManager storing its jobs and results in directory, None when diskcache isn't installed
+    '''
+    if diskcache is None:
+        return None
+
+    return JobManager(diskcache.Cache(directory), workers, expire=expire)
@@ -0,0 +1,154 @@
+'''
+Parity check and benchmark of the cross-filtered charts (crossfilter.py) on synthetic data.
+
+    python -m benchmarks.crossfilter --scales 1 10
+
+Run from the repository root. Every linked chart is drawn for a set of selections twice: from the bitmap indexes
+(crossfilter.py) and from a boolean mask over the whole frame, aggregated by graph_module like the unfiltered charts.
+The figures must be identical or the exit code is 1. The aggregate columns time the row selection and counts of the
+charts without drawing them. Times are the fastest of --repeat runs.
+'''
+import argparse
+import sys
+import time
+import pandas as pd
+import plotly.io as pio
+
+import crossfilter
+import data_utils
+import dataset
+import graph_module as gm
+import query_backend as qb
+import sport_store
+from benchmarks import synthetic
+
+SPORT = "Athletics"
+
+# Selections a user gets to by clicking the linked charts, from a single bar to one of every column
+SELECTIONS = [
+    {},
+    {"NOC": ["NOR"]},
+    {"Sex": ["F"]},
+    {"Games": ["1992 Summer", "1994 Winter"]},
+    {"NOC": ["NOR", "SWE", "USA"], "Sex": ["F"]},
+    {"Season": ["Winter"], "Medal": ["Gold"]},
+    {"NOC": ["USA"], "Games": ["1996 Summer"], "Sex": ["M"], "Season": ["Summer"], "Medal": ["Gold", "Silver"]},
+]
+
+
+def select(selection):
+    # The rows of the selection picked by a boolean mask over the frame
+    df = dataset.athletes()
+    mask = pd.Series(True, index=df.index)
+    for column, values in selection.items():
+        mask &= df[column].isin(values)
+
+    return df[mask]
+
+
+def masked(selection):
+    # The figures aggregated from the masked rows like without cross-filtering
+    df_selected = select(selection)
+    df_sport = df_selected[df_selected["Sport"] == SPORT]
+
+    return {
+        "most-medals-by-country": gm.most_medals_by_country(df_selected),
+        "gender-distribution": gm.gender_distribution(df_selected),
+        "gender-distribution-by-games": gm.gender_distribution_by_games(df_selected),
+        "sport": sport_store.sport_update(SPORT, df_sport),
+    }
+
+
+def bitmapped(selection):
+    figures = {graph_id: crossfilter.linked_figure(graph_id, selection) for graph_id in crossfilter.LINKED_GRAPHS}
+    figures["sport"] = crossfilter.sport_update(SPORT, selection)
+
+    return figures
+
+
+def aggregate_masked(selection):
+    # Only the aggregations of the linked charts, without drawing them
+    df_selected = select(selection)
+    return qb.count(df_selected, "Sex"), qb.count(df_selected, ["Games", "Sex"]), data_utils.medal_cube(df_selected)
+
+
+def aggregate_bitmapped(selection):
+    bitmaps = dataset.bitmaps()
+    bitmap = bitmaps.bitmap(selection)
+    return bitmaps.count(bitmap, "Sex"), bitmaps.count_pairs(bitmap, "Games", "Sex"), dataset.select_medal_cube(selection)
+
+
+def fastest(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def run_scale(scale, repeat=3):
+    '''
+    returns the times of every selection by method and the selections whose figures differ
+    '''
+    dataset.DATA_FILE = synthetic.ensure_csv(scale)
+    dataset.clear()
+    dataset.athletes()
+
+    start = time.perf_counter()
+    dataset.bitmaps()
+    dataset.select_medal_cube({})
+    print(f"{scale:g}x, bitmap indexes built in {time.perf_counter() - start:.2f} s")
+
+    times = {}
+    mismatches = []
+    for selection in SELECTIONS:
+        name = crossfilter.token(selection)
+        mask_seconds, expected = fastest(lambda: masked(selection), repeat)
+        bitmap_seconds, figures = fastest(lambda: bitmapped(selection), repeat)
+        aggregate_mask_seconds, _ = fastest(lambda: aggregate_masked(selection), repeat)
+        aggregate_bitmap_seconds, _ = fastest(lambda: aggregate_bitmapped(selection), repeat)
+        times[name] = {
+            "mask": mask_seconds, "bitmap": bitmap_seconds,
+            "aggregate_mask": aggregate_mask_seconds, "aggregate_bitmap": aggregate_bitmap_seconds,
+        }
+
+        for graph_id, figure in figures.items():
+            # The sport entry is a figure update, not a figure
+            if pio.to_json(figure, validate=False) != pio.to_json(expected[graph_id], validate=False):
+                mismatches.append(f"{scale:g}x {name} {graph_id}")
+
+    times = pd.DataFrame(times).T
+    times["speedup"] = times["mask"] / times["bitmap"]
+    times["aggregate_speedup"] = times["aggregate_mask"] / times["aggregate_bitmap"]
+
+    return times, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the cross-filtered charts drawn from bitmap indexes with masks over the frame")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1], help="data sizes relative to athlete_events.csv, e.g. 1 10")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per selection, the fastest is kept")
+    args = parser.parse_args(argv)
+
+    found = []
+    with pd.option_context("display.width", 200, "display.max_colwidth", 120, "display.float_format", "{:.4f}".format):
+        for scale in args.scales:
+            times, mismatches = run_scale(scale, args.repeat)
+            print("seconds to draw (and only aggregate) every linked chart")
+            print(times.to_string())
+            print()
+            found.extend(mismatches)
+
+    for mismatch in found:
+        print("MISMATCH", mismatch)
+    if found:
+        return 1
+
+    print("Bitmap and mask figures agree")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+'''
+Draws the figure builders on inputs the real data only has for some countries and sports: no rows at all, no ages of
+one sex and no ages at all.
+
+    python -m benchmarks.edge_cases
+
+Run from the repository root. Every builder must draw a figure, the exit code is 1 if one of them raises.
+'''
+import sys
+import traceback
+import numpy as np
+
+import data_utils
+import dataset
+import graph_module as gm
+from benchmarks import synthetic
+
+SPORTS = ["Gymnastics", "Shooting", "Speed Skating", "Archery"]
+
+
+def inputs():
+    '''
+    returns name -> frame of every edge case, all cut from the rows of one country
+    '''
+    nor = dataset.nor_athletes()
+
+    no_female_ages = nor.copy()
+    no_female_ages.loc[no_female_ages["Sex"] == "F", "Age"] = np.nan
+
+    no_ages = nor.copy()
+    no_ages["Age"] = np.nan
+
+    return {"no rows": nor.iloc[:0], "no female ages": no_female_ages, "no ages": no_ages}
+
+
+def cases(df):
+    return {
+        "box_statistics": lambda: data_utils.box_statistics(df, "Sport", "Age"),
+        "age_by_gender_by_year": lambda: gm.age_by_gender_by_year(df),
+        "norwegian_sex_age_distribution": lambda: gm.norwegian_sex_age_distribution(df),
+        "age_distribution_by_sports": lambda: gm.age_distribution_by_sports(df, SPORTS),
+        "bmi_distribution_by_sports_medalists": lambda: gm.bmi_distribution_by_sports_medalists(df, SPORTS),
+    }
+
+
+def main(argv=None):
+    dataset.DATA_FILE = synthetic.ensure_csv(1)
+    dataset.clear()
+
+    failed = []
+    for input_name, df in inputs().items():
+        for name, function in cases(df).items():
+            try:
+                function()
+            except Exception:
+                failed.append(f"{name} on {input_name}")
+                traceback.print_exc()
+
+    for failure in failed:
+        print("FAILED", failure)
+    if failed:
+        return 1
+
+    print("Every builder drew the edge cases")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+'''
+Memory report of the athlete frame in the compact schema of data_utils.compact_frame against plain
+object/float64/int64 columns, with the time of the groupbys the figures run on it.
+
+    python -m benchmarks.memory --scales 1 10
+
+Run from the repository root. Sizes count every string in full (pandas memory_usage(deep=True)),
+times are the fastest of --repeat runs.
+'''
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+import athlete_cache
+import data_utils
+from benchmarks import synthetic
+
+
+def object_frame(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    returns df with the column types read_athlete_events had before the compact schema
+    '''
+    types = {}
+    for column, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            types[column] = object
+        elif pd.api.types.is_integer_dtype(dtype):
+            types[column] = np.int64
+        elif pd.api.types.is_float_dtype(dtype):
+            types[column] = np.float64
+
+    return df.astype(types)
+
+
+# Groupbys of graph_module and data_utils, on the whole frame
+GROUPBYS = {
+    "medal_cube": lambda df: data_utils.medal_cube(df),
+    "games_sex_counts": lambda df: df.groupby("Games", observed=True)["Sex"].value_counts(),
+    "noc_sport_medals": lambda df: df.drop_duplicates(subset=["ID"]).groupby(["NOC", "Sport"], observed=True)["Medal"].count(),
+    "games_participants": lambda df: df.groupby("Games", observed=True)["ID"].nunique(),
+    "unique_athlete_games": lambda df: df.drop_duplicates(subset=["Games", "Hash"]),
+    "sport_partition": lambda df: df[df["Sport"] == "Gymnastics"],
+}
+
+
+def fastest(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def report(scale, repeat=3):
+    path = synthetic.ensure_csv(scale)
+    compact = data_utils.read_athlete_events(path)
+    plain = object_frame(compact)
+
+    sizes = pd.concat(
+        {"plain": data_utils.memory_report(plain), "compact": data_utils.memory_report(compact)}, axis=1
+    )
+    sizes[("", "ratio")] = sizes[("plain", "bytes")] / sizes[("compact", "bytes")]
+
+    times = pd.DataFrame(
+        {name: {"plain_s": fastest(lambda: groupby(plain), repeat), "compact_s": fastest(lambda: groupby(compact), repeat)}
+         for name, groupby in GROUPBYS.items()}
+    ).T
+    times["speedup"] = times["plain_s"] / times["compact_s"]
+
+    return sizes, times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory and groupby time of the compact athlete frame")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1], help="data sizes relative to athlete_events.csv")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per groupby, the fastest is kept")
+    args = parser.parse_args(argv)
+
+    with pd.option_context("display.width", 160, "display.max_columns", 10, "display.float_format", "{:.4f}".format):
+        for scale in args.scales:
+            sizes, times = report(scale, args.repeat)
+            total = sizes.loc["Total"]
+            print(f"{scale:g}x: {total[('plain', 'bytes')] / 2**20:.1f} MB -> {total[('compact', 'bytes')] / 2**20:.1f} MB "
+                  f"({total[('', 'ratio')]:.1f}x smaller, athlete cache format {athlete_cache.CACHE_FORMAT_VERSION})")
+            print(sizes.to_string())
+            print(times.to_string())
+            print()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
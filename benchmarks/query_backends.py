@@ -0,0 +1,103 @@
+'''
+Benchmark of the query backends (query_backend.py) on synthetic data.
+
+    python -m benchmarks.query_backends
+    python -m benchmarks.query_backends --scales 1 10 100 --only medal_cube count_games_sex
+
+Run from the repository root. Every operation the dashboard runs through query_backend is timed on each backend
+on the same frame, times are the fastest of --repeat runs. That the backends agree is tested in tests/test_query_backend.py.
+'''
+import argparse
+import sys
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+import data_utils
+import query_backend as qb
+from benchmarks import synthetic
+
+SPORTS = ["Gymnastics", "Shooting", "Speed Skating", "Archery"]
+
+# The operations of graph_module and data_utils, with the arguments they are called with there
+OPERATIONS = {
+    "select_sports": lambda df: qb.select(df, Sport=SPORTS),
+    "select_noc_season": lambda df: qb.select(df, NOC="NOR", Season="Winter"),
+    "select_sex": lambda df: qb.select(df, Sex="F"),
+    "first_rows_medal_keys": lambda df: qb.first_rows(df, data_utils.MEDAL_KEYS),
+    "drop_duplicates_sport_games_id": lambda df: qb.drop_duplicates(df, ["Sport", "Games", "ID"]),
+    "drop_duplicates_games_hash": lambda df: qb.drop_duplicates(df, ["Games", "Hash"]),
+    "count_sex": lambda df: qb.count(df, "Sex"),
+    "count_games_sex": lambda df: qb.count(df, ["Games", "Sex"]),
+    "count_noc_sport_medals": lambda df: qb.count(df, ["NOC", "Sport"], "Medal"),
+    "nunique_games_id": lambda df: qb.nunique(df, "Games", "ID"),
+    "medal_cube": lambda df: data_utils.medal_cube(df),
+}
+
+
+@contextmanager
+def using(backend):
+    # Swaps the backend every query_backend function (and so data_utils and graph_module) runs on
+    previous, qb._backend = qb._backend, backend
+    try:
+        yield
+    finally:
+        qb._backend = previous
+
+
+def fastest(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def run_scale(scale, backends, repeat=3, only=None):
+    '''
+    returns the time of every operation by backend
+    '''
+    df = data_utils.read_athlete_events(synthetic.ensure_csv(scale))
+    times = {}
+
+    for name, operation in OPERATIONS.items():
+        if only and name not in only:
+            continue
+
+        for backend in backends:
+            with using(backend):
+                seconds, _ = fastest(lambda: operation(df), repeat)
+            times.setdefault(name, {})[backend.name] = seconds
+
+    times = pd.DataFrame(times).T
+    for backend in backends[1:]:
+        times[f"{backend.name}_speedup"] = times[backends[0].name] / times[backend.name]
+
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the speed of the query backends")
+    parser.add_argument("--scales", type=float, nargs="+", default=[100], help="data sizes relative to athlete_events.csv, e.g. 1 10 100")
+    parser.add_argument("--backends", nargs="+", default=qb.BACKENDS, choices=qb.BACKENDS, help="the first one is the reference")
+    parser.add_argument("--threads", type=int, default=0, help="threads of the duckdb backend, one per CPU by default")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per operation, the fastest is kept")
+    parser.add_argument("--only", nargs="+", choices=list(OPERATIONS), help="names of the operations to run")
+    args = parser.parse_args(argv)
+
+    backends = [qb.make_backend(name, args.threads) for name in args.backends]
+
+    with pd.option_context("display.width", 160, "display.float_format", "{:.4f}".format):
+        for scale in args.scales:
+            times = run_scale(scale, backends, args.repeat, args.only)
+            print(f"{scale:g}x, seconds")
+            print(times.to_string())
+            print()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+'''
+Benchmarks every figure builder in graph_module, read_athlete_events and group_medals on synthetic data.
+
+    python -m benchmarks.run --scales 1 10
+    python -m benchmarks.run --scales 1 --check            # exit code 1 when a case regressed against baselines.json
+    python -m benchmarks.run --scales 1 --update-baseline  # store the results as the new baselines
+
+Run from the repository root. Wall time is the fastest of --repeat runs, peak memory is measured with
+tracemalloc in a separate run and figure size is the length of the figure's plotly JSON.
+'''
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import plotly.graph_objects as go
+
+import data_utils
+import dataset
+import graph_module as gm
+from benchmarks import synthetic
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# A case regresses when a measure grows more than this fraction over its baseline
+DEFAULT_THRESHOLD = 0.25
+
+# Wall time differences below this many seconds are timer noise, not regressions
+MIN_WALL_DIFFERENCE = 0.005
+
+SPORTS = ["Gymnastics", "Shooting", "Speed Skating", "Archery"]
+
+
+def _read_uncached(path):
+    # The digest cache is process wide, it is emptied so every run hashes the names again
+    data_utils._name_digests.clear()
+    return data_utils.read_athlete_events(path, use_cache=False)
+
+
+def cases(path):
+    '''
+    returns name -> function of every benchmarked case, called with the same arguments as in layout.py and main.py
+    '''
+    df = dataset.athletes()
+    nor = dataset.nor_athletes()
+    nor_cube = dataset.medal_cube("NOC", "NOR")
+    df_sports = dataset.partition("Sport", SPORTS)
+    sport_athletes = dataset.unique_athletes("sport_games", "Sport", SPORTS)
+
+    return {
+        "read_athlete_events": lambda: _read_uncached(path),
+        "read_athlete_events_cached": lambda: data_utils.read_athlete_events(path),
+        "group_medals": lambda: data_utils.group_medals(df),
+        "most_medals_by_country": lambda: gm.most_medals_by_country(df, cube=dataset.medal_cube()),
+        "gender_distribution": lambda: gm.gender_distribution(df),
+        "gender_distribution_by_games": lambda: gm.gender_distribution_by_games(df),
+        "norwegian_participants_sex": lambda: gm.norwegian_participants_sex(nor, athletes=dataset.unique_athletes("noc_games", "NOC", "NOR")),
+        "norwegian_medals_decade": lambda: gm.norwegian_medals_decade(nor, cube=nor_cube),
+        "norwegian_sex_age_distribution": lambda: gm.norwegian_sex_age_distribution(nor, athletes=dataset.unique_athletes("noc_games_name", "NOC", "NOR")),
+        "age_by_gender_by_year": lambda: gm.age_by_gender_by_year(nor),
+        "medal_coloured_bars": lambda: gm.medal_coloured_bars(nor, cube=nor_cube),
+        "medals_by_sport_and_sex": lambda: gm.medals_by_sport_and_sex(nor, "Norway's top performing Olympic sports", cube=nor_cube),
+        "norwegian_medals_season": lambda: gm.norwegian_medals_season(nor, cube=nor_cube),
+        "top_medals_winter": lambda: gm.top_medals_winter(dataset.partition("Season", "Winter"), cube=dataset.medal_cube("Season", "Winter")),
+        "subplot_medal_distribution": lambda: gm.subplot_medal_distribution(df, "Speed Skating", "Gymnastics", "Archery", "Shooting", athletes=dataset.unique_athletes("athlete")),
+        "medal_distribution_by_country": lambda: gm.medal_distribution_by_country(df, "Alpine Skiing", athletes=dataset.unique_athletes("athlete")),
+        "age_distribution_by_sports": lambda: gm.age_distribution_by_sports(df_sports, SPORTS, athletes=sport_athletes),
+        "subplot_weight_height_correlation": lambda: gm.subplot_weight_height_correlation(df_sports, SPORTS, athletes=sport_athletes),
+        "weight_distribution_by_sports": lambda: gm.weight_distribution_by_sports(df_sports, SPORTS, athletes=sport_athletes),
+        "height_distribution_by_sports": lambda: gm.height_distribution_by_sports(df_sports, SPORTS, athletes=sport_athletes),
+        "bmi_distribution_by_sports": lambda: gm.bmi_distribution_by_sports(df_sports, SPORTS, athletes=sport_athletes),
+        "bmi_distribution_by_sports_medalists": lambda: gm.bmi_distribution_by_sports_medalists(df_sports, SPORTS, athletes=sport_athletes),
+        "sport_subplots": lambda: gm.sport_subplots(df, "Football", df_sport=dataset.partition("Sport", "Football"), cube=dataset.medal_cube("Sport", "Football")),
+    }
+
+
+def measure(function, repeat=3):
+    '''
+    returns the fastest wall time in seconds, the peak traced memory in MB and the JSON size of the result if it is a figure
+    '''
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        wall_times.append(time.perf_counter() - start)
+
+    # Cycles left by the timed runs and earlier cases would otherwise be collected at a different point of every case
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    figure_bytes = len(result.to_json()) if isinstance(result, go.Figure) else None
+
+    return {"wall_s": round(min(wall_times), 5), "peak_mb": round(peak / 2**20, 3), "figure_bytes": figure_bytes}
+
+
+def run_scale(scale, repeat=3, only=None):
+    path = synthetic.ensure_csv(scale)
+
+    # Point the registry at the synthetic data and warm it up, loading the frame isn't part of any figure
+    dataset.DATA_FILE = path
+    dataset.clear()
+    data_utils.read_athlete_events(path)
+    dataset.medal_cube("NOC", "NOR")
+    dataset.partition("Sport", SPORTS)
+
+    results = {}
+    for name, function in cases(path).items():
+        if only and name not in only:
+            continue
+        results[name] = measure(function, repeat)
+        print(f"{scale:>6g}x  {name:<38} {results[name]['wall_s']:>9.4f} s {results[name]['peak_mb']:>10.1f} MB {results[name]['figure_bytes'] or '':>10}", flush=True)
+
+    return results
+
+
+def regressions(results, baselines, threshold=DEFAULT_THRESHOLD):
+    '''
+    returns a description of every measure that grew more than threshold over its baseline
+    '''
+    found = []
+    for scale, scale_results in results.items():
+        for name, result in scale_results.items():
+            baseline = baselines.get(scale, {}).get(name)
+            if baseline is None:
+                continue
+
+            for measure_name, value in result.items():
+                base_value = baseline.get(measure_name)
+                if value is None or not base_value:
+                    continue
+                if measure_name == "wall_s" and value - base_value < MIN_WALL_DIFFERENCE:
+                    continue
+                if value > base_value * (1 + threshold):
+                    found.append(f"{scale}x {name} {measure_name}: {base_value} -> {value} (+{value / base_value - 1:.0%})")
+
+    return found
+
+
+def read_baselines(path=BASELINE_PATH):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {"results": {}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the figure builders on synthetic data")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1], help="data sizes relative to athlete_events.csv, e.g. 1 10 100")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, the fastest is kept")
+    parser.add_argument("--only", nargs="+", help="names of the cases to run")
+    parser.add_argument("--check", action="store_true", help="compare against the baselines and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed growth over the baseline, 0.25 is 25 %%")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results in baselines.json")
+    parser.add_argument("--output", help="also write the results to this json file")
+    args = parser.parse_args(argv)
+
+    results = {f"{scale:g}": run_scale(scale, args.repeat, args.only) for scale in args.scales}
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    baselines = read_baselines()
+
+    if args.update_baseline:
+        for scale, scale_results in results.items():
+            baselines["results"].setdefault(scale, {}).update(scale_results)
+        baselines["machine"] = {"platform": platform.platform(), "python": platform.python_version(), "processor": platform.processor()}
+        with open(BASELINE_PATH, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print(f"Updated {BASELINE_PATH}")
+
+    if args.check:
+        found = regressions(results, baselines["results"], args.threshold)
+        for regression in found:
+            print("REGRESSION", regression)
+        if found:
+            return 1
+        print("No regressions")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Rows in the real athlete_events.csv, scale 1 generates the same amount
+BASE_ROWS = 271_116
+
+ROWS_PER_CHUNK = 1_000_000
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+COLUMNS = ["ID", "Name", "Sex", "Age", "Height", "Weight", "Team", "NOC", "Games", "Year", "Season", "City", "Sport", "Event", "Medal"]
+
+SUMMER_GAMES = [
+    (1896, "Athina"), (1900, "Paris"), (1904, "St. Louis"), (1906, "Athina"), (1908, "London"),
+    (1912, "Stockholm"), (1920, "Antwerpen"), (1924, "Paris"), (1928, "Amsterdam"), (1932, "Los Angeles"),
+    (1936, "Berlin"), (1948, "London"), (1952, "Helsinki"), (1956, "Melbourne"), (1960, "Roma"),
+    (1964, "Tokyo"), (1968, "Mexico City"), (1972, "Munich"), (1976, "Montreal"), (1980, "Moskva"),
+    (1984, "Los Angeles"), (1988, "Seoul"), (1992, "Barcelona"), (1996, "Atlanta"), (2000, "Sydney"),
+    (2004, "Athina"), (2008, "Beijing"), (2012, "London"), (2016, "Rio de Janeiro"),
+]
+
+WINTER_GAMES = [
+    (1924, "Chamonix"), (1928, "Sankt Moritz"), (1932, "Lake Placid"), (1936, "Garmisch-Partenkirchen"),
+    (1948, "Sankt Moritz"), (1952, "Oslo"), (1956, "Cortina d'Ampezzo"), (1960, "Squaw Valley"),
+    (1964, "Innsbruck"), (1968, "Grenoble"), (1972, "Sapporo"), (1976, "Innsbruck"), (1980, "Lake Placid"),
+    (1984, "Sarajevo"), (1988, "Calgary"), (1992, "Albertville"), (1994, "Lillehammer"), (1998, "Nagano"),
+    (2002, "Salt Lake City"), (2006, "Torino"), (2010, "Vancouver"), (2014, "Sochi"),
+]
+
+# sport: (season, share of entries, athletes per entry, events per sex, mean age, height and weight offset from the average athlete)
+SPORTS = {
+    "Athletics": ("Summer", 0.15, 1, 24, 25, 2, -3),
+    "Swimming": ("Summer", 0.10, 1, 16, 21, 5, 0),
+    "Gymnastics": ("Summer", 0.10, 1, 8, 21, -10, -12),
+    "Rowing": ("Summer", 0.05, 4, 7, 25, 9, 10),
+    "Cycling": ("Summer", 0.05, 1, 9, 25, 2, -1),
+    "Fencing": ("Summer", 0.05, 1, 6, 27, 3, 0),
+    "Shooting": ("Summer", 0.05, 1, 8, 34, -1, 4),
+    "Wrestling": ("Summer", 0.04, 1, 9, 25, -3, 6),
+    "Boxing": ("Summer", 0.04, 1, 10, 24, -2, -2),
+    "Sailing": ("Summer", 0.03, 2, 5, 30, 2, 5),
+    "Canoeing": ("Summer", 0.03, 2, 8, 25, 5, 5),
+    "Weightlifting": ("Summer", 0.02, 1, 8, 25, -6, 10),
+    "Archery": ("Summer", 0.015, 1, 2, 27, 0, 0),
+    "Equestrianism": ("Summer", 0.02, 1, 3, 33, 0, -3),
+    "Football": ("Summer", 0.03, 18, 1, 24, 3, 2),
+    "Hockey": ("Summer", 0.025, 16, 1, 25, 1, 0),
+    "Basketball": ("Summer", 0.02, 12, 1, 25, 18, 18),
+    "Cross Country Skiing": ("Winter", 0.03, 1, 6, 26, 0, -2),
+    "Alpine Skiing": ("Winter", 0.035, 1, 5, 23, 0, 2),
+    "Speed Skating": ("Winter", 0.025, 1, 6, 24, 0, 0),
+    "Ice Hockey": ("Winter", 0.025, 22, 1, 26, 5, 12),
+    "Biathlon": ("Winter", 0.02, 1, 5, 27, 0, -2),
+    "Ski Jumping": ("Winter", 0.01, 1, 2, 23, 0, -8),
+    "Figure Skating": ("Winter", 0.015, 1, 2, 22, -8, -12),
+    "Bobsleigh": ("Winter", 0.01, 4, 1, 28, 5, 20),
+}
+
+# noc: (team name, summer weight, winter weight)
+NOCS = {
+    "USA": ("United States", 10, 8), "GER": ("Germany", 8, 8), "FRA": ("France", 7, 5), "GBR": ("Great Britain", 7, 4),
+    "ITA": ("Italy", 6, 5), "CAN": ("Canada", 5, 7), "SWE": ("Sweden", 5, 6), "NOR": ("Norway", 3, 8),
+    "JPN": ("Japan", 5, 4), "AUS": ("Australia", 5, 1), "URS": ("Soviet Union", 5, 5), "RUS": ("Russia", 4, 5),
+    "CHN": ("China", 4, 2), "NED": ("Netherlands", 4, 4), "HUN": ("Hungary", 4, 1), "FIN": ("Finland", 3, 6),
+    "SUI": ("Switzerland", 3, 6), "AUT": ("Austria", 3, 7), "POL": ("Poland", 3, 2), "ESP": ("Spain", 3, 1),
+    "KOR": ("South Korea", 3, 2), "BRA": ("Brazil", 3, 0.5), "ROU": ("Romania", 3, 1), "CZE": ("Czech Republic", 2, 3),
+    "BEL": ("Belgium", 2, 0.5), "DEN": ("Denmark", 2, 0.5), "GRE": ("Greece", 2, 0.5), "ARG": ("Argentina", 2, 0.5),
+    "MEX": ("Mexico", 2, 0.5), "NZL": ("New Zealand", 1.5, 0.5), "IND": ("India", 1.5, 0.2), "KEN": ("Kenya", 1, 0.1),
+    "EGY": ("Egypt", 1, 0.1), "ISL": ("Iceland", 0.3, 0.5), "JAM": ("Jamaica", 0.8, 0.1), "RSA": ("South Africa", 1.5, 0.3),
+}
+
+FIRST_GAMES_NOCS = ["GRE", "USA", "GER", "FRA", "GBR", "HUN", "AUT", "DEN", "SUI", "AUS"]
+
+
+def _games():
+    '''
+    returns one row per games with Year, Season, City, Games and the relative number of entries
+    '''
+    games = pd.DataFrame(
+        [(year, "Summer", city) for year, city in SUMMER_GAMES] + [(year, "Winter", city) for year, city in WINTER_GAMES],
+        columns=["Year", "Season", "City"],
+    )
+    games["Games"] = games["Year"].astype(str) + " " + games["Season"]
+
+    # The games grow over time, the winter games are a lot smaller than the summer games
+    games["weight"] = (games["Year"] - 1880) ** 1.5 * np.where(games["Season"] == "Summer", 1, 0.2)
+    return games
+
+
+def _female_share(year):
+    # From a few percent in the early games to almost half in the latest ones
+    return np.clip(0.01 + (year - 1900) * 0.0035, 0.01, 0.45)
+
+
+def generate(scale=1, seed=0, chunk=0, rows=None) -> pd.DataFrame:
+    '''
+    returns a deterministic frame shaped like athlete_events.csv with scale times as many rows.
+    entries (one athlete or one team in one event) get medals per event, athletes keep sex, height and weight
+    for their whole career and get older between games.
+    rows and chunk generate a part of a larger data set, ids and events of different chunks never overlap
+    '''
+    rng = np.random.default_rng([seed, chunk])
+    n_rows = rows if rows is not None else int(BASE_ROWS * scale)
+
+    games = _games()
+    sports = pd.DataFrame.from_dict(
+        SPORTS, orient="index", columns=["Season", "share", "team_size", "events", "age", "height", "weight"]
+    )
+    nocs = pd.DataFrame.from_dict(NOCS, orient="index", columns=["Team", "Summer", "Winter"])
+
+    # Entries are drawn until they hold enough athletes, the surplus rows are cut at the end
+    mean_team_size = (sports["share"] * sports["team_size"]).sum() / sports["share"].sum()
+    n_entries = int(n_rows / mean_team_size * 1.05) + 100
+
+    game_of_entry = rng.choice(len(games), n_entries, p=(games["weight"] / games["weight"].sum()).to_numpy())
+    entry_season = games["Season"].to_numpy()[game_of_entry]
+    entry_year = games["Year"].to_numpy()[game_of_entry]
+
+    sport_of_entry = np.empty(n_entries, dtype=int)
+    noc_of_entry = np.empty(n_entries, dtype=int)
+    for season in ["Summer", "Winter"]:
+        in_season = entry_season == season
+        season_sports = np.flatnonzero(sports["Season"].to_numpy() == season)
+        shares = sports["share"].to_numpy()[season_sports]
+        sport_of_entry[in_season] = rng.choice(season_sports, in_season.sum(), p=shares / shares.sum())
+        noc_weights = nocs[season].to_numpy()
+        noc_of_entry[in_season] = rng.choice(len(nocs), in_season.sum(), p=noc_weights / noc_weights.sum())
+
+    # Only a handful of nations took part in the first games
+    first_games = entry_year == 1896
+    early_nocs = np.flatnonzero(nocs.index.isin(FIRST_GAMES_NOCS))
+    noc_of_entry[first_games] = rng.choice(early_nocs, first_games.sum())
+
+    entry_female = rng.random(n_entries) < _female_share(entry_year)
+
+    # More events as the data grows, so every event keeps a realistic number of entries and medals
+    events_per_sex = np.maximum(1, np.round(sports["events"].to_numpy() * n_rows / BASE_ROWS)).astype(int)
+    event_number = (rng.random(n_entries) * events_per_sex[sport_of_entry]).astype(int) + 1 + chunk * events_per_sex[sport_of_entry]
+
+    # Exponential race: the three fastest entries of every event and games win, stronger nations are faster
+    strength = np.where(entry_season == "Summer", nocs["Summer"].to_numpy()[noc_of_entry], nocs["Winter"].to_numpy()[noc_of_entry])
+    race_time = rng.exponential(size=n_entries) / strength
+    event_key = ((game_of_entry * len(sports) + sport_of_entry) * 2 + entry_female) * (event_number.max() + 1) + event_number
+    order = np.lexsort((race_time, event_key))
+    first_of_event = np.r_[True, event_key[order][1:] != event_key[order][:-1]]
+    event_start = np.maximum.accumulate(np.where(first_of_event, np.arange(n_entries), 0))
+    place = np.empty(n_entries, dtype=int)
+    place[order] = np.arange(n_entries) - event_start
+
+    # One row per athlete of every entry
+    team_size = sports["team_size"].to_numpy()[sport_of_entry]
+    row_entry = np.repeat(np.arange(n_entries), team_size)[:n_rows]
+    n_rows = len(row_entry)
+
+    row_game = game_of_entry[row_entry]
+    row_sport = sport_of_entry[row_entry]
+    row_noc = noc_of_entry[row_entry]
+    row_female = entry_female[row_entry]
+    row_year = entry_year[row_entry]
+
+    # Careers: rows of the same nation, sport and sex ordered by year are cut into runs of one athlete each
+    order = np.lexsort((row_year, row_female, row_sport, row_noc))
+    group = ((row_noc * len(sports) + row_sport) * 2 + row_female)[order]
+    sorted_year = row_year[order]
+    new_group = np.r_[True, group[1:] != group[:-1]]
+    # Careers end after a random number of starts or when there are no games of the sport for a long time
+    long_break = np.r_[True, np.diff(sorted_year) > 8]
+    new_athlete = new_group | long_break | (rng.random(n_rows) < 0.45)
+    athlete_of_sorted = np.cumsum(new_athlete) - 1
+    row_athlete = np.empty(n_rows, dtype=int)
+    row_athlete[order] = athlete_of_sorted
+    n_athletes = athlete_of_sorted[-1] + 1 if n_rows else 0
+
+    first_row = order[new_athlete]
+    athlete_sport = row_sport[first_row]
+    athlete_female = row_female[first_row]
+    birth_year = row_year[first_row] - np.round(rng.normal(sports["age"].to_numpy()[athlete_sport], 4.5)).clip(12, 60)
+
+    # Body metrics were rarely recorded in the early games
+    first_year = row_year[first_row]
+    missing_body = rng.random(n_athletes) < np.where(first_year < 1960, 0.75, 0.12)
+    height = np.round(
+        rng.normal(np.where(athlete_female, 168, 180) + sports["height"].to_numpy()[athlete_sport], 7)
+    )
+    weight = np.round(
+        rng.normal(np.where(athlete_female, 60, 75) + sports["weight"].to_numpy()[athlete_sport], 8)
+    ).clip(28, 200)
+    height[missing_body] = np.nan
+    weight[missing_body | (rng.random(n_athletes) < 0.03)] = np.nan
+
+    age = (row_year - birth_year[row_athlete]).astype(float)
+    age[rng.random(n_rows) < 0.035] = np.nan
+
+    medal_names = np.array(["Gold", "Silver", "Bronze", None], dtype=object)
+    row_medal = medal_names[np.minimum(place[row_entry], 3)]
+
+    sport_names = sports.index.to_numpy()
+    event_names = pd.Series(sport_names[row_sport]) + np.where(row_female, " Women's Event ", " Men's Event ") + event_number[row_entry].astype(str)
+
+    # Every chunk has fewer athletes than ROWS_PER_CHUNK
+    row_id = row_athlete + 1 + chunk * ROWS_PER_CHUNK
+
+    return pd.DataFrame({
+        "ID": row_id,
+        "Name": "Synthetic Athlete " + pd.Series(row_id).astype(str),
+        "Sex": np.where(row_female, "F", "M"),
+        "Age": age,
+        "Height": height[row_athlete],
+        "Weight": weight[row_athlete],
+        "Team": nocs["Team"].to_numpy()[row_noc],
+        "NOC": nocs.index.to_numpy()[row_noc],
+        "Games": games["Games"].to_numpy()[row_game],
+        "Year": row_year,
+        "Season": games["Season"].to_numpy()[row_game],
+        "City": games["City"].to_numpy()[row_game],
+        "Sport": sport_names[row_sport],
+        "Event": event_names,
+        "Medal": row_medal,
+    }, columns=COLUMNS)
+
+
+def csv_path(scale):
+    return os.path.join(DATA_DIR, f"athlete_events_{scale:g}x.csv")
+
+
+def write_csv(scale=1, seed=0, path=None):
+    '''
+    writes the synthetic frame of the passed scale to path, in chunks so large scales fit in memory
+    '''
+    path = path or csv_path(scale)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    n_rows = int(BASE_ROWS * scale)
+    n_chunks = max(1, -(-n_rows // ROWS_PER_CHUNK))
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", newline="") as file:
+        for chunk in range(n_chunks):
+            chunk_rows = n_rows // n_chunks + (chunk < n_rows % n_chunks)
+            df = generate(scale, seed=seed, chunk=chunk, rows=chunk_rows)
+            df.to_csv(file, header=chunk == 0, index=False)
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def ensure_csv(scale=1, seed=0):
+    '''
+    returns the path of the synthetic csv of the passed scale, generated on first use
+    '''
+    path = csv_path(scale)
+    if not os.path.exists(path):
+        write_csv(scale, seed, path)
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate synthetic athlete_events.csv data")
+    parser.add_argument("--scale", type=float, default=1, help="rows relative to the real data set (1, 10, 100)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help=f"output csv, defaults to {DATA_DIR}/athlete_events_<scale>x.csv")
+    args = parser.parse_args()
+
+    path = write_csv(args.scale, args.seed, args.out)
+    print(f"Wrote {int(BASE_ROWS * args.scale)} rows to {path}")
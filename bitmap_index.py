@@ -0,0 +1,105 @@
+'''
+Bitmap index of a frame: for every value of an indexed column, one bit per row telling whether the row has that value.
+
+Bits are packed 64 to a uint64 word, so a selection of any values of any columns is resolved with a few
+bitwise ORs (values of one column) and ANDs (across columns) over len(frame) / 64 words, and rows are counted per
+value with a popcount instead of a groupby over the frame.
+'''
+import numpy as np
+import pandas as pd
+
+
+def _words(rows):
+    return (rows + 63) // 64
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    # Set bits per bitmap, words is one bitmap per row
+    return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+
+
+class BitmapIndex:
+    '''
+    per value bitmaps of the columns of df. a selection is a dict of column -> list of values, a row is selected
+    when it has one of the values of every column in the selection
+    '''
+    def __init__(self, df: pd.DataFrame, columns) -> None:
+        self.rows = len(df)
+        self.columns = list(columns)
+        # Values of every column in the order of their bitmaps, and the position of each value
+        self.values = {}
+        self._positions = {}
+        self._bitmaps = {}
+
+        positions = np.arange(self.rows, dtype=np.int64)
+        for column in self.columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+            else:
+                codes, uniques = pd.factorize(values, sort=True)
+
+            present = codes >= 0
+            bitmaps = np.zeros((len(uniques), _words(self.rows)), dtype=np.uint64)
+            # Every row sets one bit, so or-ing the bits of a word together is the same as adding them
+            np.bitwise_or.at(
+                bitmaps,
+                (codes[present], positions[present] >> 6),
+                np.left_shift(np.uint64(1), (positions[present] & 63).astype(np.uint64)),
+            )
+
+            self.values[column] = list(uniques)
+            self._positions[column] = {value: position for position, value in enumerate(uniques)}
+            self._bitmaps[column] = bitmaps
+
+        self._all = np.full(_words(self.rows), np.iinfo(np.uint64).max, dtype=np.uint64)
+        if self.rows % 64:
+            self._all[-1] = np.uint64((1 << (self.rows % 64)) - 1)
+
+
+    def bitmap(self, selection=None) -> np.ndarray:
+        '''
+        returns the bitmap of the rows of selection, every row for an empty one.
+        raises ValueError for a column that isn't indexed
+        '''
+        bitmap = self._all
+        for column, values in (selection or {}).items():
+            if column not in self._bitmaps:
+                raise ValueError(f"{column!r} isn't an indexed column, expected one of {self.columns}")
+
+            found = [self._positions[column][value] for value in values if value in self._positions[column]]
+            if not found:
+                return np.zeros_like(self._all)
+            bitmap = bitmap & np.bitwise_or.reduce(self._bitmaps[column][found], axis=0)
+
+        return bitmap
+
+
+    def positions(self, bitmap: np.ndarray) -> np.ndarray:
+        '''
+        returns the ascending row positions of the set bits of bitmap
+        '''
+        bits = np.unpackbits(bitmap.view(np.uint8), bitorder="little", count=self.rows)
+        return np.flatnonzero(bits)
+
+
+    def count(self, bitmap: np.ndarray, column) -> pd.Series:
+        '''
+        returns the selected rows per value of column, values without a selected row are left out
+        '''
+        counts = pd.Series(_popcount(self._bitmaps[column] & bitmap), index=pd.Index(self.values[column], name=column))
+        return counts[counts > 0]
+
+
+    def count_pairs(self, bitmap: np.ndarray, first, second) -> pd.Series:
+        '''
+        returns the selected rows per combination of a value of first and a value of second, sorted by first and then second.
+        combinations without a selected row are left out
+        '''
+        first_bitmaps = self._bitmaps[first] & bitmap
+        # One value of second at a time, second is the column with fewer values
+        counts = np.stack([_popcount(first_bitmaps & second_bitmap) for second_bitmap in self._bitmaps[second]], axis=1)
+
+        index = pd.MultiIndex.from_product([self.values[first], self.values[second]], names=[first, second])
+        counts = pd.Series(counts.ravel(), index=index)
+        return counts[counts > 0]
@@ -0,0 +1,101 @@
+import os
+
+# Settings for the dashboard, each one can be overridden with an environment variable
+
+
+def _env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+# Number of rendered sport_subplots figures kept in memory
+FIGURE_CACHE_SIZE = _env_int("OS_FIGURE_CACHE_SIZE", 80)
+
+# Number of figures drawn for cross-filter selections (crossfilter.py) kept in memory
+CROSSFILTER_CACHE_SIZE = _env_int("OS_CROSSFILTER_CACHE_SIZE", 64)
+
+# Render every sport in a background thread after startup so the first view of each is a cache hit
+WARM_FIGURE_CACHE = _env_flag("OS_WARM_FIGURE_CACHE")
+
+# Build the All Sports figure in background jobs with a progress bar instead of in the web server's threads, needs dash[diskcache]
+BACKGROUND_CALLBACKS = _env_flag("OS_BACKGROUND_CALLBACKS")
+
+# Background jobs building at once, the others wait in the queue
+BACKGROUND_WORKERS = _env_int("OS_BACKGROUND_WORKERS", 2)
+
+# Directory of the background job queue and result store, shared by the gunicorn workers. Next to the athlete cache when not set
+BACKGROUND_CACHE_DIR = os.environ.get("OS_BACKGROUND_CACHE_DIR")
+
+# Seconds an unused background job result is kept
+BACKGROUND_RESULT_EXPIRE = _env_int("OS_BACKGROUND_RESULT_EXPIRE", 3600)
+
+# Figure sets of the Countries tab kept in memory, one per NOC
+COUNTRY_CACHE_SIZE = _env_int("OS_COUNTRY_CACHE_SIZE", 40)
+
+# Processes building the figure sets of the Countries tab, each loads its own copy of the data set
+COUNTRY_PROCESSES = _env_int("OS_COUNTRY_PROCESSES", 2)
+
+# Countries with the most medals whose figure sets are built at startup, the others are built when first selected
+COUNTRY_PREWARM = _env_int("OS_COUNTRY_PREWARM", 10)
+
+# Send pre-aggregated data for every sport once and draw the All Sports figure in the browser
+CLIENTSIDE_SPORTS = _env_flag("OS_CLIENTSIDE_SPORTS")
+
+# When the server callback draws the All Sports figure, send the skeleton once and then only the data and title of each sport
+SPORT_PATCHES = _env_flag("OS_SPORT_PATCHES", True)
+
+# Weight/height scatters switch to WebGL above the first threshold and to binned heatmaps above the second
+SCATTER_GL_THRESHOLD = _env_int("OS_SCATTER_GL_THRESHOLD", 2000)
+SCATTER_BIN_THRESHOLD = _env_int("OS_SCATTER_BIN_THRESHOLD", 20000)
+
+# Bins per axis of the binned weight/height heatmaps
+SCATTER_BINS = _env_int("OS_SCATTER_BINS", 80)
+
+# Callback latency metrics, served in the prometheus text format on /metrics
+METRICS_ENABLED = _env_flag("OS_METRICS")
+
+# Serve /metrics to every client. When off it is only served to requests from the same machine that didn't pass
+# through a proxy, a reverse proxy on the same machine that sets no X-Forwarded-For or Forwarded header makes every
+# request look local, block /metrics in the proxy then
+METRICS_PUBLIC = _env_flag("OS_METRICS_PUBLIC")
+
+# Production server settings, used by gunicorn.conf.py
+BIND = os.environ.get("OS_BIND", "0.0.0.0:8050")
+WORKERS = _env_int("OS_WORKERS", os.cpu_count() or 1)
+THREADS = _env_int("OS_THREADS", 4)
+
+# Load the data set and build the tabs in the gunicorn master, the forked workers share that memory
+PRELOAD = _env_flag("OS_PRELOAD", True)
+
+# Serve the tab and sport figures as pre-encoded, compressed JSON from /figures, the browser revalidates them with their ETag
+FIGURE_ENDPOINT = _env_flag("OS_FIGURE_ENDPOINT", True)
+
+# How the figures of the tabs are built at startup: process (forked workers sharing the data set), thread or serial
+FIGURE_BUILD_MODE = os.environ.get("OS_FIGURE_BUILD_MODE", "process")
+
+# Workers building the startup figures, one per CPU when not set
+FIGURE_BUILD_WORKERS = _env_int("OS_FIGURE_BUILD_WORKERS", 0)
+
+# Engine computing the aggregations of the figures (query_backend.py): pandas, or duckdb with the duckdb package installed
+QUERY_BACKEND = os.environ.get("OS_QUERY_BACKEND", "pandas")
+
+# Threads of the duckdb backend, DuckDB uses one per CPU when not set
+QUERY_THREADS = _env_int("OS_QUERY_THREADS", 0)
+
+# Load pre-rendered figures from the snapshot written by figure_snapshot.py, used while it matches the data set and the code
+FIGURE_SNAPSHOT = _env_flag("OS_FIGURE_SNAPSHOT", True)
+
+# Snapshot file, next to the athlete cache of the data set when not set
+FIGURE_SNAPSHOT_FILE = os.environ.get("OS_FIGURE_SNAPSHOT_FILE")
+
+# Poll the data set csv for appended rows (see ingest.py) and add them to the running server, every WATCH_INTERVAL seconds.
+# Every serving process polls and loads the appended rows itself, so it is off unless the file is appended to
+WATCH_DATA_FILE = _env_flag("OS_WATCH_DATA")
+WATCH_INTERVAL = _env_int("OS_WATCH_INTERVAL", 5)
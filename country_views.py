@@ -0,0 +1,196 @@
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait as wait_for
+import dataset
+import graph_module as gm
+from data_utils import medal_table
+from figure_cache import FigureCache
+from serialization import EncodedFigure, encode_figure
+
+# Graphs of the Countries tab, the Norway tab with the figures of any NOC (the winter figure covers every country)
+COUNTRY_GRAPHS = ["participants", "medals-decade", "age-histogram", "age-boxplot", "medals", "sports-sex", "seasons"]
+
+
+def country_name(noc):
+    for option in dataset.noc_options():
+        if option["value"] == noc:
+            return option["label"].rsplit(" (", 1)[0]
+    return noc
+
+
+def build_country_figures(noc) -> dict:
+    '''
+    renders the figures of one country and returns their JSON by graph name, runs in the process pool
+    '''
+    name = country_name(noc)
+    athletes = dataset.partition("NOC", noc)
+    cube = dataset.medal_cube("NOC", noc)
+
+    figures = {
+        "participants": gm.norwegian_participants_sex(athletes, title=f"Athletes from {name} in the Olympics", athletes=dataset.unique_athletes("noc_games", "NOC", noc)),
+        "medals-decade": gm.norwegian_medals_decade(athletes, cube=cube, title=f"Medals won by male and female athletes from {name} per decade"),
+        "age-histogram": gm.norwegian_sex_age_distribution(athletes, title=f"Ages of Olympic athletes from {name}", athletes=dataset.unique_athletes("noc_games_name", "NOC", noc)),
+        "age-boxplot": gm.age_by_gender_by_year(athletes),
+        "medals": gm.medal_coloured_bars(athletes, cube=cube),
+        "sports-sex": gm.medals_by_sport_and_sex(athletes, f"Top performing Olympic sports of {name}", cube=cube),
+        "seasons": gm.norwegian_medals_season(athletes, cube=cube, title=f"Seasonal medals of {name}"),
+    }
+
+    # Sent back to the server process as bytes, encoding them here keeps that work out of the server too
+    return {graph: encode_figure(figure).body for graph, figure in figures.items()}
+
+
+def popular_countries(limit):
+    '''
+    returns the limit NOCs with the most medals
+    '''
+    return medal_table(dataset.medal_cube(), "NOC").index[:limit].tolist()
+
+
+def _init_worker(data_file):
+    # A spawned worker loads the data set itself when it builds its first figures. Every append comes from this
+    # file, so it has the rows the server has (or rows appended since, which the server's next append picks up)
+    dataset.DATA_FILE = data_file
+
+
+# Every CountryViews of this process, see _forget_pools()
+_instances = weakref.WeakSet()
+
+
+def _forget_pools():
+    # A forked server worker can't use the pools of its parent
+    for views in list(_instances):
+        views._forget_pool()
+
+
+os.register_at_fork(after_in_child=_forget_pools)
+
+
+class CountryViews:
+    '''
+    figure sets of every country, built in a process pool on first request and kept in a size bounded LRU cache
+    '''
+    def __init__(self, max_entries, processes) -> None:
+        self.cache = FigureCache(max_entries)
+        self._processes = processes
+        self._pool = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+
+    def _forget_pool(self):
+        self._pool = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+
+    def _key(self, noc):
+        return ("country", noc, dataset.version())
+
+
+    def submit(self, noc):
+        '''
+        starts building the figures of noc unless they are cached or being built, returns a future or None if cached
+        '''
+        key = self._key(noc)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            if self.cache.get(key) is not None:
+                return None
+
+            if self._pool is None:
+                # Spawned rather than forked, the server has threads running whose locks a forked process could
+                # inherit held. A forkserver would be started by the gunicorn master and unusable from its workers
+                self._pool = ProcessPoolExecutor(
+                    self._processes, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker, initargs=(dataset.DATA_FILE,),
+                )
+            future = self._pool.submit(build_country_figures, noc)
+            self._pending[key] = future
+
+        future.add_done_callback(lambda future: self._store(key, future))
+        return future
+
+
+    def _put(self, key, bodies):
+        # The figures of a build, unless another thread already cached the same build
+        figures = self.cache.peek(key)
+        if figures is None:
+            figures = {graph: EncodedFigure(body) for graph, body in bodies.items()}
+            self.cache.put(key, figures)
+
+        return figures
+
+
+    def _store(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self._put(key, future.result())
+
+
+    def figures(self, noc):
+        '''
+        returns the encoded figures of noc by graph name, waiting for them to be built if needed
+        '''
+        key = self._key(noc)
+        future = self.submit(noc)
+        if future is None:
+            figures = self.cache.get(key)
+        else:
+            # Waiters of a future are woken before its done callbacks run, so the result is taken from the future
+            # instead of waiting for _store to cache it
+            try:
+                figures = self._put(key, future.result())
+            except Exception:
+                figures = None
+
+        # Evicted already, cancelled by restart() or failed in the pool, built in this thread instead
+        if figures is None:
+            figures = {graph: EncodedFigure(body) for graph, body in build_country_figures(noc).items()}
+            self.cache.put(key, figures)
+
+        return figures
+
+
+    def warm_up(self, nocs, wait=False):
+        '''
+        starts building the figures of nocs in the pool, with wait returns once they are all built
+        '''
+        futures = [future for future in map(self.submit, nocs) if future is not None]
+        if wait:
+            wait_for(futures)
+
+
+    def restart(self):
+        '''
+        replaces the pool, its workers loaded the data set as it was then
+        '''
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+    def shutdown(self):
+        self.restart()
+
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {**self.cache.stats(), "pending": pending}
+
+
+def affected_countries(changes):
+    '''
+    returns the NOCs whose figures an append with the change set of dataset.append changes, None if it is every NOC
+    '''
+    # Unlike the sport figures, the axes of a country's figures only depend on its own athletes
+    if changes is None:
+        return None
+    return changes["values"]["NOC"]
@@ -0,0 +1,144 @@
+'''
+Linked selections across the Start and All Sports charts.
+
+Clicking a bar of a linked chart adds its value to the selection (or removes it again), and every linked chart is
+drawn again from the selected rows only. A selection is a dict of column -> list of values of dataset.BITMAP_COLUMNS:
+a row is selected when it has one of the values of every column. Rows are resolved and counted with the bitmap
+indexes of dataset.bitmaps(), so a new selection never scans the frame.
+'''
+import json
+import graph_module as gm
+import dataset
+import sport_store
+
+# Linked graphs of the Start tab and the column a click on one of their bars selects
+LINKED_GRAPHS = {
+    "most-medals-by-country": "NOC",
+    "gender-distribution": "Sex",
+    "gender-distribution-by-games": "Games",
+}
+
+# Traces of the All Sports figure (graph_module.sport_subplots) a click selects a value of, the medal bars and the gender bars
+SPORT_CLICK_TRACES = {0: "NOC", 3: "Sex"}
+
+# The gender bars of the All Sports figure are labelled instead of showing the Sex values
+SEX_LABELS = {"Male": "M", "Female": "F"}
+
+
+def normalize(selection) -> dict:
+    '''
+    returns selection with its columns in BITMAP_COLUMNS order, the values of each sorted and columns without values left out.
+    raises ValueError for anything that isn't a selection
+    '''
+    if not isinstance(selection, dict):
+        raise ValueError(f"a selection is a dict of column -> list of values, got {selection!r}")
+
+    unknown = [column for column in selection if column not in dataset.BITMAP_COLUMNS]
+    if unknown:
+        raise ValueError(f"can't select on {unknown}, expected columns of {dataset.BITMAP_COLUMNS}")
+
+    normalized = {}
+    for column in dataset.BITMAP_COLUMNS:
+        values = selection.get(column) or []
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"the values of {column} should be a list of strings, got {values!r}")
+        if values:
+            normalized[column] = sorted(set(values))
+
+    return normalized
+
+
+def token(selection) -> str:
+    '''
+    returns the selection as compact JSON, the same for every selection of the same rows
+    '''
+    return json.dumps(normalize(selection), separators=(",", ":"))
+
+
+def parse(text) -> dict:
+    '''
+    returns the normalized selection of a JSON text, raises ValueError if it isn't one
+    '''
+    return normalize(json.loads(text))
+
+
+def toggle(selection, column, value) -> dict:
+    '''
+    returns selection with value added to the values of column, or removed if it's already one of them
+    '''
+    values = list((selection or {}).get(column) or [])
+    values = [other for other in values if other != value] if value in values else values + [value]
+
+    return normalize({**(selection or {}), column: values})
+
+
+def clicked_value(click_data, column):
+    '''
+    returns the value of column of the clicked bar in the clickData of a graph, None if nothing was clicked
+    '''
+    if not click_data or not click_data.get("points"):
+        return None
+
+    value = click_data["points"][0].get("x")
+    if column == "Sex":
+        value = SEX_LABELS.get(value, value)
+
+    return value if isinstance(value, str) else None
+
+
+def sport_click(click_data):
+    '''
+    returns the column and value a click on the All Sports figure selects, None for a trace without a linked column
+    '''
+    if not click_data or not click_data.get("points"):
+        return None
+
+    column = SPORT_CLICK_TRACES.get(click_data["points"][0].get("curveNumber"))
+    value = clicked_value(click_data, column) if column is not None else None
+
+    return (column, value) if value is not None else None
+
+
+def describe(selection) -> str:
+    if not selection:
+        return "Click a bar in the Start or All Sports charts to filter the linked charts"
+
+    return "Filtered by " + " · ".join(f"{column}: {', '.join(values)}" for column, values in selection.items())
+
+
+def _medal_cube(selection):
+    cube = dataset.select_medal_cube(selection)
+
+    # With one sex selected every row of a team medal counts, like medal_table(..., by_sex=True)
+    if len(selection.get("Sex", [])) == 1:
+        cube = cube.assign(Count=cube["SexCount"])
+
+    return cube
+
+
+def linked_figure(graph_id, selection):
+    '''
+    returns the figure of a linked graph of the Start tab drawn from the rows of selection
+    '''
+    selection = normalize(selection)
+
+    if graph_id == "most-medals-by-country":
+        return gm.most_medals_by_country(dataset.athletes(), cube=_medal_cube(selection))
+
+    # The gender charts only count rows, popcounts of the bitmaps are enough
+    bitmaps = dataset.bitmaps()
+    if graph_id == "gender-distribution":
+        return gm.gender_distribution(None, counts=bitmaps.count(bitmaps.bitmap(selection), "Sex"))
+    if graph_id == "gender-distribution-by-games":
+        return gm.gender_distribution_by_games(None, counts=bitmaps.count_pairs(bitmaps.bitmap(selection), "Games", "Sex"))
+
+    raise ValueError(f"{graph_id!r} isn't a linked graph, expected one of {list(LINKED_GRAPHS)}")
+
+
+def sport_update(sport, selection):
+    '''
+    returns the All Sports figure update of sport (sport_store.sport_update) drawn from the rows of selection
+    '''
+    selection = {**normalize(selection), "Sport": [sport]}
+
+    return sport_store.sport_update(sport, dataset.select(selection), cube=_medal_cube(selection))
@@ -1,26 +1,158 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import hashlib as hl
-import seaborn as sns
 import plotly_express as px 
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import athlete_cache
+import query_backend as qb
 
 
-def read_athlete_events(file_path = "athlete_events.csv") -> pd.DataFrame:
+# Below this many unseen names hashing in the current process is faster than starting a process pool
+PARALLEL_HASH_THRESHOLD = 250_000
+HASH_BATCH_SIZE = 50_000
+
+# name -> sha256 hex digest, shared by every hash_column call in the process. It is never written to disk: it would hold
+# every name in plain text, and hashing all distinct names of athlete_events.csv again takes about 50 ms
+_name_digests = {}
+
+
+def read_athlete_events(file_path = "athlete_events.csv", use_cache=True) -> pd.DataFrame:
+    '''
+    returns the athlete events of the csv file with names hashed, in the compact schema of compact_frame
+    '''
+    if use_cache:
+        df = athlete_cache.load_cache(file_path)
+        if df is not None:
+            return compact_frame(df)
+
     df = pd.read_csv(file_path)
     df = hash_column(df, "Name")
+    df = compact_frame(df)
+
+    if use_cache:
+        # A missing cache only costs speed, so a read-only checkout should still work
+        try:
+            athlete_cache.write_cache(df, file_path)
+        except OSError:
+            pass
 
     return df
 
 
-def group_medals(df: pd.DataFrame, group_by="NOC"):
-    df_medals = df.copy()
-    df_medals["Medal"] = df_medals["Medal"].fillna("No Medal")
+def rebuild_athlete_cache(file_path = "athlete_events.csv"):
+    '''
+    parses the csv file and rewrites its columnar cache regardless of the current cache state
+    '''
+    df = read_athlete_events(file_path, use_cache=False)
+    return athlete_cache.write_cache(df, file_path)
+
+
+# Numeric columns stored as float32 when that keeps every value exact, e.g. whole ages and heights or half kilograms
+FLOAT32_COLUMNS = ["Age", "Height", "Weight"]
+
+# Integer columns stored in the smallest integer type their values fit in
+SMALL_INTEGER_COLUMNS = ["ID", "Year"]
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    returns df with categorical text columns (athlete_cache.CATEGORICAL_COLUMNS, with sorted categories),
+    small integer types and float32 where no value changes. columns already in a compact type are left as they are
+    '''
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in athlete_cache.CATEGORICAL_COLUMNS and values.dtype == object:
+            values = values.astype("category")
+        elif column in SMALL_INTEGER_COLUMNS and values.dtype == np.int64:
+            values = pd.to_numeric(values, downcast="integer")
+        elif column in FLOAT32_COLUMNS and values.dtype == np.float64:
+            narrowed = values.astype(np.float32)
+            if np.array_equal(narrowed.to_numpy(dtype=np.float64), values.to_numpy(), equal_nan=True):
+                values = narrowed
+        columns[column] = values
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def append_rows(df: pd.DataFrame, df_delta: pd.DataFrame) -> pd.DataFrame:
+    '''
+    returns the rows of df followed by the rows of df_delta in the compact schema.
+    categories are merged and kept sorted, so the result is the same as compacting all rows at once
+    '''
+    columns = {}
+    for column in df.columns:
+        values, delta = df[column], df_delta[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories = values.cat.categories.union(pd.Index(delta.dropna().unique(), dtype=object))
+            if len(categories) != len(values.cat.categories):
+                values = values.cat.set_categories(categories)
+            delta = pd.Series(pd.Categorical(delta, categories=values.cat.categories), index=delta.index)
+        columns[column] = pd.concat([values, delta], ignore_index=True)
+
+    # Numbers are concatenated in a type holding both, a 64 bit result is narrowed again
+    return compact_frame(pd.DataFrame(columns, copy=False))
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    returns the type and the bytes used by every column of df, strings counted in full
+    '''
+    usage = df.memory_usage(index=False, deep=True)
+    report = pd.DataFrame({"dtype": df.dtypes.astype(str), "bytes": usage})
+    report.loc["Total"] = ["", usage.sum()]
+
+    return report
 
-    # Drop duplicates ensures that team medals count as one medal
-    df_medals = df_medals.drop_duplicates(subset=["Event", "Games", "Team", "Medal"])
 
-    medal_counts = df_medals.groupby([group_by, "Medal"]).size().unstack(fill_value=0)
+# Team medals are collapsed on these columns, so a relay gold counts as one medal
+MEDAL_KEYS = ["Event", "Games", "Team", "Medal"]
+
+# Columns the medal cube is aggregated over
+CUBE_DIMENSIONS = ["NOC", "Sport", "Games", "Season", "Sex", "Medal"]
+
+
+def medal_events(df: pd.DataFrame, dimensions=CUBE_DIMENSIONS):
+    '''
+    returns the medal fact table of df, one row per team medal and sex. rows without a medal are kept as "No Medal".
+    Count is 1 on the row a team medal is counted on when both sexes are counted together,
+    every row counts once when counting one sex at a time
+    '''
+    df_medals = df[list(dict.fromkeys(dimensions + MEDAL_KEYS + ["Sex"]))]
+    medals = df_medals["Medal"]
+    if isinstance(medals.dtype, pd.CategoricalDtype):
+        medals = medals.cat.set_categories(medals.cat.categories.union(["No Medal"]))
+    df_medals = df_medals.assign(Medal=medals.fillna("No Medal"))
+
+    counted = np.zeros(len(df_medals), dtype=int)
+    counted[qb.first_rows(df_medals, MEDAL_KEYS)] = 1
+    df_medals = df_medals.assign(Count=counted)
+    df_medals = qb.drop_duplicates(df_medals, MEDAL_KEYS + ["Sex"])
+
+    return df_medals
+
+
+def medal_cube(df: pd.DataFrame, dimensions=CUBE_DIMENSIONS):
+    '''
+    returns medal counts of df aggregated over dimensions.
+    Count is the number of medals with team medals collapsed, SexCount the same count when only one sex is selected
+    '''
+    df_medals = medal_events(df, dimensions).assign(SexCount=1)
+
+    return qb.sum(df_medals, dimensions, ["Count", "SexCount"]).reset_index()
+
+
+def medal_table(cube: pd.DataFrame, group_by="NOC", by_sex=False):
+    '''
+    returns Bronze, Silver, Gold and Total medals per group_by value of a medal cube or a slice of one.
+    by_sex should be True when the cube has been sliced to one sex
+    '''
+    medal_counts = cube.groupby([group_by, "Medal"], observed=True)["SexCount" if by_sex else "Count"].sum().unstack(fill_value=0)
+
+    # Groups without any counted row in the slice, e.g. a team member of another sex got the medal, aren't part of it
+    medal_counts = medal_counts[medal_counts.sum(axis=1) > 0]
 
     # If count for the medal type is missing, set 0 to the column
     for medal in ["Bronze", "Silver", "Gold"]:
@@ -36,7 +168,22 @@ def group_medals(df: pd.DataFrame, group_by="NOC"):
     return medal_counts
 
 
+def group_medals(df: pd.DataFrame, group_by="NOC", cube: pd.DataFrame = None):
+    '''
+    counts medals per group_by value of df. cube can be passed when a medal cube of df is already computed
+    '''
+    if cube is None:
+        dimensions = CUBE_DIMENSIONS if group_by in CUBE_DIMENSIONS else CUBE_DIMENSIONS + [group_by]
+        cube = medal_cube(df, dimensions)
+
+    return medal_table(cube, group_by)
+
+
 def plot_top_medals(df: pd.DataFrame, limit=10, group_by='NOC') -> None:
+    # Imported here since the dashboard never plots with these and they make up most of its import time
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     medal_counts = group_medals(df, group_by)
 
     medal_counts = medal_counts.head(limit)
@@ -47,23 +194,57 @@ def plot_top_medals(df: pd.DataFrame, limit=10, group_by='NOC') -> None:
     plt.show()
 
 
-def hash_column(df, column): 
+def hash_column(df, column, remember=True): 
     '''
     anonymizes specified column on passed df
     drops specified column
     returns modified df
     '''
-    hashed_column= df[column].apply(lambda row_value: hl.sha256(row_value.encode()).hexdigest())
+    hashed_column = hash_values(df[column], remember)
     df.insert(1,"Hash", hashed_column)
     df = df.drop(columns=[column])
     return df
 
 
-def get_NOC_color():
+def hash_values(values: pd.Series, remember=True) -> pd.Series:
+    '''
+    returns the sha256 hex digest of every value.
+    each distinct value is hashed once, and only if it isn't already in the in-memory digest cache.
+    with remember=False new digests aren't added to the cache, so it doesn't grow with every value ever hashed
+    '''
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    unique_digests = list(map(_name_digests.get, uniques))
+    unseen = [value for value, digest in zip(uniques, unique_digests) if digest is None]
+
+    if unseen:
+        if len(unseen) >= PARALLEL_HASH_THRESHOLD:
+            batches = [unseen[i:i + HASH_BATCH_SIZE] for i in range(0, len(unseen), HASH_BATCH_SIZE)]
+            with ProcessPoolExecutor() as executor:
+                digests = [digest for batch in executor.map(_sha256_batch, batches) for digest in batch]
+        else:
+            digests = _sha256_batch(unseen)
+
+        if not remember:
+            digests = dict(zip(unseen, digests))
+            unique_digests = [digest if digest is not None else digests[value] for value, digest in zip(uniques, unique_digests)]
+            return pd.Series(np.array(unique_digests, dtype=object)[codes], index=values.index)
+
+        _name_digests.update(zip(unseen, digests))
+        unique_digests = list(map(_name_digests.get, uniques))
+
+    return pd.Series(np.array(unique_digests, dtype=object)[codes], index=values.index)
+
+
+def _sha256_batch(values):
+    return [hl.sha256(value.encode()).hexdigest() for value in values]
+
+
+def get_NOC_color(df: pd.DataFrame = None):
     '''
     Used for consistent color for every country.
     '''
-    df = read_athlete_events()
+    if df is None:
+        df = read_athlete_events()
 
     # Chat GPT is used for this solution.
     # "I want to dynamically assign unique colors to each country in my DataFrame column NOC for a Plotly bar chart. 
@@ -79,6 +260,91 @@ def get_NOC_color():
     return country_colors
 
 
+def box_statistics(df: pd.DataFrame, group_by, value, max_outliers=100) -> pd.DataFrame:
+    '''
+    returns q1, median, q3, lowerfence, upperfence and a sample of the outliers of value for every group, in group order.
+    all groups are computed in one pass over the sorted values, the same way plotly.js computes a box from raw data
+    '''
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+    df_values = df[group_by + [value]].dropna().sort_values(group_by + [value])
+
+    sizes = df_values.groupby(group_by, sort=True, observed=True).size()
+    if sizes.empty:
+        # No group has a value, e.g. a country without ages. An empty frame draws an empty chart like px.box did
+        columns = group_by + ["count", "q1", "median", "q3", "lowerfence", "upperfence", "outliers"]
+        return pd.DataFrame({column: pd.Series(dtype=object if column == "outliers" else float) for column in columns})
+
+    values = df_values[value].to_numpy(dtype=float)
+    n = sizes.to_numpy()
+    starts = (np.cumsum(n) - n).astype(int)
+
+    def interpolate(p):
+        # plotly.js Lib.interp: linear interpolation at position p * n - 0.5, clamped to the first and last value
+        position = np.clip(p * n - 0.5, 0, n - 1)
+        low = np.floor(position).astype(int)
+        high = np.ceil(position).astype(int)
+        fraction = position - low
+        return fraction * values[starts + high] + (1 - fraction) * values[starts + low]
+
+    stats = sizes.rename("count").reset_index()
+    stats["q1"] = interpolate(0.25)
+    stats["median"] = interpolate(0.5)
+    stats["q3"] = interpolate(0.75)
+
+    # The whiskers end at the last values inside 1.5 IQR from the box
+    iqr = stats["q3"].to_numpy() - stats["q1"].to_numpy()
+    ends = starts + n
+    low_limit = np.repeat(stats["q1"].to_numpy() - 1.5 * iqr, n)
+    high_limit = np.repeat(stats["q3"].to_numpy() + 1.5 * iqr, n)
+    first_inside = np.minimum(_first_true(values >= low_limit, starts, ends), ends - 1)
+    last_inside = np.maximum(_last_true(values <= high_limit, starts, ends), starts)
+
+    stats["lowerfence"] = np.minimum(stats["q1"].to_numpy(), values[first_inside])
+    stats["upperfence"] = np.maximum(stats["q3"].to_numpy(), values[last_inside])
+
+    outliers = []
+    for start, end, low, high in zip(starts, ends, stats["lowerfence"], stats["upperfence"]):
+        group_values = values[start:end]
+        group_outliers = group_values[(group_values < low) | (group_values > high)]
+        if len(group_outliers) > max_outliers:
+            group_outliers = group_outliers[np.linspace(0, len(group_outliers) - 1, max_outliers).astype(int)]
+        outliers.append(group_outliers.tolist())
+    stats["outliers"] = outliers
+
+    return stats
+
+
+def _first_true(mask, starts, ends):
+    # Position of the first True in every [start, end) segment of mask, end if there is none
+    positions = np.where(mask, np.arange(len(mask)), len(mask))
+    first = np.minimum.reduceat(positions, starts) if len(starts) else np.array([], dtype=int)
+    return np.minimum(first, ends)
+
+
+def _last_true(mask, starts, ends):
+    # Position of the last True in every [start, end) segment of mask, start - 1 if there is none
+    positions = np.where(mask, np.arange(len(mask)), -1)
+    last = np.maximum.reduceat(positions, starts) if len(starts) else np.array([], dtype=int)
+    return np.where(last >= starts, last, starts - 1)
+
+
+def histogram_counts(df: pd.DataFrame, value, group_by, bin_size=1) -> pd.DataFrame:
+    '''
+    returns the number of rows per group in fixed width bins of value.
+    the index holds the left edge of every bin from the lowest to the highest value, the columns are the groups
+    '''
+    df_values = df[[group_by, value]].dropna()
+    if df_values.empty:
+        return pd.DataFrame()
+
+    bins = np.floor(df_values[value].to_numpy(dtype=float) / bin_size).astype(int)
+    counts = df_values.groupby([bins, df_values[group_by].to_numpy()]).size().unstack(fill_value=0)
+    counts = counts.reindex(np.arange(bins.min(), bins.max() + 1), fill_value=0)
+    counts.index = counts.index * bin_size
+
+    return counts
+
+
 def round_down_to_nearest_ten(number):
     return math.floor(number / 10) * 10
 
@@ -0,0 +1,341 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import data_utils
+from athlete_model import AthleteModel
+from bitmap_index import BitmapIndex
+from metrics import traced
+
+# Every view handed out shares memory with the loaded frame, copy on write keeps callers from changing it
+pd.options.mode.copy_on_write = True
+
+DATA_FILE = "athlete_events.csv"
+
+# Columns with a row index, see partition()
+INDEXED_COLUMNS = ["Sport", "NOC", "Games", "Season"]
+
+# Unique athlete views (athlete_model.VIEWS) and the column their rows are indexed by, built by preload(). see unique_athletes()
+UNIQUE_INDEXES = [("sport_games", "Sport"), ("noc_games", "NOC"), ("noc_games_name", "NOC")]
+
+# Columns with a bitmap index over the frame and the medal cube, see bitmaps()
+BITMAP_COLUMNS = data_utils.CUBE_DIMENSIONS
+
+# Columns whose overall min/max is reported by append(), figures scale their axes to them
+RANGE_COLUMNS = ["Age", "Height", "Weight"]
+
+
+class _State:
+    '''
+    the loaded frame, the size of the csv file it was read from and everything derived from it.
+    an append replaces the whole state, so a reader never mixes a frame with the index of another one
+    '''
+    def __init__(self, frame: pd.DataFrame, source_size, derived=None) -> None:
+        self.frame = frame
+        self.source_size = source_size
+        self.derived = derived if derived is not None else {}
+
+
+    def get(self, name, build):
+        if name not in self.derived:
+            self.derived[name] = build(self)
+        return self.derived[name]
+
+
+_state = None
+_version = 0
+_load_lock = threading.RLock()
+
+
+def _current() -> _State:
+    global _state
+
+    # Callbacks and background warm-up may ask for the frame at the same time, only one of them loads it
+    if _state is None:
+        with _load_lock:
+            if _state is None:
+                # The size is taken before reading, rows appended while the file is read are picked up by the next append()
+                source_size = os.path.getsize(DATA_FILE) if os.path.exists(DATA_FILE) else None
+                _state = _State(data_utils.read_athlete_events(DATA_FILE), source_size)
+
+    return _state
+
+
+def _athletes() -> pd.DataFrame:
+    return _current().frame
+
+
+def athletes() -> pd.DataFrame:
+    '''
+    returns a read-only view of the athlete frame, loaded once per process
+    '''
+    return _athletes().copy(deep=False)
+
+
+def _build_index(df: pd.DataFrame) -> dict:
+    '''
+    maps column -> value -> sorted row positions for every column in INDEXED_COLUMNS
+    '''
+    return {column: df.groupby(column, sort=False, observed=True).indices for column in INDEXED_COLUMNS}
+
+
+def _extend_index(index: dict, df_delta: pd.DataFrame, offset) -> dict:
+    '''
+    returns index with the rows of df_delta added, their positions start at offset. only values in df_delta are copied
+    '''
+    extended = {}
+    for column, delta_positions in _build_index(df_delta).items():
+        extended[column] = dict(index[column])
+        for value, positions in delta_positions.items():
+            previous = extended[column].get(value)
+            positions = positions + offset
+            extended[column][value] = positions if previous is None else np.concatenate([previous, positions])
+
+    return extended
+
+
+def _take(df: pd.DataFrame, index: dict, column, values) -> pd.DataFrame:
+    column_index = index[column]
+    empty = np.array([], dtype=np.intp)
+
+    if isinstance(values, (list, tuple, set)):
+        positions = np.sort(np.concatenate([column_index.get(value, empty) for value in values] or [empty]))
+    else:
+        positions = column_index.get(values, empty)
+
+    return df.take(positions)
+
+
+def _row_index(state: _State = None) -> dict:
+    return (state or _current()).get("row_index", lambda state: _build_index(state.frame))
+
+
+@traced("filter")
+def partition(column, values) -> pd.DataFrame:
+    '''
+    returns the rows where column equals values, or any of values if a list is passed.
+    rows are looked up in the row index so the cost depends on the size of the partition, not the frame
+    '''
+    state = _current()
+    return _take(state.frame, _row_index(state), column, values)
+
+
+def _medal_cube(state: _State = None) -> pd.DataFrame:
+    return (state or _current()).get("medal_cube", lambda state: data_utils.medal_cube(state.frame))
+
+
+def _medal_cube_index(state: _State = None) -> dict:
+    return (state or _current()).get("medal_cube_index", lambda state: _build_index(_medal_cube(state)))
+
+
+@traced("filter")
+def medal_cube(column=None, values=None) -> pd.DataFrame:
+    '''
+    returns the medal cube of the whole frame, or the slice of it where column equals values (see partition)
+    '''
+    state = _current()
+    if column is None:
+        return _medal_cube(state).copy(deep=False)
+
+    return _take(_medal_cube(state), _medal_cube_index(state), column, values)
+
+
+def _bitmaps(state: _State = None) -> BitmapIndex:
+    return (state or _current()).get("bitmaps", lambda state: BitmapIndex(state.frame, BITMAP_COLUMNS))
+
+
+def _medal_cube_bitmaps(state: _State = None) -> BitmapIndex:
+    return (state or _current()).get("medal_cube_bitmaps", lambda state: BitmapIndex(_medal_cube(state), BITMAP_COLUMNS))
+
+
+def bitmaps() -> BitmapIndex:
+    '''
+    returns the bitmap index of BITMAP_COLUMNS over the rows of the frame
+    '''
+    return _bitmaps()
+
+
+@traced("filter")
+def select(selection) -> pd.DataFrame:
+    '''
+    returns the rows of the selection, a dict of column -> list of values (see bitmap_index.BitmapIndex).
+    rows are looked up in the bitmap index, so any combination of columns costs a few passes over len(frame) / 64 words
+    '''
+    state = _current()
+    index = _bitmaps(state)
+    return state.frame.take(index.positions(index.bitmap(selection)))
+
+
+@traced("filter")
+def select_medal_cube(selection) -> pd.DataFrame:
+    '''
+    returns the rows of the medal cube in the selection, see select()
+    '''
+    state = _current()
+    index = _medal_cube_bitmaps(state)
+    return _medal_cube(state).take(index.positions(index.bitmap(selection)))
+
+
+def _model(state: _State = None) -> AthleteModel:
+    return (state or _current()).get("model", lambda state: AthleteModel(state.frame))
+
+
+def model() -> AthleteModel:
+    '''
+    returns the normalized athlete, games, event and participation tables of the frame (athlete_model.py)
+    '''
+    return _model()
+
+
+def _unique_index(state: _State, view, column) -> dict:
+    # The frame row positions of view by value of column, like the row index of partition() but for the rows of one view
+    def build(state):
+        positions = _model(state).unique_positions(view)
+        view_values = state.frame[column].take(positions)
+        groups = view_values.groupby(view_values, sort=False, observed=True).indices
+        return {column: {value: positions[group] for value, group in groups.items()}}
+
+    return state.get(("unique_index", view, column), build)
+
+
+@traced("filter")
+def unique_athletes(view, column=None, values=None) -> pd.DataFrame:
+    '''
+    returns the first row of every athlete of view (athlete_model.VIEWS) in the frame, or in its partition where
+    column equals values (see partition). the rows are looked up in the model's precomputed positions, nothing is deduplicated
+    '''
+    state = _current()
+    if column is None:
+        return state.frame.take(_model(state).unique_positions(view))
+
+    return _take(state.frame, _unique_index(state, view, column), column, values)
+
+
+def _nor_athletes() -> pd.DataFrame:
+    return _current().get("nor_athletes", lambda state: _take(state.frame, _row_index(state), "NOC", "NOR"))
+
+
+def nor_athletes() -> pd.DataFrame:
+    return _nor_athletes().copy(deep=False)
+
+
+def noc_colors() -> dict:
+    return _current().get("noc_colors", lambda state: data_utils.get_NOC_color(state.frame))
+
+
+def sport_options() -> list:
+    return _current().get("sport_options", lambda state: [{"label": sport, "value": sport} for sport in sorted(state.frame["Sport"].unique())])
+
+
+def _noc_options(state: _State) -> list:
+    # NOCs have no names in the data, each one is labelled with the team most of its entries are under
+    sizes = state.frame.groupby(["NOC", "Team"], observed=True).size().sort_values(ascending=False, kind="stable")
+    teams = sizes.reset_index().drop_duplicates("NOC")
+
+    options = [{"label": f"{team} ({noc})", "value": noc} for noc, team in zip(teams["NOC"], teams["Team"])]
+    return sorted(options, key=lambda option: option["label"])
+
+
+def noc_options() -> list:
+    return _current().get("noc_options", _noc_options)
+
+
+def preload():
+    '''
+    loads the frame and builds everything derived from it, a pre-fork server calls this once before starting its workers
+    '''
+    _row_index()
+    _medal_cube_index()
+    _bitmaps()
+    _medal_cube_bitmaps()
+    _model()
+    for view, column in UNIQUE_INDEXES:
+        _unique_index(_current(), view, column)
+    _nor_athletes()
+    noc_colors()
+    sport_options()
+    noc_options()
+
+
+def is_loaded() -> bool:
+    return _state is not None
+
+
+def source_size():
+    '''
+    returns the size of the csv file the loaded frame was read from, None when no frame is loaded
+    '''
+    state = _state
+    return state.source_size if state is not None else None
+
+
+def append(df_delta: pd.DataFrame, source_size=None) -> dict:
+    '''
+    adds the rows of df_delta (hashed like read_athlete_events) to the loaded frame. the row index and medal cube
+    are extended instead of rebuilt, other derived results are rebuilt when next asked for.
+    source_size is the size of the csv file including df_delta, a frame read from at least that much already has the rows.
+    returns the change set: the appended INDEXED_COLUMNS values, the RANGE_COLUMNS whose min or max moved
+    and the version after the append
+    '''
+    global _state, _version
+
+    changes = {
+        "rows": len(df_delta),
+        "values": {column: set(df_delta[column].dropna().unique()) for column in INDEXED_COLUMNS},
+        "ranges": set(RANGE_COLUMNS),
+    }
+
+    with _load_lock:
+        state = _state
+        # Without a loaded frame there is nothing to extend, the next load reads the appended file
+        if state is not None and (source_size is None or state.source_size is None or state.source_size < source_size):
+            frame = data_utils.append_rows(state.frame, df_delta)
+            df_delta = frame.iloc[len(state.frame):]
+
+            changes["ranges"] = {
+                column for column in RANGE_COLUMNS
+                if df_delta[column].min() < state.frame[column].min() or df_delta[column].max() > state.frame[column].max()
+            }
+
+            derived = {}
+            if "row_index" in state.derived:
+                derived["row_index"] = _extend_index(state.derived["row_index"], df_delta, len(state.frame))
+            if "medal_cube" in state.derived:
+                derived["medal_cube"] = _extend_medal_cube(state.derived["medal_cube"], frame, derived.get("row_index"), changes["values"]["Games"])
+
+            # The state is replaced before the version changes, a cache key taken with the new version never gets old data
+            _state = _State(frame, source_size if source_size is not None else state.source_size, derived)
+
+        _version += 1
+        changes["version"] = _version
+
+    return changes
+
+
+def _extend_medal_cube(cube: pd.DataFrame, frame: pd.DataFrame, index, games) -> pd.DataFrame:
+    # Team medals are collapsed within an event of one Games, so the cube rows of the other Games can't change
+    # and only the appended Games are aggregated again
+    games = list(games)
+    df_games = _take(frame, index, "Games", games) if index is not None else frame[frame["Games"].isin(games)]
+    cube = data_utils.append_rows(cube[~cube["Games"].isin(games)], data_utils.medal_cube(df_games))
+
+    # Same row order as a cube aggregated from the whole frame
+    return cube.sort_values(data_utils.CUBE_DIMENSIONS, ignore_index=True)
+
+
+def version() -> int:
+    '''
+    increases every time the registry is cleared or appended to, used to key caches of derived results
+    '''
+    return _version
+
+
+def clear():
+    '''
+    drops the loaded frame and everything derived from it, the next call reloads from DATA_FILE
+    '''
+    global _state, _version
+
+    with _load_lock:
+        _state = None
+        _version += 1
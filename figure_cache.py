@@ -0,0 +1,153 @@
+import threading
+from collections import OrderedDict
+import dataset
+import sport_store
+from serialization import encode_figure
+
+
+class FigureCache:
+    '''
+    size bounded LRU cache of encoded plotly figures (see serialization.EncodedFigure)
+    '''
+    def __init__(self, max_entries) -> None:
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key):
+        with self._lock:
+            figure = self._entries.get(key)
+            if figure is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+            return figure
+
+
+    def peek(self, key):
+        '''
+        returns the figure for key without counting a lookup or making it recently used, None if it isn't cached
+        '''
+        with self._lock:
+            return self._entries.get(key)
+
+
+    def put(self, key, figure):
+        with self._lock:
+            self._entries[key] = figure
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def get_or_build(self, key, build):
+        '''
+        returns the encoded figure for key, build is called to create the figure on a miss
+        '''
+        figure = self.get(key)
+        if figure is None:
+            figure = encode_figure(build())
+            self.put(key, figure)
+
+        return figure
+
+
+    def invalidate(self, predicate=None):
+        '''
+        drops every entry whose key matches predicate, or all entries if no predicate is passed
+        '''
+        with self._lock:
+            for key in [key for key in self._entries if predicate is None or predicate(key)]:
+                del self._entries[key]
+
+
+    def rekey(self, function):
+        '''
+        replaces every key by function(key), entries for which it returns None are dropped
+        '''
+        with self._lock:
+            entries = OrderedDict()
+            for key, figure in self._entries.items():
+                new_key = function(key)
+                if new_key is not None:
+                    entries[new_key] = figure
+            self._entries = entries
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def build_sport_update(sport, progress=None):
+    '''
+    builds the All Sports figure update of sport (sport_store.sport_update), progress is called with (step, steps) as the build goes on
+    '''
+    progress = progress or (lambda step, steps: None)
+
+    progress(0, 3)
+    df_sport = dataset.partition("Sport", sport)
+    progress(1, 3)
+    cube = dataset.medal_cube("Sport", sport)
+    progress(2, 3)
+    update = sport_store.sport_update(sport, df_sport, cube)
+    progress(3, 3)
+
+    return update
+
+
+def sport_key(sport):
+    return ("sport_subplots", sport, dataset.version())
+
+
+def affected_sports(changes):
+    '''
+    returns the sports whose figure an append with the change set of dataset.append changes, None if it is every sport
+    '''
+    # The axes of every sport figure are scaled to the ages, weights and heights of all athletes
+    if changes is None or changes["ranges"]:
+        return None
+    return changes["values"]["Sport"]
+
+
+def carry_over(cache: FigureCache, changes, affected=affected_sports):
+    '''
+    moves the figures an append didn't change to the data set version after it, the rest are dropped.
+    keys are (kind, value, version), affected returns the values whose figures changed (see affected_sports)
+    '''
+    values = affected(changes)
+
+    def new_key(key):
+        if values is None or key[2] != changes["version"] - 1 or key[1] in values:
+            return None
+        return (key[0], key[1], changes["version"])
+
+    cache.rekey(new_key)
+
+
+def warm_up(cache: FigureCache, build_sport_update, sports=None):
+    '''
+    renders the figure update of every sport into the cache in a daemon thread and returns the thread
+    '''
+    def run():
+        for sport in sports if sports is not None else [option["value"] for option in dataset.sport_options()]:
+            cache.get_or_build(sport_key(sport), lambda: build_sport_update(sport))
+
+    thread = threading.Thread(target=run, name="figure-cache-warm-up", daemon=True)
+    thread.start()
+
+    return thread
@@ -0,0 +1,99 @@
+'''
+Builds a set of independent figures in parallel, used for the figures of the lazy tabs at startup (Layout.build_tabs).
+
+    process   forked worker processes, they share the loaded data set with the parent instead of copying it
+    thread    threads of this process, only the parts of pandas and numpy that release the GIL run in parallel
+    serial    one after another in this thread
+
+Every figure is returned encoded (serialization.EncodedFigure) with the time it took to build and encode it.
+'''
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from serialization import EncodedFigure, encode_figure
+
+MODES = ["process", "thread", "serial"]
+
+# Builds of the running build(), forked process workers look their task up here by name
+_builds = {}
+
+
+def _build(name):
+    start = time.perf_counter()
+    body = encode_figure(_builds[name]()).body
+    return body, time.perf_counter() - start
+
+
+class FigureScheduler:
+    '''
+    builds figures in a pool of workers of the passed mode, see the module docstring
+    '''
+    def __init__(self, mode="process", workers=None) -> None:
+        if mode not in MODES:
+            raise ValueError(f"unknown figure build mode {mode!r}, expected one of {MODES}")
+
+        # Without fork the workers would have to load the data set themselves
+        if mode == "process" and "fork" not in multiprocessing.get_all_start_methods():
+            mode = "thread"
+
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        # Seconds every figure of the last build() took, by name
+        self.timings = {}
+        # Seconds the last build() took from start to end
+        self.wall_time = 0.0
+
+
+    def build(self, builds) -> dict:
+        '''
+        calls every function of builds, a dict of figure name to a function returning a plotly figure.
+        returns the encoded figures by name
+        '''
+        start = time.perf_counter()
+        workers = min(self.workers, len(builds))
+
+        _builds.clear()
+        _builds.update(builds)
+        try:
+            if self.mode == "serial" or workers <= 1:
+                results = {name: _build(name) for name in builds}
+            else:
+                results = self._build_parallel(builds, workers)
+        finally:
+            _builds.clear()
+
+        self.timings = {name: seconds for name, (_, seconds) in results.items()}
+        self.wall_time = time.perf_counter() - start
+
+        return {name: EncodedFigure(body) for name, (body, _) in results.items()}
+
+
+    def _build_parallel(self, builds, workers):
+        if self.mode == "thread":
+            with ThreadPoolExecutor(workers, thread_name_prefix="figure-build") as pool:
+                return dict(zip(builds, pool.map(_build, builds)))
+
+        # A new pool per build, its workers are forked with the current data set and shut down before
+        # a pre-fork server starts its own workers
+        try:
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as pool:
+                return dict(zip(builds, pool.map(_build, builds)))
+        except (BrokenProcessPool, OSError) as error:
+            print(f"Building figures in processes failed ({error}), building them one after another", file=sys.stderr)
+            return {name: _build(name) for name in builds}
+
+
+    def report(self):
+        '''
+        returns the timings of the last build() as text, slowest figure first
+        '''
+        total = sum(self.timings.values())
+        lines = [f"Built {len(self.timings)} figures in {self.wall_time:.2f} s ({self.mode}, {self.workers} workers, "
+                 f"{total:.2f} s of build time)"]
+        for name, seconds in sorted(self.timings.items(), key=lambda item: item[1], reverse=True):
+            lines.append(f"    {name:<32} {seconds:.3f} s")
+
+        return "\n".join(lines)
@@ -0,0 +1,176 @@
+'''
+Build step rendering the dashboard's figures into a snapshot file, so a server can start without pandas or Plotly work.
+
+    python figure_snapshot.py                      # static tab figures of athlete_events.csv
+    python figure_snapshot.py --sports             # also every All Sports figure
+    python figure_snapshot.py data.csv --output snapshot.pkl
+
+The snapshot is keyed by the content hash of the csv and a fingerprint of the code building the figures,
+load() returns None when either has changed and the app falls back to building the figures itself.
+'''
+import argparse
+import hashlib as hl
+import os
+import pickle
+import sys
+import time
+from functools import partial
+import plotly
+import athlete_cache
+import config
+import dataset
+from figure_cache import build_sport_update
+from figure_scheduler import MODES, FigureScheduler
+from layout import Layout
+from serialization import EncodedFigure
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# A change to any of these files can change a figure, so it makes every snapshot stale
+FIGURE_SOURCES = ["graph_module.py", "data_utils.py", "dataset.py", "layout.py", "figure_cache.py", "query_backend.py", "athlete_model.py", "sport_store.py"]
+
+# Encodings stored in the snapshot next to the plain JSON, compressed once at build time with the slowest settings
+STORED_ENCODINGS = ["br", "gzip"]
+
+
+class FigureSnapshot:
+    '''
+    encoded figures read from a snapshot file, static tab figures by graph id and All Sports figure updates by sport
+    '''
+    def __init__(self, static, sports, sport_options, created) -> None:
+        self.static = static
+        self.sports = sports
+        self.sport_options = sport_options
+        self.created = created
+
+
+def snapshot_path(file_path):
+    '''
+    returns the default snapshot path of the passed csv file, next to its athlete cache
+    '''
+    return athlete_cache.cache_dir_for(file_path) + ".figures.pkl"
+
+
+def code_fingerprint():
+    '''
+    hash of the figure building code, the plotly version and the settings that change figures
+    '''
+    sha = hl.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for file_name in FIGURE_SOURCES:
+        with open(os.path.join(directory, file_name), "rb") as file:
+            sha.update(file.read())
+
+    settings = [plotly.__version__, config.SCATTER_GL_THRESHOLD, config.SCATTER_BIN_THRESHOLD, config.SCATTER_BINS]
+    sha.update(repr(settings).encode())
+
+    return sha.hexdigest()
+
+
+def _source_matches(file_path, source):
+    # Size and mtime are compared first like athlete_cache.is_cache_valid, the content is only hashed when they differ.
+    # The snapshot may be a read-only build artifact, so a new mtime isn't written back
+    try:
+        fingerprint = athlete_cache.source_fingerprint(file_path)
+    except OSError:
+        return False
+
+    if fingerprint["size"] != source["size"]:
+        return False
+    if fingerprint["mtime_ns"] == source["mtime_ns"]:
+        return True
+
+    return athlete_cache.file_content_hash(file_path) == source["sha256"]
+
+
+def _encoded(figure: EncodedFigure):
+    return {encoding: figure.encoded(encoding) for encoding in ["identity"] + STORED_ENCODINGS}
+
+
+def _decoded(encodings):
+    return EncodedFigure(encodings["identity"], encodings)
+
+
+def build(file_path, include_sports=False, scheduler=None):
+    '''
+    renders every static tab figure of file_path, and every All Sports figure update with include_sports.
+    the figures are built by scheduler (figure_scheduler.FigureScheduler), serially if none is passed.
+    returns the snapshot content, see write()
+    '''
+    dataset.DATA_FILE = file_path
+    dataset.clear()
+    scheduler = scheduler or FigureScheduler("serial")
+
+    static = Layout(encode_figures=True).static_figures(scheduler)
+
+    sport_options = dataset.sport_options()
+    sports = {}
+    if include_sports:
+        sports = scheduler.build({option["value"]: partial(build_sport_update, option["value"]) for option in sport_options})
+
+    return {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "source": {**athlete_cache.source_fingerprint(file_path), "sha256": athlete_cache.file_content_hash(file_path)},
+        "code": code_fingerprint(),
+        "created": time.time(),
+        "static": {graph_id: _encoded(figure) for graph_id, figure in static.items()},
+        "sports": {sport: _encoded(figure) for sport, figure in sports.items()},
+        "sport_options": sport_options,
+    }
+
+
+def write(content, path):
+    # Written next to the target and swapped in, a server starting meanwhile reads the old snapshot or the new one
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        pickle.dump(content, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load(file_path, path=None):
+    '''
+    returns the FigureSnapshot of file_path, or None when the snapshot is missing or stale
+    '''
+    path = path or snapshot_path(file_path)
+    try:
+        with open(path, "rb") as file:
+            content = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+    if content.get("format_version") != SNAPSHOT_FORMAT_VERSION or content.get("code") != code_fingerprint():
+        return None
+    if not _source_matches(file_path, content["source"]):
+        return None
+
+    return FigureSnapshot(
+        static={graph_id: _decoded(encodings) for graph_id, encodings in content["static"].items()},
+        sports={sport: _decoded(encodings) for sport, encodings in content["sports"].items()},
+        sport_options=content["sport_options"],
+        created=content["created"],
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the dashboard figures into a snapshot loaded at startup")
+    parser.add_argument("csv", nargs="?", default=dataset.DATA_FILE, help="athlete events csv file")
+    parser.add_argument("--sports", action="store_true", help="also render the All Sports figure of every sport")
+    parser.add_argument("--output", help="snapshot file, defaults to the path the app looks in")
+    parser.add_argument("--mode", choices=MODES, default=config.FIGURE_BUILD_MODE, help="how the figures are built in parallel")
+    parser.add_argument("--workers", type=int, default=config.FIGURE_BUILD_WORKERS, help="parallel figure builds, one per CPU by default")
+    args = parser.parse_args(argv)
+
+    path = args.output or config.FIGURE_SNAPSHOT_FILE or snapshot_path(args.csv)
+    start = time.perf_counter()
+    content = build(args.csv, include_sports=args.sports, scheduler=FigureScheduler(args.mode, args.workers))
+    write(content, path)
+
+    print(f"Wrote {len(content['static'])} static and {len(content['sports'])} sport figures to {path} "
+          f"in {time.perf_counter() - start:.1f} s ({os.path.getsize(path) / 2**20:.1f} MB)")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
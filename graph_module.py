@@ -1,5 +1,11 @@
+import math
+import numpy as np
 import plotly_express as px
-from data_utils import group_medals, get_NOC_color, round_down_to_nearest_ten, round_up_to_nearest_ten
+from data_utils import box_statistics, group_medals, histogram_counts, medal_cube, medal_table, round_down_to_nearest_ten, round_up_to_nearest_ten
+import dataset
+import config
+import query_backend as qb
+from metrics import span, traced
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
@@ -7,15 +13,18 @@ from plotly.subplots import make_subplots
 # This setting is used to avoid a Pandas FutureWarning (SettingWithCopyWarning)
 pd.options.mode.copy_on_write = True
 
-country_colors = get_NOC_color()
 
-
-def most_medals_by_country(df: pd.DataFrame):
-    medal_counts = group_medals(df, "NOC")
+@traced("figure")
+def most_medals_by_country(df: pd.DataFrame, cube: pd.DataFrame = None):
+    medal_counts = group_medals(df, "NOC", cube=cube)
     medal_counts = medal_counts[medal_counts["Total"] > 0]
     medal_counts = medal_counts.sort_values(by="Total", ascending=False)
     medal_counts = medal_counts.iloc[:20]
 
+    # Rows without any medal, e.g. a cross-filter selection (crossfilter.py), give an empty chart
+    if medal_counts.empty:
+        return px.bar(title="Countries with most amount of medals", labels={"x": "NOC", "y": "Number of Medals"})
+
     return px.bar(
         medal_counts, 
         x=medal_counts.index, 
@@ -27,8 +36,14 @@ def most_medals_by_country(df: pd.DataFrame):
     )
 
 
-def gender_distribution(df: pd.DataFrame):
-    gender_counts = df["Sex"].value_counts().reset_index()
+@traced("figure")
+def gender_distribution(df: pd.DataFrame, counts: pd.Series = None):
+    # counts can be passed when the rows per Sex are already counted, e.g. by a bitmap index (crossfilter.py)
+    if counts is None:
+        counts = qb.count(df, "Sex")
+
+    # Largest group first, like value_counts
+    gender_counts = counts.sort_values(ascending=False, kind="stable").reset_index()
     gender_counts.columns = ["Sex", "Count"]
 
     fig = px.bar(
@@ -43,8 +58,15 @@ def gender_distribution(df: pd.DataFrame):
     return fig
 
 
-def gender_distribution_by_games(df: pd.DataFrame):
-    dist_by_games = df.groupby("Games")["Sex"].value_counts().reset_index()
+@traced("figure")
+def gender_distribution_by_games(df: pd.DataFrame, counts: pd.Series = None):
+    # counts of the rows per Games and Sex can be passed like in gender_distribution
+    if counts is None:
+        counts = qb.count(df, ["Games", "Sex"])
+
+    # Ordered like groupby(...).value_counts(), the larger sex first within every Games
+    dist_by_games = counts.rename("count").reset_index()
+    dist_by_games = dist_by_games.sort_values(["Games", "count"], ascending=[True, False], kind="stable", ignore_index=True)
 
     fig = px.histogram(dist_by_games, x="Games", y="count", color='Sex', barmode='group')
     
@@ -58,33 +80,106 @@ def gender_distribution_by_games(df: pd.DataFrame):
     return fig
 
 
-def age_distribution_by_sports(df: pd.DataFrame, sports = ["Gymnastics","Shooting","Football","Alpine Skiing"]):
-    df_filt = df.drop_duplicates(subset=["Sport", "Games", "ID"])
+def box_traces(stats: pd.DataFrame, x, name, color, outliers=True):
+    '''
+    returns a box drawn from precomputed statistics (see box_statistics) and a marker trace with its outliers.
+    stats holds one row per x value
+    '''
+    traces = [
+        go.Box(
+            x=stats[x].tolist(),
+            q1=stats["q1"].tolist(),
+            median=stats["median"].tolist(),
+            q3=stats["q3"].tolist(),
+            lowerfence=stats["lowerfence"].tolist(),
+            upperfence=stats["upperfence"].tolist(),
+            # Without raw values plotly would draw all points of the (missing) sample, only the outliers are sent
+            boxpoints=False,
+            name=name,
+            marker_color=color,
+            legendgroup=name,
+            offsetgroup=name,
+            alignmentgroup="True",
+        )
+    ]
+
+    if outliers:
+        outlier_x = [value for value, group_outliers in zip(stats[x], stats["outliers"]) for _ in group_outliers]
+        outlier_y = [outlier for group_outliers in stats["outliers"] for outlier in group_outliers]
+        traces.append(
+            go.Scatter(
+                x=outlier_x,
+                y=outlier_y,
+                mode="markers",
+                name=name,
+                marker_color=color,
+                legendgroup=name,
+                showlegend=False,
+            )
+        )
+
+    return traces
+
+
+def box_by_category(df: pd.DataFrame, x, y, title, labels={}, category_order=None):
+    '''
+    returns a box per x value, coloured by x, looking like px.box(df, x=x, y=y, color=x) but sending only the box statistics.
+    boxes are ordered by category_order or by first appearance in df like plotly express does
+    '''
+    categories = category_order if category_order is not None else df[x].dropna().unique().tolist()
+    with span("aggregate"):
+        stats = box_statistics(df, x, y).set_index(x)
+    palette = px.colors.qualitative.Plotly
+
+    fig = go.Figure()
+    for position, category in enumerate(categories):
+        if category in stats.index:
+            fig.add_traces(box_traces(stats.loc[[category]].reset_index(), x, category, palette[position % len(palette)]))
+
+    fig.update_layout(
+        title=title,
+        boxmode="overlay",
+        legend_title_text=labels.get(x, x),
+        xaxis=dict(title_text=labels.get(x, x), categoryorder="array", categoryarray=categories),
+        yaxis_title_text=labels.get(y, y),
+    )
+
+    return fig
+
+
+@traced("figure")
+def age_distribution_by_sports(df: pd.DataFrame, sports = ["Gymnastics","Shooting","Football","Alpine Skiing"], athletes: pd.DataFrame = None):
+    # athletes can be passed when the first row of every athlete per sport and Games of df is already looked up,
+    # e.g. by dataset.unique_athletes("sport_games")
+    df_filt = athletes if athletes is not None else qb.drop_duplicates(df, ["Sport", "Games", "ID"])
     df_filt = df_filt.dropna(subset=["Age"])
-    df_filt = df_filt[df_filt["Sport"].isin(sports)]
+    df_filt = qb.select(df_filt, Sport=sports)
 
-    fig = px.box(
+    fig = box_by_category(
         df_filt,
         x="Sport",
         y="Age",
         title="Age distribution by sports",
         labels={"Age": "Agr distribution (years)", "Sport": "Sport"},
-        color="Sport"
     )
     fig.update_layout(showlegend = False)
     
     return fig
 
 
-def medal_distribution_by_country(df: pd.DataFrame, sport="Alpine Skiing", subplot=False):
-    df_all_unique_participants = df.drop_duplicates(subset=["ID"])
+@traced("figure")
+def medal_distribution_by_country(df: pd.DataFrame, sport="Alpine Skiing", subplot=False, athletes: pd.DataFrame = None):
+    # athletes can be passed when the first row of every athlete of df is already looked up, e.g. by dataset.unique_athletes("athlete")
+    df_all_unique_participants = athletes if athletes is not None else qb.drop_duplicates(df, ["ID"])
 
     # Group the data and count medals for each sport and country. Ignore rows without medals.
-    medals_by_country = df_all_unique_participants.groupby(["NOC", "Sport"])["Medal"].count().reset_index()
+    medals_by_country = qb.count(df_all_unique_participants, ["NOC", "Sport"], "Medal").reset_index()
     all_medals_df = medals_by_country[medals_by_country["Medal"] > 0]
     
     df_dist = all_medals_df[all_medals_df["Sport"]==sport].sort_values(by="Medal", ascending=False)
     
+    country_colors = dataset.noc_colors()
+
     if subplot:
         return go.Bar(
         x=df_dist["NOC"],
@@ -108,61 +203,102 @@ def medal_distribution_by_country(df: pd.DataFrame, sport="Alpine Skiing", subpl
         )
 
 
-def subplot_medal_distribution(df: pd.DataFrame, sport1, sport2, sport3, sport4):
+@traced("figure")
+def subplot_medal_distribution(df: pd.DataFrame, sport1, sport2, sport3, sport4, athletes: pd.DataFrame = None):
+    # The unique athletes are looked up once for all four sports
+    if athletes is None:
+        athletes = qb.drop_duplicates(df, ["ID"])
+
     fig = make_subplots(rows=2, cols=2, subplot_titles=[sport1, sport2, sport3, sport4])
-    fig.add_trace(medal_distribution_by_country(df, sport=sport1, subplot=True), row=1, col=1)
-    fig.add_trace(medal_distribution_by_country(df, sport=sport2, subplot=True), row=1, col=2)
-    fig.add_trace(medal_distribution_by_country(df, sport=sport3, subplot=True), row=2, col=1)
-    fig.add_trace(medal_distribution_by_country(df, sport=sport4, subplot=True), row=2, col=2)
+    fig.add_trace(medal_distribution_by_country(df, sport=sport1, subplot=True, athletes=athletes), row=1, col=1)
+    fig.add_trace(medal_distribution_by_country(df, sport=sport2, subplot=True, athletes=athletes), row=1, col=2)
+    fig.add_trace(medal_distribution_by_country(df, sport=sport3, subplot=True, athletes=athletes), row=2, col=1)
+    fig.add_trace(medal_distribution_by_country(df, sport=sport4, subplot=True, athletes=athletes), row=2, col=2)
     fig.update_layout(title=f"Medal Distribution by Country for {sport1}, {sport2}, {sport3}, {sport4}", showlegend=False)
     return fig
 
 
+@traced("figure")
 def age_by_gender_by_year(df: pd.DataFrame):
-    plot_df = df.copy()
+    plot_df = df[["Year", "Age", "Sex"]]
     plot_df["Sex"] = plot_df["Sex"].apply(lambda x: "Male" if x == "M" else "Female")
 
-    fig = px.box(
-        plot_df,
-        x="Year",
-        y="Age",
-        color="Sex",
-        points=False,
+    # Quartiles of every year and sex are computed here, the browser only gets a handful of numbers per box
+    with span("aggregate"):
+        stats = box_statistics(plot_df, ["Sex", "Year"], "Age")
+    palette = px.colors.qualitative.Plotly
+
+    fig = go.Figure()
+    for position, sex in enumerate(plot_df["Sex"].unique()):
+        fig.add_traces(box_traces(stats[stats["Sex"] == sex], "Year", sex, palette[position % len(palette)], outliers=False))
+
+    fig.update_layout(
         title="Age distribution by gender per year",
-        labels={"Sex": ""}
+        boxmode="group",
+        legend_title_text="",
+        xaxis_title_text="Year",
+        yaxis_title_text="Age",
     )
-    fig.update_layout()
 
     return fig
 
 
-def norwegian_sex_age_distribution(df: pd.DataFrame):
-    df_age = df.drop_duplicates(subset=["Games", "Hash"])
+@traced("figure")
+def norwegian_sex_age_distribution(df: pd.DataFrame, title="Ages of Norwegian Olympic athletes", athletes: pd.DataFrame = None):
+    # athletes can be passed when the first row of every athlete name per Games of df is already looked up,
+    # e.g. by dataset.unique_athletes("noc_games_name") for the rows of one country
+    df_age = athletes if athletes is not None else qb.drop_duplicates(df, ["Games", "Hash"])
     df_age["Sex"] = df_age["Sex"].apply(lambda x: "Male" if x == "M" else "Female")
 
-    fig = px.histogram(
-        df_age,
-        x="Age",
-        color="Sex", 
-        barmode="overlay", 
-        title="Ages of Norwegian Olympic athletes",
-        labels={"Sex": ""}
-    )
+    sexes = df_age["Sex"].unique()
+
+    # One bar per whole year of age, counted here instead of binning every athlete in the browser.
+    # A sex without any known age has no column in the counts and gets an empty bar trace
+    with span("aggregate"):
+        age_counts = histogram_counts(df_age, "Age", "Sex").reindex(columns=sexes, fill_value=0)
+    palette = px.colors.qualitative.Plotly
+
+    fig = go.Figure()
+    for position, sex in enumerate(sexes):
+        fig.add_trace(
+            go.Bar(
+                x=age_counts.index.tolist(),
+                y=age_counts[sex].tolist(),
+                width=1,
+                name=sex,
+                marker_color=palette[position % len(palette)],
+                opacity=0.5,
+            )
+        )
 
+    fig.update_layout(
+        title=title,
+        barmode="overlay",
+        legend_title_text="",
+        xaxis_title_text="Age",
+    )
     fig.update_traces(marker_line_width=1.5)
     fig.update_yaxes(title_text="Amount")
     
     return fig
 
 
-def norwegian_participants_sex(df: pd.DataFrame, col="Games"):
-    nor_wom = df[df["Sex"] == "F"]
-    nor_men = df[df["Sex"] == "M"]
+@traced("figure")
+def norwegian_participants_sex(df: pd.DataFrame, col="Games", title="Norwegian athletes in the Olympics", athletes: pd.DataFrame = None):
+    if athletes is not None:
+        # The first row of every athlete per col of df (e.g. dataset.unique_athletes("noc_games") for the rows of one country),
+        # counting rows counts unique participants. Sex is an athlete column, so every athlete is counted with their own
+        nor_participants = qb.count(athletes, col).reset_index(name="All")
+        nor_participants_men = qb.count(qb.select(athletes, Sex="M"), col).reset_index(name="Male")
+        nor_participants_wom = qb.count(qb.select(athletes, Sex="F"), col).reset_index(name="Female")
+    else:
+        nor_wom = qb.select(df, Sex="F")
+        nor_men = qb.select(df, Sex="M")
 
-    # Count the unique number of participants
-    nor_participants = df.groupby(col)["ID"].nunique().reset_index(name="All")
-    nor_participants_men = nor_men.groupby(col)["ID"].nunique().reset_index(name="Male")
-    nor_participants_wom = nor_wom.groupby(col)["ID"].nunique().reset_index(name="Female")
+        # Count the unique number of participants
+        nor_participants = qb.nunique(df, col, "ID").reset_index(name="All")
+        nor_participants_men = qb.nunique(nor_men, col, "ID").reset_index(name="Male")
+        nor_participants_wom = qb.nunique(nor_wom, col, "ID").reset_index(name="Female")
     
     # Merge to one DataFrame where amount of Male and Female are stored in seperate columns
     nor_participants = nor_participants.merge(nor_participants_men, on=col, how="left").fillna(0)
@@ -173,7 +309,7 @@ def norwegian_participants_sex(df: pd.DataFrame, col="Games"):
         nor_participants, 
         x=col, 
         y=["Male", "Female"],
-        title="Norwegian athletes in the Olympics",
+        title=title,
         labels={"value": "Participants", "variable": "", "Games": ""}
     )
 
@@ -182,17 +318,20 @@ def norwegian_participants_sex(df: pd.DataFrame, col="Games"):
     return fig
 
 
-def norwegian_medals_decade(df: pd.DataFrame):
+@traced("figure")
+def norwegian_medals_decade(df: pd.DataFrame, cube: pd.DataFrame = None, title="Medals won by Norwegian male and female athletes per decade"):
+    if cube is None:
+        cube = medal_cube(df)
 
-    def group_and_sort(df: pd.DataFrame, group_by):
-        return group_medals(df, group_by).sort_values(by=group_by).reset_index()[["Games", "Total"]]
+    def group_and_sort(cube: pd.DataFrame, group_by, by_sex=False):
+        return medal_table(cube, group_by, by_sex).sort_values(by=group_by).reset_index()[["Games", "Total"]]
 
-    nor_wom = df[df["Sex"] == "F"]
-    nor_men = df[df["Sex"] == "M"]
+    nor_wom = cube[cube["Sex"] == "F"]
+    nor_men = cube[cube["Sex"] == "M"]
     
-    nor_medals_all = group_and_sort(df, "Games")
-    nor_medals_men = group_and_sort(nor_men, "Games")
-    nor_medals_wom = group_and_sort(nor_wom, "Games")
+    nor_medals_all = group_and_sort(cube, "Games")
+    nor_medals_men = group_and_sort(nor_men, "Games", by_sex=True)
+    nor_medals_wom = group_and_sort(nor_wom, "Games", by_sex=True)
     
     nor_medals_decade = nor_medals_all.merge(nor_medals_men, on="Games", how="left", suffixes=("", "_Male"))
     nor_medals_decade = nor_medals_decade.merge(nor_medals_wom, on="Games", how="left", suffixes=("", "_Female")).fillna(0)
@@ -202,8 +341,9 @@ def norwegian_medals_decade(df: pd.DataFrame):
     nor_medals_decade = nor_medals_decade.groupby("Decade", as_index=False)[["Medals", "Male", "Female"]].sum()
 
     # the below code originally came from Copilot with the prompt: "Using plotly express and pandas, how can I plot multiple pie plots with subplots from row values of a dataframe?"
-    num_rows = 2
+    # Two rows of six decades, more rows for countries that competed longer
     num_cols = 6
+    num_rows = max(2, math.ceil(len(nor_medals_decade) / num_cols))
     
     fig = make_subplots(
         rows=num_rows, 
@@ -220,7 +360,7 @@ def norwegian_medals_decade(df: pd.DataFrame):
             go.Pie(
                 labels=["Male", "Female"],
                 values=[row["Male"], row["Female"]],
-                name=f"{row["Decade"]}s",
+                name=f"{row['Decade']}s",
                 textposition="inside",
                 textinfo="percent",
                 insidetextorientation="horizontal"
@@ -229,7 +369,7 @@ def norwegian_medals_decade(df: pd.DataFrame):
         )
     
     fig.update_layout(
-        title_text="Medals won by Norwegian male and female athletes per decade",
+        title_text=title,
         height=300 * num_rows, 
         showlegend=True, 
         uniformtext=dict(minsize=10, mode="hide")
@@ -239,8 +379,9 @@ def norwegian_medals_decade(df: pd.DataFrame):
     return fig
  
 
-def medal_coloured_bars(df: pd.DataFrame, col="Games", top=False):
-    df_medal_count = group_medals(df, col).sort_values(by=col)
+@traced("figure")
+def medal_coloured_bars(df: pd.DataFrame, col="Games", top=False, cube: pd.DataFrame = None):
+    df_medal_count = group_medals(df, col, cube=cube).sort_values(by=col)
     df_medal_count = df_medal_count.reset_index()
 
     if top == True:
@@ -260,28 +401,40 @@ def medal_coloured_bars(df: pd.DataFrame, col="Games", top=False):
     return fig
 
 
-def norwegian_medals_season(df: pd.DataFrame):
-    nor_medals_winter = df[df["Season"] == "Winter"].dropna(subset=["Medal"]).drop_duplicates(subset=["Event", "Games", "Team", "Medal"])
-    nor_medals_summer = df[df["Season"] == "Summer"].dropna(subset=["Medal"]).drop_duplicates(subset=["Event", "Games", "Team", "Medal"])
-    medals_winter = nor_medals_winter.groupby("Games")["Medal"].count().reset_index(name="Medals")
-    medals_summer = nor_medals_summer.groupby("Games")["Medal"].count().reset_index(name="Medals")
+@traced("figure")
+def norwegian_medals_season(df: pd.DataFrame, cube: pd.DataFrame = None, title="Norwegian seasonal medals"):
+    if cube is None:
+        cube = medal_cube(df)
+
+    def season_medals(season):
+        # Only games where at least one medal was won
+        medal_counts = medal_table(cube[cube["Season"] == season], "Games").sort_index()
+        return medal_counts.loc[medal_counts["Total"] > 0, "Total"].reset_index(name="Medals")
+
+    medals_winter = season_medals("Winter")
+    medals_summer = season_medals("Summer")
 
     fig = make_subplots(rows=1, cols=2, subplot_titles=("Winter games", "Summer games"))
 
     fig.add_trace(go.Bar(x=medals_winter["Games"], y=medals_winter["Medals"], marker_color="skyblue"), row=1, col=1)
     fig.add_trace(go.Bar(x=medals_summer["Games"], y=medals_summer["Medals"], marker_color="orange"), row=1, col=2)
 
-    fig.update_layout(title_text="Norwegian seasonal medals", showlegend=False, yaxis_title="Medals")
-    fig.update_yaxes(range=[0, 35]) 
+    fig.update_layout(title_text=title, showlegend=False, yaxis_title="Medals")
+    # Same scale on both subplots, raised for countries winning more than 35 medals at one Games
+    most_medals = pd.concat([medals_winter["Medals"], medals_summer["Medals"]]).max()
+    fig.update_yaxes(range=[0, max(35, int(most_medals) if pd.notna(most_medals) else 0)])
     fig.update_xaxes(tickangle=-90)
     
     return fig
 
 
-def top_medals_winter(df: pd.DataFrame):
-    winter_medals = df[df["Season"] == "Winter"].dropna(subset=["Medal"])
-    winter_medals = winter_medals.drop_duplicates(subset=["Event", "Games", "Team", "Medal"])
-    winter_medals = winter_medals.groupby("NOC")["Medal"].count().reset_index(name="Medals")
+@traced("figure")
+def top_medals_winter(df: pd.DataFrame, cube: pd.DataFrame = None):
+    if cube is None:
+        cube = medal_cube(df)
+
+    winter_medals = medal_table(cube[cube["Season"] == "Winter"], "NOC").sort_index()
+    winter_medals = winter_medals.loc[winter_medals["Total"] > 0, "Total"].reset_index(name="Medals")
     winter_medals = winter_medals.sort_values(by="Medals", ascending=False)
 
     fig = px.bar(
@@ -297,24 +450,26 @@ def top_medals_winter(df: pd.DataFrame):
     return fig
 
 
-def medals_by_sport_and_sex(df: pd.DataFrame, headline):
+@traced("figure")
+def medals_by_sport_and_sex(df: pd.DataFrame, headline, cube: pd.DataFrame = None):
+    if cube is None:
+        cube = medal_cube(df)
 
-    def sports_medals(df: pd.DataFrame, group_by):
-        sport_medal = df.drop_duplicates(subset=["Event", "Games", "Team", "Medal"])
-        sport_medal = sport_medal.groupby([group_by, "Medal"]).size().unstack(fill_value=0)
-        sport_medal["Total"] = sport_medal.sum(axis=1)
-        sport_medal = sport_medal.reindex(columns=["Bronze", "Silver", "Gold", "Total"])
+    def sports_medals(cube: pd.DataFrame, group_by, by_sex=False):
+        # Only groups with medals, sorted by group before sorting by Total so ties keep their order
+        sport_medal = medal_table(cube, group_by, by_sex).sort_index()
+        sport_medal = sport_medal[sport_medal["Total"] > 0]
         sport_medal = sport_medal.sort_values(by="Total", ascending=False)
         sport_medal = sport_medal.reset_index()
         
         return sport_medal
     
-    wom = df[df["Sex"] == "F"]
-    men = df[df["Sex"] == "M"]
+    wom = cube[cube["Sex"] == "F"]
+    men = cube[cube["Sex"] == "M"]
 
-    sports_medals_all = sports_medals(df, group_by="Sport")
-    sports_medals_men = sports_medals(men, group_by="Sport")
-    sports_medals_wom = sports_medals(wom, group_by="Sport")
+    sports_medals_all = sports_medals(cube, group_by="Sport")
+    sports_medals_men = sports_medals(men, group_by="Sport", by_sex=True)
+    sports_medals_wom = sports_medals(wom, group_by="Sport", by_sex=True)
 
     sports_list = sports_medals_all["Sport"].tolist()
     color_map = {sport: px.colors.qualitative.Plotly[i % len(px.colors.qualitative.Plotly)] for i, sport in enumerate(sports_list)}     # code from Copilot with the prompt: "Each value in sports_list should have a consistent colour when plotted"
@@ -332,30 +487,74 @@ def medals_by_sport_and_sex(df: pd.DataFrame, headline):
     return fig
 
 
-def height_and_weight_correlation_sport_filter(df: pd.DataFrame, sport):
-    df_filt = df.drop_duplicates(subset=["Sport", "Games", "ID"])
-    df_filt = df_filt[df_filt["Sport"] == sport]
-    gender_colors = {"M": "blue", "F": "red"}
+def weight_height_traces(df: pd.DataFrame, name, gender_colors={"M": "blue", "F": "red"}):
+    '''
+    returns the traces of a weight/height scatter of df with markers coloured by sex.
+    above config.SCATTER_GL_THRESHOLD athletes the scatter is drawn with WebGL,
+    above config.SCATTER_BIN_THRESHOLD it is replaced by one 2D histogram per sex so the payload stays bounded
+    '''
+    if len(df) <= config.SCATTER_BIN_THRESHOLD:
+        scatter = go.Scatter if len(df) <= config.SCATTER_GL_THRESHOLD else go.Scattergl
+        return [
+            scatter(
+                x=df["Weight"],
+                y=df["Height"],
+                mode="markers",
+                marker=dict(color=df["Sex"].map(gender_colors)),
+                name=name,
+            )
+        ]
 
-    fig = go.Scatter(
-        x=df_filt["Weight"],
-        y=df_filt["Height"],
-        mode="markers",
-        marker=dict(color=df_filt["Sex"].map(gender_colors)),
-        name=sport,
-    )
+    df_body = df.dropna(subset=["Weight", "Height"])
+    weights = df_body["Weight"].to_numpy(dtype=float)
+    heights = df_body["Height"].to_numpy(dtype=float)
+
+    # Shared edges for both sexes so the layers line up
+    weight_edges = np.linspace(weights.min(), weights.max() + 1, config.SCATTER_BINS + 1) if len(df_body) else np.arange(2)
+    height_edges = np.linspace(heights.min(), heights.max() + 1, config.SCATTER_BINS + 1) if len(df_body) else np.arange(2)
+
+    traces = []
+    for gender, color in gender_colors.items():
+        is_gender = (df_body["Sex"] == gender).to_numpy()
+        with span("aggregate"):
+            counts, _, _ = np.histogram2d(weights[is_gender], heights[is_gender], bins=[weight_edges, height_edges])
+
+        # Empty bins are left out so the other sex shows through
+        z = np.where(counts.T > 0, counts.T, np.nan)
+
+        traces.append(
+            go.Heatmap(
+                x=(weight_edges[:-1] + weight_edges[1:]) / 2,
+                y=(height_edges[:-1] + height_edges[1:]) / 2,
+                z=z,
+                colorscale=[[0, "rgba(255, 255, 255, 0)"], [1, color]],
+                zmin=0,
+                opacity=0.7,
+                showscale=False,
+                hovertemplate="Weight %{x:.0f} kg<br>Height %{y:.0f} cm<br>Athletes %{z}<extra></extra>",
+                name=f"{name} ({'Male' if gender == 'M' else 'Female'})",
+            )
+        )
+
+    return traces
 
-    return fig
 
+def height_and_weight_correlation_sport_filter(df: pd.DataFrame, sport, athletes: pd.DataFrame = None):
+    # athletes like in age_distribution_by_sports
+    df_filt = athletes if athletes is not None else qb.drop_duplicates(df, ["Sport", "Games", "ID"])
+    df_filt = qb.select(df_filt, Sport=sport)
 
-def subplot_weight_height_correlation(df: pd.DataFrame, sports):
+    return weight_height_traces(df_filt, name=sport)
+
+
+@traced("figure")
+def subplot_weight_height_correlation(df: pd.DataFrame, sports, athletes: pd.DataFrame = None):
     sport1, sport2, sport3, sport4 = sports
     fig = make_subplots(rows=2, cols=2, subplot_titles=[sport1, sport2, sport3, sport4])
 
-    fig.add_trace(height_and_weight_correlation_sport_filter(df, sport=sport1), row=1, col=1)
-    fig.add_trace(height_and_weight_correlation_sport_filter(df, sport=sport2), row=1, col=2)
-    fig.add_trace(height_and_weight_correlation_sport_filter(df, sport=sport3), row=2, col=1)
-    fig.add_trace(height_and_weight_correlation_sport_filter(df, sport=sport4), row=2, col=2)
+    for i, sport in enumerate([sport1, sport2, sport3, sport4]):
+        for trace in height_and_weight_correlation_sport_filter(df, sport=sport, athletes=athletes):
+            fig.add_trace(trace, row=i // 2 + 1, col=i % 2 + 1)
 
     fig.update_xaxes(title_text="Weight (kg)", range=[20, 150])
     fig.update_yaxes(title_text="Height (cm)", range=[120, 220])
@@ -364,78 +563,94 @@ def subplot_weight_height_correlation(df: pd.DataFrame, sports):
     return fig
 
 
-def weight_distribution_by_sports(df: pd.DataFrame, sports = ["Gymnastics","Shooting","Football","Alpine Skiing"]):
-    df = df.dropna(subset=["Weight"])
-
-    df_filt = df.drop_duplicates(subset=["Sport", "Games", "ID"])
-    df_filt = df_filt[df_filt["Sport"].isin(sports)]
+@traced("figure")
+def weight_distribution_by_sports(df: pd.DataFrame, sports = ["Gymnastics","Shooting","Football","Alpine Skiing"], athletes: pd.DataFrame = None):
+    # athletes like in age_distribution_by_sports. Weight is an athlete column, so rows without one can be dropped after deduplicating
+    if athletes is not None:
+        df_filt = athletes.dropna(subset=["Weight"])
+    else:
+        df = df.dropna(subset=["Weight"])
+        df_filt = qb.drop_duplicates(df, ["Sport", "Games", "ID"])
+    df_filt = qb.select(df_filt, Sport=sports)
 
-    fig = px.box(
+    fig = box_by_category(
         df_filt,
         x="Sport",
         y="Weight",
         title="Weight distribution by sports",
-        color="Sport"
     )
     fig.update_layout(showlegend = False)
     
     return fig
 
 
-def height_distribution_by_sports(df: pd.DataFrame, sports = ["Gymnastics","Shooting","Football","Alpine Skiing"]):
-    df = df.dropna(subset=["Height"])
-
-    df_filt = df.drop_duplicates(subset=["Sport", "Games", "ID"])
-    df_filt = df_filt[df_filt["Sport"].isin(sports)]
+@traced("figure")
+def height_distribution_by_sports(df: pd.DataFrame, sports = ["Gymnastics","Shooting","Football","Alpine Skiing"], athletes: pd.DataFrame = None):
+    # athletes like in weight_distribution_by_sports
+    if athletes is not None:
+        df_filt = athletes.dropna(subset=["Height"])
+    else:
+        df = df.dropna(subset=["Height"])
+        df_filt = qb.drop_duplicates(df, ["Sport", "Games", "ID"])
+    df_filt = qb.select(df_filt, Sport=sports)
 
-    fig = px.box(
+    fig = box_by_category(
         df_filt,
         x="Sport",
         y="Height",
         title="Height distribution by sports",
-        color="Sport"
     )
     fig.update_layout(showlegend = False)
     
     return fig
 
 
-def bmi_distribution_by_sports(df: pd.DataFrame, sports=["Gymnastics", "Shooting", "Football", "Alpine Skiing"]):
-    df = df.dropna(subset=["Height", "Weight"])
+@traced("figure")
+def bmi_distribution_by_sports(df: pd.DataFrame, sports=["Gymnastics", "Shooting", "Football", "Alpine Skiing"], athletes: pd.DataFrame = None):
+    # athletes like in weight_distribution_by_sports
+    if athletes is not None:
+        df = athletes.dropna(subset=["Height", "Weight"])
+    else:
+        df = df.dropna(subset=["Height", "Weight"])
 
-    df["BMI"] = df["Weight"] / (df["Height"] / 100) ** 2
+    # Weight and Height can be float32 in the loaded frame, BMI is computed in float64
+    df["BMI"] = df["Weight"].astype(float) / (df["Height"].astype(float) / 100) ** 2
 
-    df_filt = df.drop_duplicates(subset=["Sport", "Games", "ID"])
-    df_filt = df_filt[df_filt["Sport"].isin(sports)]
+    df_filt = df if athletes is not None else qb.drop_duplicates(df, ["Sport", "Games", "ID"])
+    df_filt = qb.select(df_filt, Sport=sports)
 
-    fig = px.box(
+    fig = box_by_category(
         df_filt,
         x="Sport",
         y="BMI",
         title="BMI distribution by sports",
-        color="Sport"
     )
     fig.update_layout(showlegend=False)
 
     return fig
 
 
-def bmi_distribution_by_sports_medalists(df: pd.DataFrame, sports=["Gymnastics", "Shooting", "Football", "Alpine Skiing"]):
-    df = df.dropna(subset=["Height", "Weight"])
+@traced("figure")
+def bmi_distribution_by_sports_medalists(df: pd.DataFrame, sports=["Gymnastics", "Shooting", "Football", "Alpine Skiing"], athletes: pd.DataFrame = None):
+    # athletes like in weight_distribution_by_sports
+    if athletes is not None:
+        df = athletes.dropna(subset=["Height", "Weight"])
+    else:
+        df = df.dropna(subset=["Height", "Weight"])
 
-    df["BMI"] = df["Weight"] / (df["Height"] / 100) ** 2
+    # Weight and Height can be float32 in the loaded frame, BMI is computed in float64
+    df["BMI"] = df["Weight"].astype(float) / (df["Height"].astype(float) / 100) ** 2
 
-    df_filt = df.drop_duplicates(subset=["Sport", "Games", "ID"])
-    df_filt = df_filt[df_filt["Sport"].isin(sports)]
+    df_filt = df if athletes is not None else qb.drop_duplicates(df, ["Sport", "Games", "ID"])
+    df_filt = qb.select(df_filt, Sport=sports)
     df_filt = df_filt[df_filt["Medal"].notna()]
 
-    fig = px.box(
+    fig = box_by_category(
         df_filt,
         x="Sport",
         y="BMI",
         title="BMI distribution by sports for medalists",
-        color="Sport",
-        category_orders={"Sport": sports}
+        category_order=sports,
     )
     fig.update_layout(showlegend=False)
     fig.update_yaxes(range=[11,48])
@@ -443,10 +658,17 @@ def bmi_distribution_by_sports_medalists(df: pd.DataFrame, sports=["Gymnastics",
     return fig
 
 
-def sport_subplots(df: pd.DataFrame, sport):
-    df_sport = df[df["Sport"] == sport]
-    gender_colors = {"M": "blue", "F": "red"}
+# Width of the weight (kg) and height (cm) bins of the body metrics chart of sport_subplots
+BODY_METRICS_BIN_SIZE = 2
+
+SPORT_GENDER_COLORS = {"M": "blue", "F": "red"}
 
+
+def sport_subplots_skeleton(df: pd.DataFrame):
+    '''
+    returns the 2x2 figure of sport_subplots without its data: the axes, scaled to all athletes in df, and one empty
+    trace per slot of sport_subplots_update. it is the same for every sport
+    '''
     fig = make_subplots(
         rows=2, cols=2,
         subplot_titles=[
@@ -455,85 +677,6 @@ def sport_subplots(df: pd.DataFrame, sport):
         ]
     )
 
-    def countries_with_most_medals_in_sport():
-        # Group medals by country
-        medal_counts = group_medals(df_sport)
-
-        # Filter to only get countries with medals (Total > 0),
-        # sort by total of medals, and get the top 20 countries with most medals.
-        medal_counts = medal_counts[medal_counts["Total"] > 0].sort_values(
-            by="Total", ascending=False
-        ).iloc[:20]
-
-        return go.Bar(
-            x=medal_counts.index,
-            y=medal_counts["Total"],
-            name="Medals",
-            marker=dict(
-                color=[
-                    country_colors.get(NOC, "#000000")
-                    for NOC in medal_counts.index
-                ]
-            ),
-        )
-
-    def age_distribution_by_gender():
-        traces = []
-
-        # Loop through each gender and create a histogram to visualize the age distribution for both genders.
-        for gender, color in gender_colors.items():
-            df_gender = df_sport[df_sport["Sex"] == gender]
-
-            # Every histogram is added to the traces-list
-            traces.append(
-                go.Histogram(
-                    x=df_gender["Age"],
-                    name="Male" if gender == "M" else "Female",
-                    marker_color=color,
-                    opacity=0.7,
-                )
-            )
-
-        return traces
-
-    def gender_distribution_of_sport():
-        genders = ["M", "F"]
-
-        # Ensures that "gender_counts" always includes the indexes "M" and "F", even if either is missing in df_sport["Sex"].
-        # Uses fill_value=0 to set the value to 0 for missing data.
-        gender_counts = df_sport["Sex"].value_counts().reindex(genders, fill_value=0)
-
-        return go.Bar(
-            x=["Male", "Female"],
-            y=gender_counts.values,
-            marker_color=[gender_colors[gender] for gender in genders],
-            name="Participants",
-        )
-
-    def height_and_weight_correlation():
-        return go.Scatter(
-            x=df_sport["Weight"],
-            y=df_sport["Height"],
-            mode="markers",
-            marker=dict(color=df_sport["Sex"].map(gender_colors)),
-            name="Athletes",
-        )
-
-
-    # Row 1, Col 1
-    fig.add_trace(countries_with_most_medals_in_sport(), row=1, col=1)
-
-    # Row 1, Col 2
-    for trace in age_distribution_by_gender():
-        fig.add_trace(trace, row=1, col=2)
-
-    # Row 2, Col 1
-    fig.add_trace(gender_distribution_of_sport(), row=2, col=1)
-
-    # Row 2, Col 2
-    fig.add_trace(height_and_weight_correlation(), row=2, col=2)
-
-
     fig.update_xaxes(title_text="Country (NOC)", row=1, col=1)
     fig.update_yaxes(title_text="Number of Medals", row=1, col=1)
 
@@ -547,10 +690,106 @@ def sport_subplots(df: pd.DataFrame, sport):
     fig.update_yaxes(title_text="Height (cm)", range=[round_down_to_nearest_ten(df["Height"].min()), round_up_to_nearest_ten(df["Height"].max())], row=2, col=2)
 
     fig.update_layout(
-        title=f"Statistics for {sport}",
         showlegend=False,
         height=800,
         margin=dict(l=50, r=50, t=100, b=50),
     )
 
+    # Row 1, Col 1
+    fig.add_trace(go.Bar(name="Medals"), row=1, col=1)
+
+    # Row 1, Col 2
+    for gender, color in SPORT_GENDER_COLORS.items():
+        fig.add_trace(go.Bar(name="Male" if gender == "M" else "Female", marker_color=color, opacity=0.7), row=1, col=2)
+
+    # Row 2, Col 1
+    fig.add_trace(go.Bar(x=["Male", "Female"], marker_color=list(SPORT_GENDER_COLORS.values()), name="Participants"), row=2, col=1)
+
+    # Row 2, Col 2, athletes binned by weight and height so the payload doesn't grow with the sport
+    for gender, color in SPORT_GENDER_COLORS.items():
+        fig.add_trace(
+            go.Scattergl(
+                mode="markers",
+                marker=dict(color=color, opacity=0.6),
+                hovertemplate="Weight %{x} kg<br>Height %{y} cm<br>Athletes %{text}<extra></extra>",
+                name="Male" if gender == "M" else "Female",
+            ),
+            row=2, col=2,
+        )
+
+    return fig
+
+
+def body_metric_bins(df: pd.DataFrame, gender):
+    '''
+    returns the weight/height bin centers of the athletes of gender in df and the number of athletes in each non-empty bin
+    '''
+    df_gender = df[(df["Sex"] == gender) & df["Weight"].notna() & df["Height"].notna()]
+    weight_bins = np.floor(df_gender["Weight"].to_numpy(dtype=float) / BODY_METRICS_BIN_SIZE).astype(np.int64)
+    height_bins = np.floor(df_gender["Height"].to_numpy(dtype=float) / BODY_METRICS_BIN_SIZE).astype(np.int64)
+    if not len(weight_bins):
+        return [], [], []
+
+    # One integer per (weight, height) bin ordered like the pairs, unique on it is much faster than on the pairs
+    lowest = height_bins.min()
+    heights = height_bins.max() - lowest + 1
+    keys, counts = np.unique(weight_bins * heights + (height_bins - lowest), return_counts=True)
+
+    weights = (keys // heights + 0.5) * BODY_METRICS_BIN_SIZE
+    heights = (keys % heights + lowest + 0.5) * BODY_METRICS_BIN_SIZE
+
+    return weights.tolist(), heights.tolist(), counts.tolist()
+
+
+@traced("figure")
+def sport_subplots_update(sport, df_sport: pd.DataFrame, cube: pd.DataFrame = None):
+    '''
+    returns what differs between the sport_subplots figures of two sports, drawn from the rows of df_sport: the title
+    and the data arrays of every trace of sport_subplots_skeleton, in the order of the traces
+    '''
+    country_colors = dataset.noc_colors()
+
+    with span("aggregate"):
+        # Countries with medals, the 20 with the most
+        medal_counts = group_medals(df_sport, cube=cube)
+        medal_counts = medal_counts[medal_counts["Total"] > 0].sort_values(by="Total", ascending=False).iloc[:20]
+
+        # Athletes per whole year of age for both genders, binned here so only the counts are sent
+        age_counts = histogram_counts(df_sport, "Age", "Sex").reindex(columns=list(SPORT_GENDER_COLORS), fill_value=0)
+
+        # Always both genders, 0 for one missing in the sport
+        gender_counts = df_sport["Sex"].value_counts().reindex(list(SPORT_GENDER_COLORS), fill_value=0)
+
+        body_bins = {gender: body_metric_bins(df_sport, gender) for gender in SPORT_GENDER_COLORS}
+
+    traces = [
+        {
+            "x": medal_counts.index.tolist(),
+            "y": medal_counts["Total"].tolist(),
+            "marker": {"color": [country_colors.get(NOC, "#000000") for NOC in medal_counts.index]},
+        },
+    ]
+    traces += [{"x": age_counts.index.tolist(), "y": age_counts[gender].tolist()} for gender in SPORT_GENDER_COLORS]
+    traces.append({"y": gender_counts.tolist()})
+    for weights, heights, counts in body_bins.values():
+        # text as strings, like plotly stores it in a figure
+        traces.append({"x": weights, "y": heights, "text": [str(count) for count in counts], "marker": {"size": [4 + 2 * math.sqrt(count) for count in counts]}})
+
+    return {"title": f"Statistics for {sport}", "traces": traces}
+
+
+@traced("figure")
+def sport_subplots(df: pd.DataFrame, sport, df_sport: pd.DataFrame = None, cube: pd.DataFrame = None):
+    # df_sport can be passed when the rows of the sport are already sliced out, e.g. by dataset.partition
+    if df_sport is None:
+        with span("filter"):
+            df_sport = df[df["Sport"] == sport]
+
+    fig = sport_subplots_skeleton(df)
+    update = sport_subplots_update(sport, df_sport, cube)
+
+    for trace, values in zip(fig.data, update["traces"]):
+        trace.update(values)
+    fig.update_layout(title=update["title"])
+
     return fig
@@ -0,0 +1,35 @@
+import gc
+# Not imported as config, gunicorn reads every module level name in this file as a setting and config is one of them
+import config as dashboard_config
+
+# gunicorn -c gunicorn.conf.py, every setting can be changed with the environment variables in config.py
+wsgi_app = "wsgi:server"
+bind = dashboard_config.BIND
+workers = dashboard_config.WORKERS
+threads = dashboard_config.THREADS
+preload_app = dashboard_config.PRELOAD
+
+# Building the tabs can take a while on large data sets when the workers load the app themselves
+timeout = 120
+
+if preload_app:
+    # Objects made by the preloaded app are kept out of the garbage collector, a collection in a worker
+    # would otherwise write to every page holding them and each worker would end up with its own copy
+    gc.disable()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        gc.enable()
+
+
+def post_worker_init(worker):
+    # Every worker ingests appended rows into its own copy of the data set. Started here rather than in post_fork so
+    # it also runs after the app is loaded when the workers load it themselves
+    import main
+    main.start_watching()
@@ -0,0 +1,253 @@
+'''
+Appends the rows of a delta csv (e.g. the results of a new Games) to the data set without a full reload.
+
+    python ingest.py new_games.csv                       # appends to athlete_events.csv
+    python ingest.py new_games.csv --data athlete_events.csv
+
+The delta has the columns of athlete_events.csv. Its rows are validated, only names that haven't been seen
+before are hashed, and the rows are appended to the csv and its athlete cache. A server started with OS_WATCH_DATA=1
+polls the csv (watch()) and appends the new rows to its loaded frame, only the figures the rows touch are built again.
+'''
+import argparse
+import io
+import os
+import sys
+import threading
+import pandas as pd
+import athlete_cache
+import data_utils
+import dataset
+
+# Columns of athlete_events.csv and the type every value must have
+SCHEMA = {
+    "ID": "int64",
+    "Name": "object",
+    "Sex": "object",
+    "Age": "float64",
+    "Height": "float64",
+    "Weight": "float64",
+    "Team": "object",
+    "NOC": "object",
+    "Games": "object",
+    "Year": "int64",
+    "Season": "object",
+    "City": "object",
+    "Sport": "object",
+    "Event": "object",
+    "Medal": "object",
+}
+
+REQUIRED_COLUMNS = ["ID", "Name", "Sex", "Team", "NOC", "Games", "Year", "Season", "City", "Sport", "Event"]
+
+ALLOWED_VALUES = {
+    "Sex": {"M", "F"},
+    "Season": {"Summer", "Winter"},
+    "Medal": {"Gold", "Silver", "Bronze"},
+}
+
+# Problems listed in the error of an invalid delta, per check
+MAX_REPORTED_ROWS = 5
+
+
+def validate(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    checks df against SCHEMA and returns it with its columns in csv order and typed like a loaded frame.
+    raises ValueError listing every problem found
+    '''
+    missing = [column for column in SCHEMA if column not in df.columns]
+    unknown = [column for column in df.columns if column not in SCHEMA]
+    if missing or unknown:
+        raise ValueError(f"delta columns don't match athlete_events.csv, missing: {missing}, unknown: {unknown}")
+
+    df = df[list(SCHEMA)]
+    problems = []
+
+    for column, dtype in SCHEMA.items():
+        if dtype == "object":
+            continue
+        numbers = pd.to_numeric(df[column], errors="coerce")
+        invalid = numbers.isna() & df[column].notna()
+        if dtype == "int64":
+            invalid |= numbers.notna() & (numbers % 1 != 0)
+        if invalid.any():
+            problems.append(_describe(f"{column} isn't a number", df.index[invalid]))
+        df = df.assign(**{column: numbers})
+
+    for column in REQUIRED_COLUMNS:
+        empty = df[column].isna()
+        if empty.any():
+            problems.append(_describe(f"{column} is empty", df.index[empty]))
+
+    for column, allowed in ALLOWED_VALUES.items():
+        invalid = df[column].notna() & ~df[column].isin(allowed)
+        if invalid.any():
+            problems.append(_describe(f"{column} isn't one of {sorted(allowed)}", df.index[invalid]))
+
+    if not problems:
+        mismatched = df["Games"] != df["Year"].astype(str) + " " + df["Season"]
+        if mismatched.any():
+            problems.append(_describe("Games isn't '<Year> <Season>'", df.index[mismatched]))
+
+    if problems:
+        raise ValueError("invalid delta: " + "; ".join(problems))
+
+    return df.astype(SCHEMA)
+
+
+def _describe(problem, rows):
+    shown = ", ".join(str(row) for row in rows[:MAX_REPORTED_ROWS])
+    more = f" and {len(rows) - MAX_REPORTED_ROWS} more" if len(rows) > MAX_REPORTED_ROWS else ""
+    return f"{problem} on rows {shown}{more}"
+
+
+def hash_names(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    replaces Name with Hash like read_athlete_events, names this process already hashed aren't hashed again
+    '''
+    return data_utils.hash_column(df, "Name")
+
+
+def append_file(df_delta: pd.DataFrame, file_path=dataset.DATA_FILE):
+    '''
+    validates df_delta and appends it to the csv file and its athlete cache. returns the hashed rows
+    '''
+    df_delta = validate(df_delta)
+
+    # Read before the csv changes, the cache is only extended if it is valid for the current file
+    df_cached = athlete_cache.load_cache(file_path)
+
+    with open(file_path, "rb") as file:
+        size = file.seek(0, os.SEEK_END)
+        ends_with_newline = size == 0 or (file.seek(-1, os.SEEK_END) and file.read(1) == b"\n")
+
+    # One write, so a server reading the file meanwhile sees either none or all of the rows
+    text = df_delta.to_csv(header=False, index=False)
+    with open(file_path, "a", newline="") as file:
+        file.write(text if ends_with_newline else "\n" + text)
+
+    df_hashed = hash_names(df_delta)
+
+    if df_cached is not None:
+        try:
+            athlete_cache.write_cache(data_utils.append_rows(df_cached, df_hashed), file_path)
+        except OSError:
+            pass
+
+    return df_hashed
+
+
+def read_appended(file_path, offset):
+    '''
+    returns the validated and hashed rows written to the csv file after offset and the offset they end at.
+    a last row that is still being written is left for the next call
+    '''
+    with open(file_path, "rb") as file:
+        file.seek(offset)
+        data = file.read()
+
+    end = data.rfind(b"\n") + 1
+    if end == 0:
+        return None, offset
+
+    df_delta = pd.read_csv(io.BytesIO(data[:end]), header=None, names=list(SCHEMA))
+
+    return hash_names(validate(df_delta)), offset + end
+
+
+class Watcher:
+    '''
+    polls the csv file for appended rows and hands them to dataset.append, see watch()
+    '''
+    def __init__(self, file_path, on_change, interval) -> None:
+        self.file_path = file_path
+        self.on_change = on_change
+        self.interval = interval
+        self.offset = None
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def start(self):
+        # The loaded frame was read from source_size bytes, without a frame everything up to now is read on load
+        self.offset = dataset.source_size() if dataset.is_loaded() else os.path.getsize(self.file_path)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="data-set-watcher", daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except (OSError, ValueError) as error:
+                print(f"Ingesting appended rows of {self.file_path} failed: {error}", file=sys.stderr)
+
+
+    def poll(self):
+        size = os.path.getsize(self.file_path)
+        if size == self.offset:
+            return
+
+        # A file that shrank was rewritten, not appended to, so everything is reloaded
+        if size < self.offset:
+            dataset.clear()
+            self.offset = size
+            self.on_change(None)
+            return
+
+        df_delta, offset = read_appended(self.file_path, self.offset)
+        if df_delta is None:
+            return
+
+        changes = dataset.append(df_delta, source_size=offset)
+        self.offset = offset
+        self.on_change(changes)
+
+
+# Watchers started by watch(), see stop_watching()
+_watchers = []
+
+
+def watch(file_path, on_change, interval=5.0):
+    '''
+    starts a daemon thread calling on_change with the change set of dataset.append every time rows are appended
+    to file_path, or with None after a full reload. the thread only runs in the calling process, a process serving
+    the data set starts its own (main.start_watching), so pool workers and background jobs forked later never ingest
+    '''
+    watcher = Watcher(file_path, on_change, interval)
+    watcher.start()
+    _watchers.append(watcher)
+
+    return watcher
+
+
+def stop_watching():
+    '''
+    stops every watcher of this process
+    '''
+    for watcher in _watchers:
+        watcher.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append the rows of a delta csv to the athlete data set")
+    parser.add_argument("delta", help="csv file with the columns of athlete_events.csv")
+    parser.add_argument("--data", default=dataset.DATA_FILE, help="csv file appended to")
+    args = parser.parse_args(argv)
+
+    try:
+        df_hashed = append_file(pd.read_csv(args.delta), args.data)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    print(f"Appended {len(df_hashed)} rows ({', '.join(sorted(df_hashed['Games'].unique()))}) to {args.data}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
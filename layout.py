@@ -1,90 +1,305 @@
+import threading
 import dash_bootstrap_components as dbc
 from dash import dcc, html
 import graph_module as gm
+import dataset
+import config
+from country_views import COUNTRY_GRAPHS
+from crossfilter import LINKED_GRAPHS, describe
+from serialization import encode_figure, loads
 
 class Layout:
-    def __init__(self, df_athletes) -> None:
-        self._df_athletes = df_athletes
-        self._nor_athletes = df_athletes[df_athletes["NOC"] == "NOR"]
-        self._sport_options = [{"label": sport, "value": sport} for sport in sorted(self._df_athletes["Sport"].unique())]
+    # Tabs whose figures are built by a callback the first time the tab is opened
+    LAZY_TABS = ["start", "norway", "sport-selection"]
 
+    SELECTED_SPORTS = ["Gymnastics","Shooting","Speed Skating","Archery"]
 
-    def layout(self):
-        start_content = dbc.Card(
-            dbc.CardBody(
+    # Values of dataset.INDEXED_COLUMNS the figures of a tab depend on, appended rows with any of them rebuild the tab.
+    # The start tab shows every athlete
+    TAB_DEPENDENCIES = {
+        "start": None,
+        "norway": {"NOC": ["NOR"], "Season": ["Winter"]},
+        "sport-selection": {"Sport": SELECTED_SPORTS},
+    }
+
+    def __init__(self, snapshot=None, encode_figures=config.FIGURE_ENDPOINT) -> None:
+        # Figures found in the snapshot (figure_snapshot.FigureSnapshot) are used instead of being built
+        self._prebuilt_figures = dict(snapshot.static) if snapshot is not None else {}
+        self._prebuilt_tabs = set(self.LAZY_TABS)
+        self._encode_figures = encode_figures
+        # Built tab contents are kept here and reused by every session
+        self._tab_contents = {}
+        # Encoded figures of the built tabs by graph id, see _graph()
+        self._static_figures = {}
+        # Graph ids of every built tab, collected per thread since callbacks can build two tabs at once
+        self._tab_graphs = {}
+        self._building = threading.local()
+        # Callbacks can open the same tab at once, only one of them builds it
+        self._tab_locks = {tab_id: threading.RLock() for tab_id in self.LAZY_TABS}
+        # Figures built ahead of their tab by build_tabs(), by graph id
+        self._scheduled_figures = {}
+        # Graph ids of every lazy tab, built or not, see _collect_graphs()
+        self._graph_ids = {}
+        self._builders = {
+            "start": self._start_content,
+            "norway": self._norway_content,
+            "sport-selection": self._sport_selection_content,
+        }
+
+
+    def tab_content(self, tab_id):
+        content = self._tab_contents.get(tab_id)
+        if content is None:
+            with self._tab_locks[tab_id]:
+                content = self._tab_contents.get(tab_id)
+                if content is None:
+                    self._building.tab_id = tab_id
+                    self._building.graph_ids = []
+                    content = self._builders[tab_id]()
+                    self._tab_graphs[tab_id] = self._building.graph_ids
+                    self._tab_contents[tab_id] = content
+
+        return content
+
+
+    def build_tabs(self, scheduler=None):
+        '''
+        builds every lazy tab that isn't built yet, their figures are built in parallel by scheduler
+        (figure_scheduler.FigureScheduler) if one is passed
+        '''
+        tab_ids = [tab_id for tab_id in self.LAZY_TABS if tab_id not in self._tab_contents]
+
+        if scheduler is not None:
+            # A first pass through the tab builders only collects the builds of the figures, see _graph()
+            builds = {}
+            for tab_id in tab_ids:
+                self._collect_graphs(tab_id, builds)
+
+            if builds:
+                # Loaded once here, forked workers share it
+                dataset.preload()
+                self._scheduled_figures.update(scheduler.build(builds))
+
+        for tab_id in tab_ids:
+            self.tab_content(tab_id)
+
+
+    def invalidate(self, changes):
+        '''
+        drops the built tabs whose figures depend on rows in the change set of dataset.append, all of them if changes is None
+        '''
+        for tab_id, dependencies in self.TAB_DEPENDENCIES.items():
+            affected = changes is None or dependencies is None or any(
+                set(values) & changes["values"][column] for column, values in dependencies.items()
+            )
+            if not affected:
+                continue
+
+            # Waits for a running build of the tab, it may have read the rows from before the append
+            with self._tab_locks[tab_id]:
+                # The snapshot was rendered from the data before the append
+                self._prebuilt_tabs.discard(tab_id)
+                if self._tab_contents.pop(tab_id, None) is not None:
+                    for graph_id in self._tab_graphs.pop(tab_id):
+                        self._static_figures.pop(graph_id, None)
+
+
+    def static_figure(self, graph_id):
+        '''
+        returns the encoded figure of graph_id, None if no tab has it. Only the tab of graph_id is built
+        '''
+        for tab_id in self.LAZY_TABS:
+            if tab_id not in self._graph_ids:
+                self._collect_graphs(tab_id, {})
+            if graph_id in self._graph_ids[tab_id]:
+                self.tab_content(tab_id)
+                return self._static_figures.get(graph_id)
+
+        return None
+
+
+    def static_figures(self, scheduler=None):
+        '''
+        builds every tab and returns the encoded figures by graph id, needs encode_figures
+        '''
+        self.build_tabs(scheduler)
+
+        return dict(self._static_figures)
+
+
+    def country_content(self, noc, figures=None):
+        '''
+        graphs of the Countries tab for noc, figures are the encoded figures of country_views.CountryViews.figures()
+        '''
+        if not self._encode_figures:
+            return [dcc.Graph(id=f"country-{graph}", figure=loads(figures[graph].body)) for graph in COUNTRY_GRAPHS]
+
+        # Fetched by the browser from /figures/country/<noc>/<graph> (figures.country in assets/figures.js)
+        return [dcc.Graph(id={"type": "country-figure", "name": f"{noc}/{graph}"}) for graph in COUNTRY_GRAPHS]
+
+
+    def _collect_graphs(self, tab_id, builds):
+        # Runs the builder of tab_id without building any figure, the builds of the figures missing from the snapshot
+        # and build_tabs() are added to builds. Remembers the graph ids of the tab
+        self._building.tab_id = tab_id
+        self._building.graph_ids = []
+        self._building.builds = builds
+        try:
+            self._builders[tab_id]()
+        finally:
+            self._building.builds = None
+        self._graph_ids[tab_id] = self._building.graph_ids
+
+
+    def _graph(self, graph_id, build):
+        # build is only called when the snapshot doesn't have the figure, so a complete snapshot needs no data at all
+        figure = self._prebuilt_figures.get(graph_id) if self._building.tab_id in self._prebuilt_tabs else None
+        self._building.graph_ids.append(graph_id)
+
+        # Collecting the figures build_tabs() hands to its scheduler, the tab itself is laid out afterwards
+        builds = getattr(self._building, "builds", None)
+        if builds is not None:
+            if figure is None and graph_id not in self._scheduled_figures:
+                builds[graph_id] = build
+            return None
+
+        if figure is None:
+            figure = self._scheduled_figures.pop(graph_id, None)
+
+        # Linked graphs are drawn again for every cross-filter selection (crossfilter.py), see the linked-figure callbacks in main.py
+        linked = graph_id in LINKED_GRAPHS
+
+        if not self._encode_figures:
+            graph_figure = loads(figure.body) if figure is not None else build()
+            return dcc.Graph(id={"type": "linked-figure", "name": graph_id} if linked else graph_id, figure=graph_figure)
+
+        # The figure is encoded once and fetched by the browser from /figures/static/<graph_id> (figures.static in assets/figures.js)
+        self._static_figures[graph_id] = figure if figure is not None else encode_figure(build())
+        return dcc.Graph(id={"type": "linked-figure" if linked else "static-figure", "name": graph_id})
+
+
+    def _start_content(self):
+        return [
+            self._graph("most-medals-by-country", lambda: gm.most_medals_by_country(dataset.athletes(), cube=dataset.medal_cube())),
+            html.Div(
                 [
-                    dcc.Graph(id="most-medals-by-country", figure=gm.most_medals_by_country(self._df_athletes)),
-                    html.Div(
+                    dbc.Row(
                         [
-                            dbc.Row(
-                                [
-                                    dbc.Col(dcc.Graph(id="gender-distribution", figure=gm.gender_distribution(self._df_athletes))),
-                                    dbc.Col(dcc.Graph(id="gender-distribution-by-games", figure=gm.gender_distribution_by_games(self._df_athletes))),
-                                ]
-                            ),
+                            dbc.Col(self._graph("gender-distribution", lambda: gm.gender_distribution(dataset.athletes()))),
+                            dbc.Col(self._graph("gender-distribution-by-games", lambda: gm.gender_distribution_by_games(dataset.athletes()))),
                         ]
-                    )
+                    ),
                 ]
-            ),
-            className="mt-3",
-        )
+            )
+        ]
+
+
+    def _norway_content(self):
+        nor_athletes = dataset.nor_athletes
+        nor_medal_cube = lambda: dataset.medal_cube("NOC", "NOR")
+        # Unique athletes of the normalized model (athlete_model.py) instead of deduplicating the rows in every figure
+        nor_unique = lambda view: dataset.unique_athletes(view, "NOC", "NOR")
+
+        return [
+            self._graph("norway-participans", lambda: gm.norwegian_participants_sex(nor_athletes(), athletes=nor_unique("noc_games"))),
+            self._graph("norway-decade", lambda: gm.norwegian_medals_decade(nor_athletes(), cube=nor_medal_cube())),
+            self._graph("Norway-age-histogram", lambda: gm.norwegian_sex_age_distribution(nor_athletes(), athletes=nor_unique("noc_games_name"))),
+            self._graph("norway-age-boxplot", lambda: gm.age_by_gender_by_year(nor_athletes())),
+            self._graph("norway-medals", lambda: gm.medal_coloured_bars(nor_athletes(), cube=nor_medal_cube())),
+            self._graph("norway-sports-sex", lambda: gm.medals_by_sport_and_sex(nor_athletes(), "Norway's top performing Olympic sports", cube=nor_medal_cube())),
+            self._graph("norway-seasons", lambda: gm.norwegian_medals_season(nor_athletes(), cube=nor_medal_cube())),
+            self._graph("norway-winter", lambda: gm.top_medals_winter(dataset.partition("Season", "Winter"), cube=dataset.medal_cube("Season", "Winter"))),
+        ]
+
 
-        norway_content = dbc.Card(
+    def _sport_selection_content(self):
+        # Every figure except the medal distribution only looks at the selected sports, so they get that partition
+        df_sports = lambda: dataset.partition("Sport", self.SELECTED_SPORTS)
+        # Every athlete once per sport and Games, looked up in the normalized model (athlete_model.py)
+        sport_athletes = lambda: dataset.unique_athletes("sport_games", "Sport", self.SELECTED_SPORTS)
+
+        return [
+            self._graph("medal-dist-subplot", lambda: gm.subplot_medal_distribution(dataset.athletes(), "Speed Skating","Gymnastics","Archery","Shooting", athletes=dataset.unique_athletes("athlete"))),
+            self._graph("sport-age-dist-graph", lambda: gm.age_distribution_by_sports(df_sports(), ["Gymnastics","Shooting","Speed Skating","Archery"], athletes=sport_athletes())),
+            self._graph("subplot_weight_height_corr", lambda: gm.subplot_weight_height_correlation(df_sports(), ["Speed Skating","Gymnastics","Archery","Shooting"], athletes=sport_athletes())),
+            self._graph("weight-dist-graph", lambda: gm.weight_distribution_by_sports(df_sports(), ["Gymnastics","Shooting","Speed Skating","Archery"], athletes=sport_athletes())),
+            self._graph("height-dist-graph", lambda: gm.height_distribution_by_sports(df_sports(), ["Gymnastics","Shooting","Speed Skating","Archery"], athletes=sport_athletes())),
+            self._graph("bmi-dist-graph", lambda: gm.bmi_distribution_by_sports(df_sports(), ["Gymnastics","Shooting","Speed Skating","Archery"], athletes=sport_athletes())),
+            self._graph("bmi-medalist-dist", lambda: gm.bmi_distribution_by_sports_medalists(df_sports(), ["Speed Skating","Gymnastics","Shooting","Archery"], athletes=sport_athletes())),
+        ]
+
+
+    def layout(self):
+        # Tab contents are filled in by the render_active_tab callback in main.py
+        start_content, norway_content, sport_selection_content = [
+            dbc.Card(
+                dbc.CardBody(dcc.Loading(html.Div(id=f"{tab_id}-tab-content"), type="circle")),
+                className="mt-3",
+            )
+            for tab_id in self.LAZY_TABS
+        ]
+
+        all_sports_content = dbc.Card(
             dbc.CardBody(
                 [
-                    dcc.Graph(id="norway-participans", figure=gm.norwegian_participants_sex(self._nor_athletes)),
-                    dcc.Graph(id="norway-decade", figure=gm.norwegian_medals_decade(self._nor_athletes)),
-                    dcc.Graph(id="Norway-age-histogram", figure=gm.norwegian_sex_age_distribution(self._nor_athletes)),
-                    dcc.Graph(id="norway-age-boxplot", figure=gm.age_by_gender_by_year(self._nor_athletes)),
-                    dcc.Graph(id="norway-medals", figure=gm.medal_coloured_bars(self._nor_athletes)),
-                    dcc.Graph(id="norway-sports-sex", figure=gm.medals_by_sport_and_sex(self._nor_athletes, "Norway's top performing Olympic sports")),
-                    dcc.Graph(id="norway-seasons", figure=gm.norwegian_medals_season(self._nor_athletes)),
-                    dcc.Graph(id="norway-winter", figure=gm.top_medals_winter(self._df_athletes)),
+                    html.Div([
+                        dcc.Dropdown(id="dropdown-sports", options=[], value="Football", clearable=False, style={"flex": "1"}),
+                        html.Div([
+                            dbc.Button(html.I(className="bi bi-caret-left"), id="dropdown-sports-left-btn", n_clicks=0),
+                            dbc.Button(html.I(className="bi bi-caret-right"), id="dropdown-sports-right-btn", n_clicks=0),
+                        ], style={"display": "flex", "gap": "0.25rem"}),
+                    ], style={"display": "flex", "gap": "0.75rem"}),
+                    # Progress of the background job building the figure, shown while it runs
+                    html.Div([
+                        dbc.Progress(id="sport-progress", value=0, max=3, style={"flex": "1"}),
+                        dbc.Button("Cancel", id="sport-cancel-btn", n_clicks=0, size="sm", color="secondary"),
+                    ], id="sport-job", style={"display": "none"}) if config.BACKGROUND_CALLBACKS else None,
+                    dcc.Loading(dcc.Graph(id="sports-statistics-graph"), type="circle"),
+                    # Filled once with the data of every sport when the figure is drawn in the browser
+                    dcc.Store(id="sport-data-store") if config.CLIENTSIDE_SPORTS else None,
+                    # ETag of the figure skeleton on the page, the next sport drawn on it is sent as a patch of its data and title.
+                    # Only read by the server callback without background jobs (handle_dropdown_sports_change in main.py)
+                    dcc.Store(id="sport-figure-shown") if not config.CLIENTSIDE_SPORTS else None,
                 ]
             ),
             className="mt-3",
         )
 
-        sport_selection_content = dbc.Card(
+        countries_content = dbc.Card(
             dbc.CardBody(
                 [
-                    dcc.Graph(id="medal-dist-subplot", figure=gm.subplot_medal_distribution(self._df_athletes, "Speed Skating","Gymnastics","Archery","Shooting")),
-                    dcc.Graph(id="sport-age-dist-graph", figure=gm.age_distribution_by_sports(self._df_athletes, ["Gymnastics","Shooting","Speed Skating","Archery"])),
-                    dcc.Graph(id="subplot_weight_height_corr", figure=gm.subplot_weight_height_correlation(self._df_athletes, ["Speed Skating","Gymnastics","Archery","Shooting"])),
-                    dcc.Graph(id="weight-dist-graph", figure=gm.weight_distribution_by_sports(self._df_athletes, ["Gymnastics","Shooting","Speed Skating","Archery"])),
-                    dcc.Graph(id="height-dist-graph", figure=gm.height_distribution_by_sports(self._df_athletes, ["Gymnastics","Shooting","Speed Skating","Archery"])),
-                    dcc.Graph(id="bmi-dist-graph", figure=gm.bmi_distribution_by_sports(self._df_athletes, ["Gymnastics","Shooting","Speed Skating","Archery"])),
-                    dcc.Graph(id="bmi-medalist-dist", figure=gm.bmi_distribution_by_sports_medalists(self._df_athletes, ["Speed Skating","Gymnastics","Shooting","Archery"])),
-
-
+                    dcc.Dropdown(id="dropdown-countries", options=[], value="NOR", clearable=False),
+                    dcc.Loading(html.Div(id="country-figures"), type="circle"),
                 ]
             ),
             className="mt-3",
         )
 
-        all_sports_content = dbc.Card(
+        # Selection of the linked charts of the Start and All Sports tabs, clicks on their bars add to it
+        cross_filter = dbc.Card(
             dbc.CardBody(
                 [
-                    html.Div([
-                        dcc.Dropdown(id="dropdown-sports", options=self._sport_options, value="Football", clearable=False, style={"flex": "1"}),
-                        html.Div([
-                            dbc.Button(html.I(className="bi bi-caret-left"), id="dropdown-sports-left-btn", n_clicks=0),
-                            dbc.Button(html.I(className="bi bi-caret-right"), id="dropdown-sports-right-btn", n_clicks=0),
-                        ], style={"display": "flex", "gap": "0.25rem"}),
-                    ], style={"display": "flex", "gap": "0.75rem"}),
-                    dcc.Graph(id="sports-statistics-graph")
-                ]
+                    dcc.Store(id="cross-filter", data={}),
+                    html.Span(describe({}), id="cross-filter-summary", style={"flex": "1"}),
+                    dcc.Dropdown(id="cross-filter-season", options=["Summer", "Winter"], value=[], multi=True, placeholder="Season", style={"minWidth": "10rem"}),
+                    dcc.Dropdown(id="cross-filter-medal", options=["Gold", "Silver", "Bronze"], value=[], multi=True, placeholder="Medal", style={"minWidth": "10rem"}),
+                    dbc.Button("Clear", id="cross-filter-clear", n_clicks=0, size="sm", color="secondary"),
+                ],
+                style={"display": "flex", "gap": "0.75rem", "alignItems": "center"},
             ),
-            className="mt-3",
+            style={"marginBottom": "1rem"},
         )
 
         tabs = dbc.Tabs(
             [
-                dbc.Tab(start_content, label="Start"),
-                dbc.Tab(norway_content, label="Norway"),
-                dbc.Tab(sport_selection_content, label="Sport Selection"),
-                dbc.Tab(all_sports_content, label="All Sports"),
-            ]
+                dbc.Tab(start_content, label="Start", tab_id="start"),
+                dbc.Tab(norway_content, label="Norway", tab_id="norway"),
+                dbc.Tab(countries_content, label="Countries", tab_id="countries"),
+                dbc.Tab(sport_selection_content, label="Sport Selection", tab_id="sport-selection"),
+                dbc.Tab(all_sports_content, label="All Sports", tab_id="all-sports"),
+            ],
+            id="tabs",
+            active_tab="start",
         )
 
         return dbc.Container([
@@ -94,6 +309,7 @@ class Layout:
                     html.H4("Project Olympic Games", style={"margin": "0"}),
                 ], style={"display": "flex", "alignItems": "center", "gap": "0.75rem"})
             ], style={"marginBottom": "1rem"}),
+            cross_filter,
             tabs
         ])
     
\ No newline at end of file
@@ -1,61 +1,442 @@
+import os
+import sys
 import dash
-from dash import Input, Output, State
+from dash import ALL, MATCH, ClientsideFunction, Input, Output, State, no_update
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 from layout import Layout
-import graph_module as gm
-import data_utils
+import dataset
+import config
+import metrics
+import serialization
+import sport_store
+import figure_snapshot
+import ingest
+import athlete_cache
+import background
+import crossfilter
+from country_views import COUNTRY_GRAPHS, CountryViews, affected_countries, popular_countries
+from figure_cache import FigureCache, affected_sports, build_sport_update, carry_over, sport_key, warm_up
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.BOOTSTRAP], title="Group 4 - Norway")
 app._favicon = ("./olympic_games.png")
 
 server = app.server
 
-df_athletes = data_utils.read_athlete_events()
-app.layout = Layout(df_athletes).layout()
+if config.METRICS_ENABLED:
+    metrics.init_app(server, public=config.METRICS_PUBLIC)
+
+# Figures rendered at build time by figure_snapshot.py, None when there is no snapshot or the data set or code changed since
+snapshot = figure_snapshot.load(dataset.DATA_FILE, config.FIGURE_SNAPSHOT_FILE) if config.FIGURE_SNAPSHOT else None
+
+layout = Layout(snapshot)
+app.layout = layout.layout()
+
+sport_figure_cache = FigureCache(config.FIGURE_CACHE_SIZE)
+
+# Linked figures drawn for a cross-filter selection, keyed by the selection's token and the data set version
+crossfilter_cache = FigureCache(config.CROSSFILTER_CACHE_SIZE)
+
+# Queue and result store of the background jobs building the All Sports figure, None without dash[diskcache]
+job_manager = None
+if config.BACKGROUND_CALLBACKS:
+    job_manager = background.make_manager(
+        config.BACKGROUND_CACHE_DIR or athlete_cache.cache_dir_for(dataset.DATA_FILE) + ".jobs",
+        config.BACKGROUND_WORKERS, expire=config.BACKGROUND_RESULT_EXPIRE,
+    )
+    if job_manager is None:
+        print("Background callbacks need dash[diskcache], the All Sports figure is built in the server instead", file=sys.stderr)
+
+# Figure sets of the Countries tab, built in a process pool
+country_views = CountryViews(config.COUNTRY_CACHE_SIZE, config.COUNTRY_PROCESSES)
+
+
+def sport_options():
+    if snapshot is not None and snapshot.sport_options is not None:
+        return snapshot.sport_options
+    return dataset.sport_options()
+
+
+def sport_update(sport, progress=None, selection=None):
+    '''
+    returns the encoded All Sports figure update of sport (sport_store.sport_update) from the snapshot or the figure cache,
+    None if there is no such sport. progress is passed to build_sport_update. with a cross-filter selection only its rows are drawn
+    '''
+    if sport not in {option["value"] for option in sport_options()}:
+        return None
+    if selection:
+        return crossfilter_cache.get_or_build(crossfilter_sport_key(sport, selection), lambda: crossfilter.sport_update(sport, selection))
+    if snapshot is not None and sport in snapshot.sports:
+        return snapshot.sports[sport]
+
+    return sport_figure_cache.get_or_build(sport_key(sport), lambda: build_sport_update(sport, progress))
+
+
+def crossfilter_sport_key(sport, selection):
+    return ("sport", sport, crossfilter.token(selection), dataset.version())
+
+
+def sport_figure(update):
+    # The whole figure of a decoded sport update, its skeleton filled in
+    return sport_store.apply_update(serialization.loads(sport_store.skeleton().body), update)
+
+
+def sport_output(sport, selection, shown):
+    '''
+    returns the All Sports figure output for sport and selection and the new value of the sport-figure-shown store,
+    None if there is no such sport. the skeleton is sent with the first figure of a session, or when it changed, and
+    every later sport only as a Patch of the trace data and title
+    '''
+    update = sport_update(sport, selection=selection)
+    if update is None:
+        return None
+
+    update = serialization.loads(update.body)
+    with metrics.span("serialize"):
+        if config.SPORT_PATCHES and shown == update["skeleton"]:
+            return sport_store.update_patch(update), no_update
+        return sport_figure(update), update["skeleton"]
+
+
+def sport_skeleton(etag):
+    # /figures/sport-skeleton/<etag>, named by the updates drawn on it so the browser fetches it again once it changed
+    skeleton = sport_store.skeleton()
+    return skeleton if etag == skeleton.etag else None
+
+
+def sport_source(name):
+    # /figures/sport/<sport> or /figures/sport/<sport>/<selection token> for a cross-filtered figure update
+    sport, _, text = name.partition("/")
+    try:
+        return sport_update(sport, selection=crossfilter.parse(text) if text else None)
+    except ValueError:
+        return None
+
+
+def linked_figure(name):
+    '''
+    returns the encoded figure of a <graph>/<selection token> name of a linked Start graph (crossfilter.py),
+    None if there is no such graph or the token isn't a selection
+    '''
+    graph, _, text = name.partition("/")
+    if graph not in crossfilter.LINKED_GRAPHS:
+        return None
+    try:
+        selection = crossfilter.parse(text or "{}")
+    except ValueError:
+        return None
+
+    key = (graph, crossfilter.token(selection), dataset.version())
+    return crossfilter_cache.get_or_build(key, lambda: crossfilter.linked_figure(graph, selection))
+
+
+def is_country(noc):
+    return noc in {option["value"] for option in dataset.noc_options()}
+
+
+def country_figure(name):
+    '''
+    returns the encoded figure of a <noc>/<graph> name from the Countries tab, None if there is no such country or graph
+    '''
+    noc, _, graph = name.partition("/")
+    if graph not in COUNTRY_GRAPHS or not is_country(noc):
+        return None
+
+    return country_views.figures(noc)[graph]
+
+
+def unsnapshotted_sports():
+    # Sports whose figure has to be built, the warm-up skips the ones the snapshot has
+    return [option["value"] for option in sport_options() if snapshot is None or option["value"] not in snapshot.sports]
+
+
+def on_data_changed(changes):
+    '''
+    called by the data set watcher after rows were appended (changes from dataset.append) or the data set was reloaded (None).
+    only the tabs and sport figures the appended rows touch are built again
+    '''
+    layout.invalidate(changes)
+    carry_over(sport_figure_cache, changes)
+    carry_over(country_views.cache, changes, affected=affected_countries)
+    # A selection can take rows of any sport or country
+    crossfilter_cache.invalidate()
+    # The pool's workers loaded the data set before the change
+    country_views.restart()
+
+    if snapshot is not None:
+        sports = affected_sports(changes)
+        for sport in list(snapshot.sports) if sports is None else sports:
+            snapshot.sports.pop(sport, None)
+        # The appended rows may add a sport
+        snapshot.sport_options = None
+
+
+def start_watching():
+    '''
+    starts ingesting rows appended to the data set in this process. called by the process serving requests, a gunicorn
+    worker (gunicorn.conf.py) or the development server, never at import so forked pools and jobs don't watch
+    '''
+    if config.WATCH_DATA_FILE and os.path.exists(dataset.DATA_FILE):
+        ingest.watch(dataset.DATA_FILE, on_data_changed, config.WATCH_INTERVAL)
+
+
+serialization.init_app(server, {
+    "static": layout.static_figure, "sport": sport_source, "sport-skeleton": sport_skeleton, "country": country_figure, "linked": linked_figure,
+})
+
+metrics.register_collector(
+    "figure_cache_events_total", "Sport figure cache lookups and evictions", "counter",
+    lambda: {(event,): sport_figure_cache.stats()[event] for event in ("hits", "misses", "evictions")}, labels=["event"],
+)
+metrics.register_collector("figure_cache_entries", "Sport figures in the cache", "gauge", lambda: sport_figure_cache.stats()["entries"])
+metrics.register_collector(
+    "country_cache_events_total", "Country figure set cache lookups and evictions", "counter",
+    lambda: {(event,): country_views.stats()[event] for event in ("hits", "misses", "evictions")}, labels=["event"],
+)
+metrics.register_collector("country_cache_entries", "Country figure sets in the cache", "gauge", lambda: country_views.stats()["entries"])
+metrics.register_collector("crossfilter_cache_entries", "Cross-filtered figures in the cache", "gauge", lambda: crossfilter_cache.stats()["entries"])
+metrics.register_collector("country_builds_pending", "Country figure sets being built in the pool", "gauge", lambda: country_views.stats()["pending"])
+if job_manager is not None:
+    metrics.register_collector("background_jobs_running", "Background jobs building a figure", "gauge", lambda: job_manager.stats()["running"])
 
 @app.callback(
-    Output("sports-statistics-graph", "figure"),
-    Input("dropdown-sports", "value"),
+    [Output(f"{tab_id}-tab-content", "children") for tab_id in Layout.LAZY_TABS],
+    Input("tabs", "active_tab"),
+    [State(f"{tab_id}-tab-content", "children") for tab_id in Layout.LAZY_TABS],
 )
-def handle_dropdown_sports_change(value):
-    return gm.sport_subplots(df_athletes, sport=value)
+@metrics.instrument_callback
+def render_active_tab(active_tab, *tab_contents):
+    # Figures for a tab are only built the first time it's opened, after that the browser keeps them
+    if active_tab not in Layout.LAZY_TABS or tab_contents[Layout.LAZY_TABS.index(active_tab)]:
+        raise PreventUpdate
+
+    return [layout.tab_content(tab_id) if tab_id == active_tab else no_update for tab_id in Layout.LAZY_TABS]
+
+
+@app.callback(
+    Output("dropdown-sports", "options"),
+    Input("tabs", "active_tab"),
+    State("dropdown-sports", "options"),
+)
+@metrics.instrument_callback
+def load_sport_options(active_tab, options):
+    if active_tab != "all-sports" or options:
+        raise PreventUpdate
+
+    return sport_options()
+
+
+@app.callback(
+    Output("dropdown-countries", "options"),
+    Input("tabs", "active_tab"),
+    State("dropdown-countries", "options"),
+)
+@metrics.instrument_callback
+def load_country_options(active_tab, options):
+    if active_tab != "countries" or options:
+        raise PreventUpdate
+
+    return dataset.noc_options()
 
 
 @app.callback(
+    Output("country-figures", "children"),
+    Input("dropdown-countries", "value"),
+    Input("tabs", "active_tab"),
+)
+@metrics.instrument_callback
+def render_country(noc, active_tab):
+    # Nothing is built before the tab is opened
+    if active_tab != "countries" or not is_country(noc):
+        raise PreventUpdate
+
+    if config.FIGURE_ENDPOINT:
+        # The graphs fetch their figures themselves, the pool starts on them right away
+        country_views.submit(noc)
+        return layout.country_content(noc)
+
+    return layout.country_content(noc, country_views.figures(noc))
+
+
+if config.CLIENTSIDE_SPORTS:
+    @app.callback(
+        Output("sport-data-store", "data"),
+        Input("tabs", "active_tab"),
+        State("sport-data-store", "data"),
+    )
+    @metrics.instrument_callback
+    def load_sport_data(active_tab, data):
+        # Sent once per session, every sport after that is drawn in the browser by sports.render
+        if active_tab != "all-sports" or data:
+            raise PreventUpdate
+
+        return sport_store.sport_data()
+
+
+    # Drawn from the aggregates of every row, so the cross-filter selection only applies to the Start graphs
+    app.clientside_callback(
+        ClientsideFunction(namespace="sports", function_name="render"),
+        Output("sports-statistics-graph", "figure"),
+        Input("dropdown-sports", "value"),
+        Input("sport-data-store", "data"),
+    )
+elif job_manager is not None:
+    # Built in a background job (background.py), the browser polls for its progress and result. A newer selection or
+    # the cancel button drops the running job, metrics of the job process aren't collected
+    # Always sends the whole figure: what the page shows would be part of the job's cache key, so identical jobs of
+    # different sessions wouldn't be shared
+    @app.callback(
+        Output("sports-statistics-graph", "figure"),
+        Input("dropdown-sports", "value"),
+        Input("dropdown-sports", "options"),
+        Input("cross-filter", "data"),
+        background=True,
+        manager=job_manager,
+        progress=[Output("sport-progress", "value"), Output("sport-progress", "max")],
+        running=[(Output("sport-job", "style"), {"display": "flex", "gap": "0.75rem", "alignItems": "center"}, {"display": "none"})],
+        cancel=[Input("sport-cancel-btn", "n_clicks")],
+    )
+    def build_sport_graph(set_progress, value, options, selection):
+        if not options:
+            raise PreventUpdate
+
+        update = sport_update(value, progress=lambda step, steps: set_progress((step, steps)), selection=selection)
+        if update is None:
+            raise PreventUpdate
+
+        return sport_figure(serialization.loads(update.body))
+elif config.FIGURE_ENDPOINT:
+    # The browser fetches the skeleton from /figures/sport-skeleton/<etag> once and then only the update of each sport
+    # from /figures/sport/<sport>, both revalidated with their ETag
+    app.clientside_callback(
+        ClientsideFunction(namespace="figures", function_name="sport"),
+        Output("sports-statistics-graph", "figure"),
+        Input("dropdown-sports", "value"),
+        Input("dropdown-sports", "options"),
+        Input("cross-filter", "data"),
+    )
+else:
+    @app.callback(
+        Output("sports-statistics-graph", "figure"),
+        Output("sport-figure-shown", "data"),
+        Input("dropdown-sports", "value"),
+        Input("dropdown-sports", "options"),
+        Input("cross-filter", "data"),
+        State("sport-figure-shown", "data"),
+    )
+    @metrics.instrument_callback
+    def handle_dropdown_sports_change(value, options, selection, shown):
+        # Options are loaded when the All Sports tab is opened, nothing is rendered before that
+        if not options:
+            raise PreventUpdate
+
+        # Only the trace data and title of a new sport differ from the figure on the page, see sport_output
+        output = sport_output(value, selection, shown)
+        if output is None:
+            raise PreventUpdate
+
+        return output
+
+
+if config.FIGURE_ENDPOINT:
+    # Graphs of the lazy tabs are rendered without figures, each one fetches its own from /figures/static/<graph id>
+    app.clientside_callback(
+        ClientsideFunction(namespace="figures", function_name="static"),
+        Output({"type": "static-figure", "name": MATCH}, "figure"),
+        Input({"type": "static-figure", "name": MATCH}, "id"),
+    )
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="figures", function_name="country"),
+        Output({"type": "country-figure", "name": MATCH}, "figure"),
+        Input({"type": "country-figure", "name": MATCH}, "id"),
+    )
+
+    # Linked graphs fetch their figure from /figures/static/<graph id> without a selection, /figures/linked/<graph id>/<selection> with one
+    app.clientside_callback(
+        ClientsideFunction(namespace="figures", function_name="linked"),
+        Output({"type": "linked-figure", "name": MATCH}, "figure"),
+        Input({"type": "linked-figure", "name": MATCH}, "id"),
+        Input("cross-filter", "data"),
+    )
+else:
+    @app.callback(
+        Output({"type": "linked-figure", "name": MATCH}, "figure"),
+        Input("cross-filter", "data"),
+        State({"type": "linked-figure", "name": MATCH}, "id"),
+    )
+    @metrics.instrument_callback
+    def render_linked_figure(selection, graph_id):
+        # The graph is laid out with its figure of every row, it's only drawn again once something was selected
+        if not selection and dash.ctx.triggered_id is None:
+            raise PreventUpdate
+
+        figure = linked_figure(f"{graph_id['name']}/{crossfilter.token(selection or {})}")
+        with metrics.span("serialize"):
+            return serialization.loads(figure.body)
+
+
+@app.callback(
+    Output("cross-filter", "data"),
+    Output("cross-filter-summary", "children"),
+    Output("cross-filter-season", "value"),
+    Output("cross-filter-medal", "value"),
+    Input({"type": "linked-figure", "name": ALL}, "clickData"),
+    Input("sports-statistics-graph", "clickData"),
+    Input("cross-filter-season", "value"),
+    Input("cross-filter-medal", "value"),
+    Input("cross-filter-clear", "n_clicks"),
+    State("cross-filter", "data"),
+    prevent_initial_call=True,
+)
+@metrics.instrument_callback
+def update_cross_filter(linked_clicks, sport_click, seasons, medals, clear_clicks, selection):
+    # A click on a bar adds its value to the selection or removes it again, see crossfilter.py
+    trigger = dash.ctx.triggered_id
+    selection = selection or {}
+
+    if trigger == "cross-filter-clear":
+        selection = {}
+    elif trigger == "cross-filter-season":
+        selection = crossfilter.normalize({**selection, "Season": seasons or []})
+    elif trigger == "cross-filter-medal":
+        selection = crossfilter.normalize({**selection, "Medal": medals or []})
+    else:
+        clicked = None
+        if trigger == "sports-statistics-graph":
+            clicked = crossfilter.sport_click(sport_click)
+        elif isinstance(trigger, dict):
+            # Graphs added to the page trigger the callback too, without clickData
+            column = crossfilter.LINKED_GRAPHS[trigger["name"]]
+            value = crossfilter.clicked_value(dash.ctx.triggered[0]["value"], column)
+            clicked = (column, value) if value is not None else None
+
+        if clicked is None:
+            raise PreventUpdate
+        selection = crossfilter.toggle(selection, *clicked)
+
+    return selection, crossfilter.describe(selection), selection.get("Season", []), selection.get("Medal", [])
+
+
+# The previous/next buttons only pick a neighbouring option, so it's done in the browser (sports.navigate in assets/sports.js).
+# The original server callback was generated by Chat GPT, with the prompt:
+# "jag har en dropdown i min dash app. Är det möjligt att lägga två knappar bredvid denna som är vänster och höegr, ocg så kan man klicka på höger för att välja nästa option och till vänster för att välja option över den nuvarande valda"
+app.clientside_callback(
+    ClientsideFunction(namespace="sports", function_name="navigate"),
     Output("dropdown-sports", "value"),
     Input("dropdown-sports-left-btn", "n_clicks"),
     Input("dropdown-sports-right-btn", "n_clicks"),
     State("dropdown-sports", "value"),
     State("dropdown-sports", "options")
 )
-def update_dropdown(left_n_clicks, right_n_clicks, current_value, options):
-    # Most of the code in this function is generated by Chat GPT, with the original prompt:
-    # "jag har en dropdown i min dash app. Är det möjligt att lägga två knappar bredvid denna som är vänster och höegr, ocg så kan man klicka på höger för att välja nästa option och till vänster för att välja option över den nuvarande valda"
-
-    ctx = dash.callback_context
-    if not ctx.triggered:
-        return current_value
-    
-    # Get the id of the element that triggered the callback
-    button_id = ctx.triggered[0]["prop_id"].split(".")[0]
-    
-    dropdown_option_values = [option["value"] for option in options]
-
-    # Find the index of the currently chosen value in dropdown from the options
-    current_index = dropdown_option_values.index(current_value)
-
-    if button_id == "dropdown-sports-left-btn":
-        # If left button is clicked select option above the current selected (previous index)
-        new_index = (current_index - 1) % len(dropdown_option_values)
-    elif button_id == "dropdown-sports-right-btn":
-        # If right button is clicked select option below the current selected (next index)
-        new_index = (current_index + 1) % len(dropdown_option_values)
-    else:
-        new_index = current_index
-
-    # Return the value to the dropdown by the new index
-    return dropdown_option_values[new_index]
 
 
 if __name__ == '__main__':
+    # wsgi.py warms the cache when the app is served by gunicorn
+    if config.WARM_FIGURE_CACHE:
+        warm_up(sport_figure_cache, build_sport_update, unsnapshotted_sports())
+    if config.COUNTRY_PREWARM:
+        country_views.warm_up(popular_countries(config.COUNTRY_PREWARM))
+
+    start_watching()
     app.run_server(debug=True)
\ No newline at end of file
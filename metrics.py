@@ -0,0 +1,283 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+import flask
+from dash.exceptions import PreventUpdate
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phases a callback's time is split into, see span(). other is the time of the callback outside of any span
+PHASES = ["filter", "aggregate", "figure", "serialize", "other"]
+
+_registry = []
+_collectors = []
+
+
+class Histogram:
+    '''
+    prometheus style histogram with cumulative buckets, one series per combination of label values
+    '''
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            # Counted in the first bucket it fits, the buckets are made cumulative when rendered
+            position = bisect.bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                series["buckets"][position] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_labels(self.labels, key, le=_number(bound))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le='+Inf')} {series['count']}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(series['sum'])}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {series['count']}")
+
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {_number(value)}")
+
+        return lines
+
+
+CALLBACK_DURATION = Histogram(
+    "dash_callback_duration_seconds", "Time from receiving a callback request to sending its response", ["callback"]
+)
+CALLBACK_PHASE_DURATION = Histogram(
+    "dash_callback_phase_duration_seconds", "Time a callback spent in each phase", ["callback", "phase"]
+)
+CALLBACK_CALLS = Counter("dash_callback_calls_total", "Callback calls by outcome (ok, prevented, error)", ["callback", "outcome"])
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Time spent handling a Flask request", ["endpoint", "status"])
+
+
+def register_collector(name, documentation, metric_type, collect, labels=()):
+    '''
+    adds a metric read when /metrics is scraped, collect returns {label values tuple: value} or a single value
+    '''
+    _collectors.append((name, documentation, metric_type, collect, tuple(labels)))
+
+
+def render():
+    '''
+    returns every metric in the prometheus text exposition format
+    '''
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+
+    for name, documentation, metric_type, collect, labels in _collectors:
+        values = collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"])
+        lines.extend(f"{name}{_labels(labels, key)} {_number(value)}" for key, value in sorted(values.items()))
+
+    return "\n".join(lines) + "\n"
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _SpanCollector:
+    def __init__(self) -> None:
+        self.timings = {}
+        # Time of the child spans of every open span, subtracted so each phase only counts its own time
+        self.child_time = []
+
+
+_current = contextvars.ContextVar("metrics_spans", default=None)
+
+
+@contextmanager
+def span(phase):
+    '''
+    adds the time spent in the block to phase of the current callback.
+    nested spans are subtracted from the enclosing one. does nothing unless spans are being collected,
+    by instrument_callback or collect_spans
+    '''
+    collector = _current.get()
+    if collector is None:
+        yield
+        return
+
+    collector.child_time.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        own_time = elapsed - collector.child_time.pop()
+        collector.timings[phase] = collector.timings.get(phase, 0.0) + own_time
+        if collector.child_time:
+            collector.child_time[-1] += elapsed
+
+
+def traced(phase):
+    '''
+    decorator running the whole function in span(phase)
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return function(*args, **kwargs)
+            with span(phase):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def collect_spans():
+    '''
+    collects spans outside of a callback, e.g. in benchmarks. yields the phase -> seconds dict
+    '''
+    collector = _SpanCollector()
+    token = _current.set(collector)
+    try:
+        yield collector.timings
+    finally:
+        _current.reset(token)
+
+
+def instrument_callback(function):
+    '''
+    decorator for dash callbacks, place it below @app.callback.
+    records the call outcome and the spans of the callback, the full latency is recorded when the response is sent
+    '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        collector = _SpanCollector()
+        token = _current.set(collector)
+        outcome = "ok"
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except PreventUpdate:
+            outcome = "prevented"
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            _current.reset(token)
+            CALLBACK_CALLS.inc(callback=function.__name__, outcome=outcome)
+            if flask.has_request_context():
+                flask.g.metrics_callback = (function.__name__, duration, collector.timings)
+
+    return wrapper
+
+
+def _callback_name():
+    # Callbacks without instrument_callback are named after their outputs
+    return (flask.request.get_json(silent=True) or {}).get("output", "unknown")
+
+
+def _local_request():
+    # Behind a reverse proxy the peer address is the proxy's, a request it forwarded usually carries one of these headers
+    if "X-Forwarded-For" in flask.request.headers or "Forwarded" in flask.request.headers:
+        return False
+    return flask.request.remote_addr in ("127.0.0.1", "::1", None)
+
+
+def init_app(server: flask.Flask, route="/metrics", public=False):
+    '''
+    times every request, adds Server-Timing headers to callback responses and serves the metrics on route.
+    unless public the metrics are only served to requests from the same machine that weren't forwarded by a proxy
+    '''
+    @server.before_request
+    def start_request_timer():
+        flask.g.metrics_start = time.perf_counter()
+
+
+    @server.after_request
+    def record_request(response):
+        start = flask.g.pop("metrics_start", None)
+        if start is None:
+            return response
+
+        duration = time.perf_counter() - start
+        endpoint = flask.request.url_rule.rule if flask.request.url_rule is not None else "unmatched"
+        REQUEST_DURATION.observe(duration, endpoint=endpoint, status=response.status_code)
+
+        if not flask.request.path.endswith("_dash-update-component"):
+            return response
+
+        name, callback_duration, timings = flask.g.pop("metrics_callback", (_callback_name(), 0.0, {}))
+        timings = dict(timings)
+        timings["other"] = max(callback_duration - sum(timings.values()), 0.0)
+        # Everything outside the callback function is mostly Dash encoding the response as JSON
+        timings["serialize"] = timings.get("serialize", 0.0) + max(duration - callback_duration, 0.0)
+
+        CALLBACK_DURATION.observe(duration, callback=name)
+        for phase, seconds in timings.items():
+            CALLBACK_PHASE_DURATION.observe(seconds, callback=name, phase=phase)
+
+        server_timing = [f'total;desc="{name}";dur={duration * 1000:.2f}']
+        server_timing += [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in timings.items()]
+        response.headers["Server-Timing"] = ", ".join(server_timing)
+
+        return response
+
+
+    def metrics_view():
+        if not public and not _local_request():
+            flask.abort(404)
+        return flask.Response(render(), mimetype="text/plain; version=0.0.4")
+
+    server.add_url_rule(route, "metrics", metrics_view)
@@ -0,0 +1,271 @@
+'''
+Aggregations the figures run on the athlete frame, computed by the backend chosen with config.QUERY_BACKEND.
+
+    pandas   the frame's own masks, drop_duplicates and groupbys
+    duckdb   DuckDB's multi-threaded columnar engine, scanning the frame in place (needs the duckdb package)
+
+Both backends return the same pandas objects: groups sorted by their keys, keys typed like the frame's columns and
+rows with a missing key left out, like a pandas groupby with observed=True. tests/test_query_backend.py checks
+that they agree, benchmarks/query_backends.py compares their speed.
+'''
+import os
+import threading
+import numpy as np
+import pandas as pd
+import config
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+BACKENDS = ["pandas", "duckdb"]
+
+
+def _keys(by):
+    return [by] if isinstance(by, str) else list(by)
+
+
+def _is_categorical(values: pd.Series):
+    return isinstance(values.dtype, pd.CategoricalDtype)
+
+
+def _present(df: pd.DataFrame, column):
+    # SQL condition of a value that isn't missing, see _codes()
+    return f'"{column}" >= 0' if _is_categorical(df[column]) else f'"{column}" IS NOT NULL'
+
+
+def _codes(values: pd.Series):
+    # Missing values are code -1, so they still form one group of their own. DuckDB only scans contiguous arrays,
+    # the codes of a frame sliced with a step aren't
+    return np.ascontiguousarray(values.cat.codes.to_numpy()) if _is_categorical(values) else values
+
+
+class PandasBackend:
+    name = "pandas"
+
+    def select(self, df: pd.DataFrame, **values) -> pd.DataFrame:
+        mask = np.ones(len(df), dtype=bool)
+        for column, value in values.items():
+            mask &= df[column].isin(value).to_numpy() if isinstance(value, (list, tuple, set)) else (df[column] == value).to_numpy()
+        return df[mask]
+
+
+    def first_rows(self, df: pd.DataFrame, subset) -> np.ndarray:
+        return np.flatnonzero(~df.duplicated(subset=_keys(subset)).to_numpy())
+
+
+    def drop_duplicates(self, df: pd.DataFrame, subset) -> pd.DataFrame:
+        return df.drop_duplicates(subset=_keys(subset))
+
+
+    def count(self, df: pd.DataFrame, by, column=None) -> pd.Series:
+        # One categorical column is counted from its codes, without the group codes a groupby allocates
+        if column is None and isinstance(by, str) and _is_categorical(df[by]):
+            counts = df[by].value_counts(sort=False)
+            return counts[counts > 0].rename(None)
+
+        groups = df.groupby(by, observed=True)
+        return groups.size() if column is None else groups[column].count()
+
+
+    def nunique(self, df: pd.DataFrame, by, column) -> pd.Series:
+        return df.groupby(by, observed=True)[column].nunique()
+
+
+    def sum(self, df: pd.DataFrame, by, columns) -> pd.DataFrame:
+        # Integers are summed in 64 bits, grouped by a categorical a compact int8/int16 column would keep its type and overflow
+        columns = list(columns)
+        narrow = [column for column in columns if pd.api.types.is_integer_dtype(df[column].dtype) and df[column].dtype != np.int64]
+        if narrow:
+            df = df.assign(**{column: df[column].astype(np.int64) for column in narrow})
+        return df.groupby(by, observed=True)[columns].sum()
+
+
+class DuckDBBackend(PandasBackend):
+    '''
+    runs the aggregations as SQL over the frame, only the columns a query needs are handed to DuckDB.
+    rows are taken from the frame by position, so selections keep the frame's types and index
+    '''
+    name = "duckdb"
+
+    def __init__(self, threads=0) -> None:
+        if duckdb is None:
+            raise ImportError("the duckdb query backend needs the duckdb package")
+
+        self._threads = threads
+        self._connection = None
+        self._pid = None
+        self._local = threading.local()
+        # Row positions handed to DuckDB with every frame, reused between queries
+        self._positions = np.arange(0, dtype=np.int64)
+
+
+    def _cursor(self):
+        # A connection isn't carried over into a forked process, every thread queries through its own cursor
+        if self._pid != os.getpid():
+            self._connection = duckdb.connect(config={"threads": self._threads} if self._threads else {})
+            self._pid = os.getpid()
+            self._local = threading.local()
+        if getattr(self._local, "cursor", None) is None:
+            self._local.cursor = self._connection.cursor()
+
+        return self._local.cursor
+
+
+    def _query(self, df, columns, sql, params=()):
+        if len(self._positions) < len(df):
+            self._positions = np.arange(len(df), dtype=np.int64)
+
+        # Categorical columns are handed over as their codes, a DuckDB ENUM would be built from their categories on every query
+        frame = pd.DataFrame(
+            {column: _codes(df[column]) for column in dict.fromkeys(columns)} | {"_row": self._positions[:len(df)]}, copy=False
+        )
+        cursor = self._cursor()
+        cursor.register("frame", frame)
+        try:
+            return cursor.execute(sql, list(params)).fetchnumpy()
+        finally:
+            cursor.unregister("frame")
+
+
+    def _index(self, df, keys, result):
+        # Keys come back as plain values or codes, they get the type of their column again
+        arrays = []
+        for key in keys:
+            values = np.asarray(result[key])
+            dtype = df[key].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                arrays.append(pd.Categorical.from_codes(values, dtype=dtype))
+            else:
+                arrays.append(values.astype(dtype))
+
+        if len(keys) == 1:
+            return pd.Index(arrays[0], name=keys[0])
+        return pd.MultiIndex.from_arrays(arrays, names=keys)
+
+
+    def _grouped(self, df, by, aggregates, columns):
+        keys = _keys(by)
+        quoted = ", ".join(f'"{key}"' for key in keys)
+        not_null = " AND ".join(_present(df, key) for key in keys)
+        selected = ", ".join(f"{sql} AS a{position}" for position, sql in enumerate(aggregates))
+        result = self._query(
+            df, keys + columns, f"SELECT {quoted}, {selected} FROM frame WHERE {not_null} GROUP BY {quoted} ORDER BY {quoted}"
+        )
+
+        return self._index(df, keys, result), [np.asarray(result[f"a{position}"]) for position in range(len(aggregates))]
+
+
+    def select(self, df: pd.DataFrame, **values) -> pd.DataFrame:
+        conditions = []
+        params = []
+        for column, value in values.items():
+            value = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            if _is_categorical(df[column]):
+                codes = df[column].cat.categories.get_indexer(value)
+                value = codes[codes >= 0].tolist()
+            if not value:
+                return df.iloc[:0]
+            conditions.append(f'"{column}" IN ({", ".join("?" * len(value))})')
+            params.extend(value)
+
+        where = " AND ".join(conditions) or "TRUE"
+        result = self._query(df, list(values), f"SELECT _row FROM frame WHERE {where} ORDER BY _row", params)
+        return df.take(np.asarray(result["_row"]))
+
+
+    def first_rows(self, df: pd.DataFrame, subset) -> np.ndarray:
+        # GROUP BY keeps missing values together as one group, like duplicated()
+        keys = _keys(subset)
+        quoted = ", ".join(f'"{key}"' for key in keys)
+        result = self._query(df, keys, f"SELECT min(_row) AS first FROM frame GROUP BY {quoted} ORDER BY first")
+        return np.asarray(result["first"])
+
+
+    def drop_duplicates(self, df: pd.DataFrame, subset) -> pd.DataFrame:
+        return df.take(self.first_rows(df, subset))
+
+
+    def count(self, df: pd.DataFrame, by, column=None) -> pd.Series:
+        aggregate = "count(*)" if column is None else f"count(*) FILTER (WHERE {_present(df, column)})"
+        index, (counts,) = self._grouped(df, by, [aggregate], [] if column is None else [column])
+        return pd.Series(counts.astype(np.int64), index=index, name=column)
+
+
+    def nunique(self, df: pd.DataFrame, by, column) -> pd.Series:
+        index, (counts,) = self._grouped(df, by, [f'count(DISTINCT "{column}") FILTER (WHERE {_present(df, column)})'], [column])
+        return pd.Series(counts.astype(np.int64), index=index, name=column)
+
+
+    def sum(self, df: pd.DataFrame, by, columns) -> pd.DataFrame:
+        columns = list(columns)
+        # DuckDB sums integers in 128 bits, pandas in 64
+        aggregates = [f'sum("{column}")::BIGINT' if pd.api.types.is_integer_dtype(df[column].dtype) else f'sum("{column}")' for column in columns]
+        index, sums = self._grouped(df, by, aggregates, columns)
+
+        types = {column: np.int64 if pd.api.types.is_integer_dtype(df[column].dtype) else df[column].dtype for column in columns}
+        return pd.DataFrame({column: values.astype(types[column]) for column, values in zip(columns, sums)}, index=index)
+
+
+def make_backend(name, threads=0):
+    if name == "pandas":
+        return PandasBackend()
+    if name == "duckdb":
+        return DuckDBBackend(threads)
+    raise ValueError(f"unknown query backend {name!r}, expected one of {BACKENDS}")
+
+
+_backend = None
+
+
+def backend():
+    '''
+    returns the backend of config.QUERY_BACKEND, made on first use
+    '''
+    global _backend
+    if _backend is None:
+        _backend = make_backend(config.QUERY_BACKEND, config.QUERY_THREADS)
+    return _backend
+
+
+def select(df: pd.DataFrame, **values) -> pd.DataFrame:
+    '''
+    returns the rows of df whose column is the passed value, or one of them for a list, for every keyword
+    '''
+    return backend().select(df, **values)
+
+
+def first_rows(df: pd.DataFrame, subset) -> np.ndarray:
+    '''
+    returns the ascending positions of the first row of every distinct combination of the subset columns
+    '''
+    return backend().first_rows(df, subset)
+
+
+def drop_duplicates(df: pd.DataFrame, subset) -> pd.DataFrame:
+    '''
+    returns the first row of every distinct combination of the subset columns, like DataFrame.drop_duplicates
+    '''
+    return backend().drop_duplicates(df, subset)
+
+
+def count(df: pd.DataFrame, by, column=None) -> pd.Series:
+    '''
+    returns the rows per group of the by columns, or the values of column that aren't missing
+    '''
+    return backend().count(df, by, column)
+
+
+def nunique(df: pd.DataFrame, by, column) -> pd.Series:
+    '''
+    returns the distinct values of column per group of the by columns
+    '''
+    return backend().nunique(df, by, column)
+
+
+def sum(df: pd.DataFrame, by, columns) -> pd.DataFrame:
+    '''
+    returns the sums of columns per group of the by columns
+    '''
+    return backend().sum(df, by, columns)
@@ -0,0 +1,148 @@
+import gzip
+import hashlib
+import json
+import threading
+import flask
+import plotly.io as pio
+from metrics import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Plotly, and Dash through it, encode NumPy arrays directly with orjson instead of going through the json module
+if orjson is not None:
+    pio.json.config.default_engine = "orjson"
+
+# Smaller responses aren't worth the time it takes to compress them
+MIN_COMPRESS_SIZE = 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Pre-encoded figures are compressed once and kept, so they can use the slowest and smallest settings
+STORED_GZIP_LEVEL = 9
+STORED_BROTLI_QUALITY = 11
+
+
+class EncodedFigure:
+    '''
+    a figure encoded as JSON bytes once, with an ETag and compressed copies made on first request
+    '''
+    def __init__(self, body: bytes, encodings=None) -> None:
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        # Compressed copies made ahead of time can be passed in, e.g. from a figure snapshot
+        self._encodings = {**(encodings or {}), "identity": body}
+        self._lock = threading.Lock()
+
+
+    def encoded(self, encoding):
+        with self._lock:
+            if encoding not in self._encodings:
+                self._encodings[encoding] = compress(self.body, encoding, stored=True)
+
+            return self._encodings[encoding]
+
+
+    def __len__(self):
+        return len(self.body)
+
+
+def encode_figure(fig) -> EncodedFigure:
+    with span("serialize"):
+        return EncodedFigure(pio.to_json(fig, validate=False).encode())
+
+
+def loads(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def compress(body: bytes, encoding, stored=False):
+    if encoding == "br":
+        return brotli.compress(body, quality=STORED_BROTLI_QUALITY if stored else BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=STORED_GZIP_LEVEL if stored else GZIP_LEVEL)
+    return body
+
+
+def accepted_encoding():
+    '''
+    returns the best encoding the current request accepts, br is preferred over gzip
+    '''
+    accept = flask.request.accept_encodings
+    if brotli is not None and accept["br"]:
+        return "br"
+    if accept["gzip"]:
+        return "gzip"
+    return "identity"
+
+
+def figure_response(figure: EncodedFigure):
+    '''
+    returns the figure compressed for the current request, or 304 Not Modified if the browser already has it
+    '''
+    encoding = accepted_encoding()
+    etag = f"{figure.etag}-{encoding}"
+
+    response = flask.Response(status=200, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    # The browser keeps the figure but asks with its ETag every time, so a changed data set is picked up at once
+    response.headers["Cache-Control"] = "no-cache"
+
+    if etag in flask.request.if_none_match:
+        response.status_code = 304
+        return response
+
+    response.set_data(figure.encoded(encoding))
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+
+    return response
+
+
+def init_app(server: flask.Flask, figure_sources: dict, route="/figures"):
+    '''
+    serves the figures of figure_sources on route/<source>/<name>, a source is a function name -> EncodedFigure or None.
+    other JSON responses are compressed and GET responses get an ETag
+    '''
+    def figure_view(source, name):
+        figure = figure_sources[source](name) if source in figure_sources else None
+        if figure is None:
+            flask.abort(404)
+        return figure_response(figure)
+
+    server.add_url_rule(f"{route}/<source>/<path:name>", "figures", figure_view)
+
+
+    @server.after_request
+    def compress_response(response):
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+            return response
+        if response.mimetype != "application/json" or "Content-Encoding" in response.headers:
+            return response
+
+        if flask.request.method == "GET":
+            # Weak since the same tag is sent for every compression of the body
+            response.add_etag(weak=True)
+            response.make_conditional(flask.request)
+            if response.status_code == 304:
+                return response
+
+        body = response.get_data()
+        encoding = accepted_encoding()
+        if len(body) < MIN_COMPRESS_SIZE or encoding == "identity":
+            return response
+
+        response.set_data(compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+
+        return response
@@ -0,0 +1,77 @@
+import functools
+from dash import Patch
+import dataset
+import graph_module as gm
+from serialization import encode_figure, loads
+
+
+@functools.lru_cache(maxsize=1)
+def _skeleton(version):
+    return encode_figure(gm.sport_subplots_skeleton(dataset.athletes()))
+
+
+def skeleton():
+    '''
+    returns the encoded sport_subplots_skeleton of the loaded data set, sent to the browser once. its ETag names it
+    in the sport updates drawn on it
+    '''
+    return _skeleton(dataset.version())
+
+
+def sport_update(sport, df_sport, cube=None):
+    '''
+    returns gm.sport_subplots_update of df_sport together with the ETag of the skeleton it is drawn on
+    '''
+    return {**gm.sport_subplots_update(sport, df_sport, cube), "skeleton": skeleton().etag}
+
+
+def _assign(target, values):
+    # Sets the values of the nested dict values in target, a figure dict or a dash Patch, keeping its other values
+    for key, value in values.items():
+        if not isinstance(value, dict):
+            target[key] = value
+        elif isinstance(target, dict):
+            _assign(target.setdefault(key, {}), value)
+        else:
+            _assign(target[key], value)
+
+
+def apply_update(figure: dict, update: dict):
+    '''
+    fills the traces and title of a skeleton figure dict in with a sport update, like sports.apply in assets/sports.js
+    '''
+    for trace, values in zip(figure["data"], update["traces"]):
+        _assign(trace, values)
+    _assign(figure["layout"], {"title": {"text": update["title"]}})
+
+    return figure
+
+
+def update_patch(update: dict):
+    '''
+    returns a dash Patch setting the traces and title of the figure on the page to those of a sport update
+    '''
+    patch = Patch()
+    for index, values in enumerate(update["traces"]):
+        _assign(patch["data"][index], values)
+    patch["layout"]["title"]["text"] = update["title"]
+
+    return patch
+
+
+@functools.lru_cache(maxsize=1)
+def _sport_data(version):
+    return {
+        "skeleton": loads(skeleton().body),
+        "sports": {
+            option["value"]: sport_update(option["value"], dataset.partition("Sport", option["value"]), dataset.medal_cube("Sport", option["value"]))
+            for option in dataset.sport_options()
+        },
+    }
+
+
+def sport_data():
+    '''
+    returns the figure skeleton and the update of every sport, drawn in the browser by sports.render in assets/sports.js
+    '''
+    return _sport_data(dataset.version())
@@ -0,0 +1,344 @@
+'''
+Bounded memory aggregation of athlete event csv files too large to load, the csv is read in chunks and never held whole.
+
+    python streaming.py archive.csv                        # summary tables of the archive
+    python streaming.py archive.csv --chunk-size 100000
+    python streaming.py athlete_events.csv --check         # compare against the tables of the loaded frame
+
+The csv is read twice. The first pass hashes the names of every chunk and spills its rows to one temporary file per
+Games. The second pass reads the files back one Games at a time and hands the rows to the aggregators, which keep
+running totals: the medal cube of data_utils.medal_cube, bin counts as from data_utils.histogram_counts and distinct
+counts as from query_backend.nunique.
+
+Rows a table only counts once (a team medal, an athlete per Games) are recognised by the values of their key columns.
+Every such key includes Games, so the seen keys are dropped when the next Games starts. Memory is bounded by
+the chunk size, the rows of the largest Games and the size of the result tables, not by the rows of the file.
+'''
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import data_utils
+import query_backend as qb
+from data_utils import CUBE_DIMENSIONS, MEDAL_KEYS
+from ingest import SCHEMA
+
+DEFAULT_CHUNK_SIZE = 250_000
+
+# The rows are aggregated one value of this column at a time, every key counted once includes it
+PARTITION_COLUMN = "Games"
+
+
+class SeenKeys:
+    '''
+    the key column combinations seen in earlier chunks of the current Games, kept whole so two keys never collide
+    '''
+    def __init__(self, columns) -> None:
+        self.columns = list(columns)
+        if PARTITION_COLUMN not in self.columns:
+            raise ValueError(f"keys counted once must include {PARTITION_COLUMN}, got {self.columns}")
+        self._keys = None
+
+
+    def clear(self):
+        # No key of the Games done so far can appear again
+        self._keys = None
+
+
+    def first(self, chunk: pd.DataFrame) -> np.ndarray:
+        '''
+        returns a mask of the rows of chunk whose keys weren't in any earlier row, and remembers their keys
+        '''
+        keys = chunk[self.columns].reset_index(drop=True)
+        if self._keys is None:
+            first = ~keys.duplicated().to_numpy()
+            self._keys = keys[first]
+            return first
+
+        # Missing values are equal to each other here, like in drop_duplicates
+        seen = len(self._keys)
+        first = ~pd.concat([self._keys, keys], ignore_index=True).duplicated().to_numpy()[seen:]
+        self._keys = pd.concat([self._keys, keys[first]], ignore_index=True)
+        return first
+
+
+    def __len__(self):
+        return len(self._keys) if self._keys is not None else 0
+
+
+def _add(total, counts):
+    # Running totals of two chunks are added group by group, groups only one of them has keep their count
+    if total is None:
+        return counts
+    return total.add(counts, fill_value=0).astype(np.int64)
+
+
+class MedalCube:
+    '''
+    medal cube (data_utils.medal_cube) of every chunk together, team medals are counted once across chunks
+    '''
+    def __init__(self, dimensions=CUBE_DIMENSIONS) -> None:
+        self.dimensions = list(dimensions)
+        self._medals = SeenKeys(MEDAL_KEYS)
+        self._medal_sexes = SeenKeys(MEDAL_KEYS + ["Sex"])
+        self._cube = None
+
+
+    def update(self, chunk: pd.DataFrame):
+        df_medals = chunk[list(dict.fromkeys(self.dimensions + MEDAL_KEYS + ["Sex"]))]
+        df_medals = df_medals.assign(Medal=df_medals["Medal"].fillna("No Medal"))
+
+        # Same rules as medal_events(): Count on the first row of a team medal, SexCount on the first row per sex
+        df_medals = df_medals.assign(Count=self._medals.first(df_medals).astype(np.int64), SexCount=1)
+        df_medals = df_medals[self._medal_sexes.first(df_medals)]
+
+        self._cube = _add(self._cube, df_medals.groupby(self.dimensions)[["Count", "SexCount"]].sum())
+
+
+    def seen_keys(self):
+        return [self._medals, self._medal_sexes]
+
+
+    def result(self) -> pd.DataFrame:
+        if self._cube is None:
+            return pd.DataFrame(columns=self.dimensions + ["Count", "SexCount"])
+        return self._cube.sort_index().reset_index()
+
+
+class BinCounts:
+    '''
+    rows per fixed width bin of value and group of the by columns, the last by column is the one
+    data_utils.histogram_counts splits the bins by. with unique, only the first row per unique key combination counts
+    '''
+    def __init__(self, value, by, bin_size=1, unique=None) -> None:
+        self.value = value
+        self.by = [by] if isinstance(by, str) else list(by)
+        self.bin_size = bin_size
+        self._unique = SeenKeys(unique) if unique else None
+        self._counts = None
+
+
+    def update(self, chunk: pd.DataFrame):
+        if self._unique is not None:
+            chunk = chunk[self._unique.first(chunk)]
+
+        df_values = chunk[self.by + [self.value]].dropna()
+        bins = np.floor(df_values[self.value].to_numpy(dtype=float) / self.bin_size).astype(int)
+        counts = df_values.groupby([df_values[column] for column in self.by] + [pd.Series(bins, index=df_values.index, name="bin")]).size()
+
+        self._counts = _add(self._counts, counts)
+
+
+    def seen_keys(self):
+        return [self._unique] if self._unique is not None else []
+
+
+    def result(self, **selection) -> pd.DataFrame:
+        '''
+        returns the bin counts of the rows with the selected values of the other by columns,
+        laid out like data_utils.histogram_counts
+        '''
+        counts = self._counts if self._counts is not None else pd.Series(dtype=np.int64)
+        for column, value in selection.items():
+            counts = counts[counts.index.get_level_values(column) == value]
+        if counts.empty:
+            return pd.DataFrame()
+
+        counts = counts.groupby(level=[self.by[-1], "bin"]).sum()
+        counts = counts.reset_index().pivot_table(index="bin", columns=self.by[-1], values=counts.name or 0, aggfunc="sum", fill_value=0)
+        counts = counts.reindex(np.arange(counts.index.min(), counts.index.max() + 1), fill_value=0).astype(np.int64)
+        counts.index = counts.index * self.bin_size
+        counts.index.name = None
+        counts.columns = counts.columns.to_numpy()
+
+        return counts
+
+
+class UniqueCounts:
+    '''
+    distinct values of column per group of the by columns, like query_backend.nunique
+    '''
+    def __init__(self, by, column) -> None:
+        self.by = [by] if isinstance(by, str) else list(by)
+        self.column = column
+        self._seen = SeenKeys(self.by + [column])
+        self._counts = None
+
+
+    def update(self, chunk: pd.DataFrame):
+        chunk = chunk[self.by + [self.column]].dropna(subset=[self.column])
+        chunk = chunk[self._seen.first(chunk)]
+
+        self._counts = _add(self._counts, chunk.groupby(self.by)[self.column].size())
+
+
+    def seen_keys(self):
+        return [self._seen]
+
+
+    def result(self, **selection) -> pd.Series:
+        counts = self._counts if self._counts is not None else pd.Series(dtype=np.int64)
+        for column, value in selection.items():
+            counts = counts.xs(value, level=column) if counts.index.nlevels > 1 else counts[counts.index == value]
+
+        return counts.sort_index().rename(self.column)
+
+
+def summary_aggregators():
+    '''
+    the aggregators of the summary tables the figures need, by table name
+    '''
+    return {
+        "medal_cube": MedalCube(),
+        # Sport figures (sport_subplots) count every entry, the distribution figures every athlete once per sport and Games
+        "age_by_sport": BinCounts("Age", ["Sport", "Sex"]),
+        "height_by_sport": BinCounts("Height", ["Sport", "Sex"], unique=["Sport", "Games", "ID"]),
+        "weight_by_sport": BinCounts("Weight", ["Sport", "Sex"], unique=["Sport", "Games", "ID"]),
+        # Country age figure (norwegian_sex_age_distribution), every athlete once per country and Games
+        "age_by_noc": BinCounts("Age", ["NOC", "Sex"], unique=["NOC", "Games", "Hash"]),
+        "participants_by_games": UniqueCounts("Games", "ID"),
+        "participants_by_noc": UniqueCounts(["NOC", "Games", "Sex"], "ID"),
+    }
+
+
+def read_chunks(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    yields the rows of the csv file chunk_size at a time, typed like ingest.SCHEMA and with Name replaced by Hash
+    '''
+    for chunk in pd.read_csv(file_path, dtype=SCHEMA, chunksize=chunk_size):
+        # Digests aren't kept between chunks, a cache of every name would grow with the file
+        yield data_utils.hash_column(chunk, "Name", remember=False)
+
+
+def spill_partitions(file_path, directory, chunk_size=DEFAULT_CHUNK_SIZE) -> list:
+    '''
+    writes the rows of every PARTITION_COLUMN value of the csv file to a file of its own in directory, one pickled
+    frame per chunk the value appears in. returns the file paths in order of first appearance
+    '''
+    paths = {}
+    for chunk in read_chunks(file_path, chunk_size):
+        for value, rows in chunk.groupby(PARTITION_COLUMN, sort=False, dropna=False):
+            path = paths.setdefault(value, os.path.join(directory, f"{len(paths)}.pkl"))
+            with open(path, "ab") as file:
+                pickle.dump(rows, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return list(paths.values())
+
+
+def read_partition(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    yields the rows spilled to path by spill_partitions, joined into chunks of about chunk_size rows
+    '''
+    pending, rows = [], 0
+    with open(path, "rb") as file:
+        while True:
+            try:
+                part = pickle.load(file)
+            except EOFError:
+                break
+            pending.append(part)
+            rows += len(part)
+            if rows >= chunk_size:
+                yield pd.concat(pending)
+                pending, rows = [], 0
+
+    if pending:
+        yield pd.concat(pending)
+
+
+def aggregate(file_path, aggregators, chunk_size=DEFAULT_CHUNK_SIZE, spill_dir=None):
+    '''
+    feeds the rows of the csv file to the aggregators one Games at a time and returns them.
+    the rows are spilled to a temporary directory in spill_dir (the system default if None), deleted afterwards
+    '''
+    with tempfile.TemporaryDirectory(dir=spill_dir, prefix="streaming-") as directory:
+        for path in spill_partitions(file_path, directory, chunk_size):
+            for aggregator in aggregators.values():
+                for seen in aggregator.seen_keys():
+                    seen.clear()
+
+            for chunk in read_partition(path, chunk_size):
+                for aggregator in aggregators.values():
+                    aggregator.update(chunk)
+            os.remove(path)
+
+    return aggregators
+
+
+def check(file_path, aggregators):
+    '''
+    returns the tables that differ from the ones computed on the whole loaded frame
+    '''
+    df = data_utils.read_athlete_events(file_path, use_cache=False)
+    nor = df[df["NOC"] == "NOR"]
+    football = df[df["Sport"] == "Football"]
+
+    def plain(table):
+        # The loaded frame has categorical keys, the streamed tables plain ones
+        table = table.reset_index() if isinstance(table, pd.Series) else table
+        return table.astype({column: object for column, dtype in table.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)})
+
+    expected = {
+        "medal_cube": (data_utils.medal_cube(df), aggregators["medal_cube"].result()),
+        "age_by_sport": (data_utils.histogram_counts(football, "Age", "Sex"), aggregators["age_by_sport"].result(Sport="Football")),
+        "height_by_sport": (
+            data_utils.histogram_counts(qb.drop_duplicates(football, ["Sport", "Games", "ID"]), "Height", "Sex"),
+            aggregators["height_by_sport"].result(Sport="Football"),
+        ),
+        "weight_by_sport": (
+            data_utils.histogram_counts(qb.drop_duplicates(football, ["Sport", "Games", "ID"]), "Weight", "Sex"),
+            aggregators["weight_by_sport"].result(Sport="Football"),
+        ),
+        "age_by_noc": (data_utils.histogram_counts(qb.drop_duplicates(nor, ["Games", "Hash"]), "Age", "Sex"), aggregators["age_by_noc"].result(NOC="NOR")),
+        "participants_by_games": (qb.nunique(df, "Games", "ID"), aggregators["participants_by_games"].result()),
+        "participants_by_noc": (qb.nunique(nor, ["Games", "Sex"], "ID"), aggregators["participants_by_noc"].result(NOC="NOR")),
+    }
+
+    differing = []
+    for name, (table, streamed) in expected.items():
+        try:
+            pd.testing.assert_frame_equal(plain(table), plain(streamed), check_dtype=False, check_names=False, check_index_type=False, check_column_type=False)
+        except AssertionError as error:
+            differing.append(f"{name}: {error}")
+
+    return differing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate an athlete events csv in chunks with bounded memory")
+    parser.add_argument("csv", help="athlete events csv file")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows read at a time")
+    parser.add_argument("--spill-dir", help="directory for the temporary per-Games files, the system default if not set")
+    parser.add_argument("--check", action="store_true", help="compare the tables against the whole frame, loads it after aggregating")
+    args = parser.parse_args(argv)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    aggregators = aggregate(args.csv, summary_aggregators(), args.chunk_size, args.spill_dir)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f"Aggregated {args.csv} in {seconds:.1f} s, peak memory {peak / 2**20:.1f} MB with chunks of {args.chunk_size} rows")
+    for name, aggregator in aggregators.items():
+        table = aggregator.result() if not isinstance(aggregator, BinCounts) else aggregator._counts
+        print(f"    {name:<24} {len(table) if table is not None else 0} rows")
+
+    if args.check:
+        differing = check(args.csv, aggregators)
+        for difference in differing:
+            print("DIFFERS", difference)
+        if differing:
+            return 1
+        print("Every table matches the loaded frame")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
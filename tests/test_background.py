@@ -0,0 +1,136 @@
+'''
+The JobManager of background.py overrides methods of dash.DiskcacheManager that aren't public API. These tests run
+a background callback through the installed Dash to check that the overrides still fit it.
+
+    python -m pytest tests/test_background.py
+'''
+import os
+import time
+import dash
+import pytest
+from dash import Input, Output, dcc, html
+
+pytest.importorskip("diskcache")
+pytest.importorskip("multiprocess")
+psutil = pytest.importorskip("psutil")
+
+import background
+
+# Seconds a test waits for a job before failing
+TIMEOUT = 30
+
+
+@pytest.fixture
+def gate(tmp_path):
+    '''
+    file the jobs wait for before they return, created by opening the gate
+    '''
+    path = tmp_path / "open"
+
+    def open_gate():
+        path.touch()
+
+    open_gate.path = str(path)
+    return open_gate
+
+
+@pytest.fixture
+def app(tmp_path, gate):
+    manager = background.make_manager(str(tmp_path / "jobs"), workers=1)
+    app = dash.Dash(__name__, background_callback_manager=manager)
+    app.layout = html.Div([dcc.Input(id="value"), html.Div(id="result"), html.Div(id="progress")])
+
+    @app.callback(Output("result", "children"), Input("value", "value"), background=True, progress=Output("progress", "children"))
+    def build(set_progress, value):
+        set_progress(f"building {value}")
+        while not os.path.exists(gate.path):
+            time.sleep(0.01)
+        return f"built {value}"
+
+    app.manager = manager
+    yield app
+
+    # The pool workers poll the queue forever
+    for child in psutil.Process().children(recursive=True):
+        child.kill()
+
+
+def body(value):
+    return {
+        "output": "result.children", "outputs": {"id": "result", "property": "children"},
+        "inputs": [{"id": "value", "property": "value", "value": value}], "changedPropIds": ["value.value"], "state": [],
+    }
+
+
+def start(client, value):
+    return client.post("/_dash-update-component", json=body(value)).get_json()
+
+
+def poll(client, value, job):
+    return client.post(f"/_dash-update-component?cacheKey={job['cacheKey']}&job={job['job']}", json=body(value)).get_json()
+
+
+def wait_for(condition):
+    deadline = time.time() + TIMEOUT
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_callers_share_a_job(app, gate):
+    client = app.server.test_client()
+    first, second, other = start(client, "a"), start(client, "a"), start(client, "b")
+
+    assert first["job"] == second["job"]
+    assert first["job"] != other["job"]
+
+    # Every caller sees the progress of the shared job until the result is read
+    wait_for(lambda: "progress" in poll(client, "a", first))
+    assert poll(client, "a", first)["progress"] == poll(client, "a", second)["progress"]
+    assert poll(client, "a", second)["progress"] == {"progress.children": "building a"}
+
+    gate()
+    wait_for(lambda: "response" in poll(client, "a", first))
+    assert poll(client, "a", second)["response"] == {"result": {"children": "built a"}}
+
+
+def test_cached_result_is_not_built_again(app, gate):
+    client = app.server.test_client()
+    gate()
+    job = start(client, "a")
+    wait_for(lambda: "response" in poll(client, "a", job))
+
+    again = start(client, "a")
+    assert not app.manager.job_running(again["job"])
+    assert poll(client, "a", again)["response"] == {"result": {"children": "built a"}}
+
+
+def test_job_is_dropped_with_its_last_caller(app):
+    client = app.server.test_client()
+    first, second = start(client, "a"), start(client, "a")
+    wait_for(lambda: "progress" in poll(client, "a", first))
+
+    app.manager.terminate_job(first["job"])
+    assert app.manager.job_running(second["job"])
+
+    app.manager.terminate_job(second["job"])
+    wait_for(lambda: not app.manager.job_running(second["job"]))
+
+    # The slot of the killed worker is taken by a new one
+    assert start(client, "b")["job"] != first["job"]
+    wait_for(lambda: app.manager.stats()["running"] == 1)
+
+
+def test_pool_has_a_fixed_size(app, gate):
+    client = app.server.test_client()
+    jobs = {value: start(client, value) for value in "abcd"}
+    wait_for(lambda: app.manager.stats()["running"] == 1)
+
+    workers = [child for child in psutil.Process().children() if child.status() != psutil.STATUS_ZOMBIE]
+    assert len(workers) == 1
+    assert sum(app.manager.job_running(job["job"]) for job in jobs.values()) == len(jobs)
+
+    gate()
+    for value, job in jobs.items():
+        wait_for(lambda: "response" in poll(client, value, job))
+        assert poll(client, value, job)["response"] == {"result": {"children": f"built {value}"}}
@@ -0,0 +1,122 @@
+'''
+Parity of the query backends (query_backend.py): every operation must give the same result on the duckdb backend as on
+the pandas backend, on frames in the compact schema of read_athlete_events and with plain object columns.
+
+    python -m pytest tests
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_utils
+import query_backend as qb
+
+pytest.importorskip("duckdb")
+
+NAN = np.nan
+
+ROWS = [
+    # ID, Sex, Age, Weight, NOC, Games, Season, Sport, Event, Team, Medal
+    (1, "M", 24.0, 80.0, "NOR", "1994 Winter", "Winter", "Biathlon", "Biathlon 20 km", "Norway", "Gold"),
+    (1, "M", 28.0, 81.0, "NOR", "1998 Winter", "Winter", "Biathlon", "Biathlon 20 km", "Norway", None),
+    (2, "F", NAN, NAN, "NOR", "1994 Winter", "Winter", "Biathlon", "Biathlon 15 km", "Norway", "Silver"),
+    (3, "F", 19.0, 52.0, "SWE", "1996 Summer", "Summer", "Gymnastics", "Gymnastics Floor", "Sweden", None),
+    (3, "F", 19.0, 52.0, "SWE", "1996 Summer", "Summer", "Gymnastics", "Gymnastics Vault", "Sweden", "Bronze"),
+    (4, "M", 31.0, NAN, "USA", "1996 Summer", "Summer", "Shooting", "Shooting Trap", "United States", "Gold"),
+    (5, "M", 22.0, 90.0, "USA", "1996 Summer", "Summer", "Football", "Football Men's Football", "United States", "Gold"),
+    (6, "M", 23.0, 88.0, "USA", "1996 Summer", "Summer", "Football", "Football Men's Football", "United States", "Gold"),
+    (7, "F", 27.0, 60.0, None, "1998 Winter", "Winter", "Curling", "Curling Women's Curling", "Canada", "Gold"),
+    (8, "F", 26.0, 61.0, "CAN", None, "Winter", "Curling", "Curling Women's Curling", "Canada", None),
+]
+
+COLUMNS = ["ID", "Sex", "Age", "Weight", "NOC", "Games", "Season", "Sport", "Event", "Team", "Medal"]
+
+BACKENDS = [qb.PandasBackend(), qb.DuckDBBackend()]
+
+# Every operation the dashboard runs through query_backend, with missing keys, missing values and empty results
+OPERATIONS = {
+    "select_sport": lambda backend, df: backend.select(df, Sport="Biathlon"),
+    "select_sports": lambda backend, df: backend.select(df, Sport=["Gymnastics", "Shooting", "Speed Skating"]),
+    "select_noc_season": lambda backend, df: backend.select(df, NOC="NOR", Season="Winter"),
+    "select_sex": lambda backend, df: backend.select(df, Sex="F"),
+    "select_nothing": lambda backend, df: backend.select(df, NOC="ZZZ"),
+    "select_no_values": lambda backend, df: backend.select(df, Sport=[]),
+    "select_disjoint": lambda backend, df: backend.select(df, NOC="NOR", Season="Summer"),
+    "first_rows_medal_keys": lambda backend, df: backend.first_rows(df, data_utils.MEDAL_KEYS),
+    "first_rows_missing_games": lambda backend, df: backend.first_rows(df, ["Games", "ID"]),
+    "drop_duplicates_sport_games_id": lambda backend, df: backend.drop_duplicates(df, ["Sport", "Games", "ID"]),
+    "drop_duplicates_one_column": lambda backend, df: backend.drop_duplicates(df, "NOC"),
+    "count_sex": lambda backend, df: backend.count(df, "Sex"),
+    "count_noc": lambda backend, df: backend.count(df, "NOC"),
+    "count_games_sex": lambda backend, df: backend.count(df, ["Games", "Sex"]),
+    "count_medals": lambda backend, df: backend.count(df, ["NOC", "Sport"], "Medal"),
+    "count_ages": lambda backend, df: backend.count(df, "Sex", "Age"),
+    "nunique_games_id": lambda backend, df: backend.nunique(df, "Games", "ID"),
+    "nunique_weight": lambda backend, df: backend.nunique(df, "Sex", "Weight"),
+    "sum_ids": lambda backend, df: backend.sum(df, "NOC", ["ID"]),
+    "sum_with_missing": lambda backend, df: backend.sum(df, ["Season", "Sex"], ["Age", "Weight"]),
+}
+
+
+def plain_frame():
+    return pd.DataFrame(ROWS, columns=COLUMNS)
+
+
+FRAMES = {
+    "compact": lambda: data_utils.compact_frame(plain_frame()),
+    "plain": plain_frame,
+    "compact_empty": lambda: data_utils.compact_frame(plain_frame()).iloc[:0],
+    "compact_no_medals": lambda: data_utils.compact_frame(plain_frame()[plain_frame()["Medal"].isna()]),
+}
+
+
+def assert_identical(expected, result):
+    if isinstance(expected, pd.DataFrame):
+        pd.testing.assert_frame_equal(result, expected, check_exact=True)
+    elif isinstance(expected, pd.Series):
+        pd.testing.assert_series_equal(result, expected, check_exact=True)
+    else:
+        np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("frame", list(FRAMES))
+@pytest.mark.parametrize("operation", list(OPERATIONS))
+def test_duckdb_matches_pandas(operation, frame):
+    df = FRAMES[frame]()
+    expected, result = (OPERATIONS[operation](backend, df) for backend in BACKENDS)
+
+    assert_identical(expected, result)
+
+
+def test_selection_keeps_rows_in_frame_order():
+    df = data_utils.compact_frame(plain_frame()).iloc[::-1]
+
+    for backend in BACKENDS:
+        assert backend.select(df, Sex="F").index.tolist() == [9, 8, 4, 3, 2]
+
+
+def test_missing_keys_are_left_out_of_groups():
+    df = data_utils.compact_frame(plain_frame())
+
+    for backend in BACKENDS:
+        counts = backend.count(df, "NOC")
+        assert counts.index.tolist() == ["CAN", "NOR", "SWE", "USA"]
+        assert counts.tolist() == [1, 3, 2, 3]
+
+
+def test_medal_cube_matches():
+    df = data_utils.compact_frame(plain_frame())
+    cubes = []
+    for backend in BACKENDS:
+        previous, qb._backend = qb._backend, backend
+        try:
+            cubes.append(data_utils.medal_cube(df))
+        finally:
+            qb._backend = previous
+
+    assert_identical(*cubes)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        qb.make_backend("sqlite")
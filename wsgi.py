@@ -0,0 +1,44 @@
+import sys
+import config
+import dataset
+import metrics
+from figure_cache import build_sport_update, warm_up
+from main import app, country_views, layout, snapshot, sport_figure_cache, unsnapshotted_sports
+from country_views import popular_countries
+from figure_scheduler import FigureScheduler
+
+# Production entry point, run with: gunicorn -c gunicorn.conf.py
+# With config.PRELOAD this module is imported once in the gunicorn master and every worker is forked from it,
+# so the frame, its indexes, the medal cube and the built tabs are in memory once and shared by all workers.
+# Numeric columns are memory-mapped from the athlete cache and shared through the page cache either way.
+
+server = app.server
+
+# With a current figure snapshot (figure_snapshot.py --sports) the tabs and sport figures come from it
+# and the data set isn't loaded at startup at all
+if snapshot is None or unsnapshotted_sports() or config.CLIENTSIDE_SPORTS:
+    dataset.preload()
+
+# The figures the snapshot doesn't have are built in parallel
+figure_scheduler = FigureScheduler(config.FIGURE_BUILD_MODE, config.FIGURE_BUILD_WORKERS)
+layout.build_tabs(figure_scheduler)
+if figure_scheduler.timings:
+    print(figure_scheduler.report(), file=sys.stderr)
+
+metrics.register_collector(
+    "startup_figure_build_seconds", "Time each tab figure took to build at startup", "gauge",
+    lambda: {(name,): seconds for name, seconds in figure_scheduler.timings.items()}, labels=["figure"],
+)
+
+if config.WARM_FIGURE_CACHE and unsnapshotted_sports():
+    warm_up_thread = warm_up(sport_figure_cache, build_sport_update, unsnapshotted_sports())
+
+    # Threads don't survive a fork, the master finishes the warm-up before any worker is started
+    if config.PRELOAD:
+        warm_up_thread.join()
+
+if config.COUNTRY_PREWARM:
+    # Built by the master so the workers inherit them, its pool is shut down before they are forked
+    country_views.warm_up(popular_countries(config.COUNTRY_PREWARM), wait=config.PRELOAD)
+    if config.PRELOAD:
+        country_views.shutdown()